@@ -0,0 +1,220 @@
+import os
+import random
+import re
+import select
+import threading
+import tty
+from collections import Counter
+from time import perf_counter, sleep
+from typing import Optional, List
+
+from switchbot.bot.serial_protocol import REPORT_START_BYTE, MACRO_START_BYTE, MACRO_HEADER_STRUCT, \
+    MACRO_STEP_STRUCT, ControllerReport, checksum
+
+REPORT_SIZE = 10
+# The text commands of controller/serial-protocol.md.
+_BUTTON = r'(?:A|B|X|Y|L|R|ZL|ZR|M|P|H|C|DL|DR|DU|DD)'
+TEXT_COMMAND_PATTERN = re.compile(rf'(?:[THR]{_BUTTON}|V|P|Q|K[01])')
+# What the firmware's strtod accepts as a stick axis. It converts nothing and leaves 0 if there is no number, which
+# still counts as valid as long as the separator or the end of the command follows.
+_AXIS = r'(?:\s*[+-]?(?:(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?|(?i:inf(?:inity)?|nan)))?'
+STICK_COMMAND_PATTERN = re.compile(rf'S[LR]({_AXIS}),({_AXIS})')
+SEQUENCED_COMMAND_PATTERN = re.compile(r'#(\d+)(.*)')
+# Bits per byte with 8N1: start bit, 8 data bits and a stop bit.
+BITS_PER_BYTE = 10
+
+
+class FakeController:
+    """
+    Stands in for the controller's firmware behind a pseudo terminal, so SerialConnector can connect to it like to
+    a real serial port.
+
+    Parses everything written to it according to the serial protocol and records when each command was received.
+    Commands take no time to execute, unlike on the firmware where taps block for PRESS_DELAY_MILLIS.
+    """
+
+    def __init__(self,
+                 firmware_version: int = 2,
+                 baud_rate: Optional[int] = None,
+                 print_diagnostics: bool = True,
+                 loss_rate: float = 0.0):
+        """
+        :param firmware_version: The version reported in response to the V command.
+        :param baud_rate: Simulates how long receiving each byte takes on a real serial line, or None to receive
+        as fast as the pseudo terminal allows.
+        :param print_diagnostics: Whether to print the same diagnostics lines as the firmware for every command.
+        :param loss_rate: The fraction of sequenced commands and reports to ignore, as if they got lost on the way.
+        """
+        self.firmware_version: int = firmware_version
+        self.baud_rate: Optional[int] = baud_rate
+        self.print_diagnostics: bool = print_diagnostics
+        self.loss_rate: float = loss_rate
+        self.is_ack_mode_enabled: bool = False
+        self.expected_sequence: int = 0
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._master)
+        self.port: str = os.ttyname(self._slave)
+        self._running: threading.Event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._received_condition: threading.Condition = threading.Condition()
+        # Value of time.perf_counter() at which each valid command was fully received.
+        self.receive_times: List[float] = []
+        self.command_types: Counter = Counter()
+        self.invalid_commands: int = 0
+        self._text: bytearray = bytearray()
+        self._binary: bytearray = bytearray()
+
+    def start(self) -> None:
+        self._running.set()
+        self._thread = threading.Thread(target=self._read, name='FakeController', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._running.clear()
+        if self._thread is not None:
+            self._thread.join(timeout=2.0)
+        self._thread = None
+        os.close(self._master)
+        os.close(self._slave)
+
+    def reset(self) -> None:
+        with self._received_condition:
+            self.receive_times = []
+            self.command_types.clear()
+            self.invalid_commands = 0
+
+    def wait_for_commands(self, count: int, timeout: float) -> bool:
+        """
+        Waits until at least count valid commands were received since the last reset.
+        """
+        with self._received_condition:
+            return self._received_condition.wait_for(lambda: len(self.receive_times) >= count, timeout)
+
+    def _read(self) -> None:
+        while self._running.is_set():
+            readable, _, _ = select.select([self._master], [], [], 0.1)
+            if not readable:
+                continue
+            try:
+                data = os.read(self._master, 4096)
+            except OSError:
+                break
+            if self.baud_rate is not None:
+                sleep(len(data) * BITS_PER_BYTE / self.baud_rate)
+            for value in data:
+                self._receive_byte(value)
+
+    def _receive_byte(self, value: int) -> None:
+        # Same framing as the firmware: binary data can only start at the beginning of a line.
+        if self._binary:
+            self._binary.append(value)
+            self._receive_binary()
+            return
+        if not self._text and value in (REPORT_START_BYTE, MACRO_START_BYTE):
+            self._binary.append(value)
+            return
+
+        if value != ord('\n'):
+            self._text.append(value)
+            return
+        command = self._text.decode('ascii', errors='replace')
+        self._text.clear()
+        if not command:
+            return
+        sequenced = SEQUENCED_COMMAND_PATTERN.fullmatch(command)
+        if sequenced is not None:
+            if self._accept_sequence(int(sequenced.group(1))):
+                valid = self._is_valid_command(sequenced.group(2))
+                self._record(self._command_type(sequenced.group(2)) if valid else None)
+                self._respond(f'{"K" if valid else "N"}{sequenced.group(1)}')
+            return
+        if not self._is_valid_command(command):
+            self._record(None)
+            self._respond('CommandExecutor ignored invalid command.')
+            return
+
+        self._record(self._command_type(command))
+        if self.print_diagnostics:
+            self._respond(f'Executing command: {command}')
+            self._respond('Command was valid.')
+        if command == 'V':
+            self._respond(f'SwitchBot controller version {self.firmware_version}')
+        elif command[0] == 'K':
+            self.is_ack_mode_enabled = command == 'K1'
+            self.expected_sequence = 0
+            if self.is_ack_mode_enabled and self.firmware_version >= 5:
+                self._respond('K1 OK')
+
+    def _accept_sequence(self, sequence: int) -> bool:
+        """
+        Decides whether to execute a sequenced command or report the same way as the firmware does in ack mode.
+        """
+        if not self.is_ack_mode_enabled or random.random() < self.loss_rate:
+            return False
+        difference = ((sequence - self.expected_sequence + 128) & 0xFF) - 128
+        if difference < 0:
+            self._respond(f'K{(self.expected_sequence - 1) & 0xFF}')
+            return False
+        if difference > 0:
+            if self.firmware_version >= 5:
+                self._respond(f'K{(self.expected_sequence - 1) & 0xFF}')
+            return False
+        self.expected_sequence = (self.expected_sequence + 1) & 0xFF
+        return True
+
+    @staticmethod
+    def _is_valid_command(command: str) -> bool:
+        if TEXT_COMMAND_PATTERN.fullmatch(command) is not None:
+            return True
+        stick = STICK_COMMAND_PATTERN.fullmatch(command)
+        if stick is None:
+            return False
+        # Same range check as the firmware, which NaN passes as well.
+        return all(not abs(float(axis or 0)) > 1.0 for axis in stick.groups())
+
+    @staticmethod
+    def _command_type(command: str) -> str:
+        return command[0] if command[0] != 'S' else command[:2]
+
+    def _receive_binary(self) -> None:
+        data = bytes(self._binary)
+        if data[0] == REPORT_START_BYTE:
+            if len(data) < REPORT_SIZE:
+                return
+            self._binary.clear()
+            try:
+                ControllerReport.from_bytes(data)
+            except ValueError:
+                self._record(None)
+                return
+            if not self.is_ack_mode_enabled:
+                self._record('report')
+            elif self._accept_sequence(data[1]):
+                self._record('report')
+                self._respond(f'K{data[1]}')
+            return
+
+        if len(data) < MACRO_HEADER_STRUCT.size:
+            return
+        size = MACRO_HEADER_STRUCT.size + data[1] * MACRO_STEP_STRUCT.size + 1
+        if len(data) < size:
+            return
+        self._binary.clear()
+        if data[1] == 0 or checksum(data[:-1]) != data[-1]:
+            self._record(None)
+            self._respond('Macro rejected')
+        else:
+            self._record('macro')
+            self._respond(f'Macro stored: {data[1]}')
+
+    def _record(self, command_type: Optional[str]) -> None:
+        with self._received_condition:
+            if command_type is None:
+                self.invalid_commands += 1
+            else:
+                self.receive_times.append(perf_counter())
+                self.command_types[command_type] += 1
+            self._received_condition.notify_all()
+
+    def _respond(self, line: str) -> None:
+        os.write(self._master, f'{line}\r\n'.encode('ascii'))
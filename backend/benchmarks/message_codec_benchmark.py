@@ -0,0 +1,109 @@
+"""
+Compares serializing messages with dataclasses_json to the compiled encoders of message_codec.
+
+Run from the backend directory:
+    python -m benchmarks.message_codec_benchmark
+"""
+import argparse
+import json
+from base64 import b64encode
+from dataclasses import dataclass
+from time import perf_counter
+from typing import Callable, List, Dict, Any
+
+from switchbot.program.dialog import Dialog
+from switchbot.program.option import SelectionOption, IntOption, BoolOption
+from switchbot.program.program import ProgramMetadata
+from switchbot.server import message_codec
+from switchbot.server.messages.current_program_message import CurrentProgramMessage
+from switchbot.server.messages.result_message import ResultMessage
+from switchbot.server.messages.show_dialog_message import ShowDialogMessage
+from switchbot.server.messages.start_program_message import StartProgramMessage
+from switchbot.server.messages.video_frame_message import VideoFrameMessage
+
+OPTIONS = [
+    SelectionOption(name='Mode', description='What to do.', choices=frozenset({'Fast', 'Safe'})),
+    IntOption(name='Attempts', description='How often to try.', default_value=10, min_value=1, max_value=100),
+    BoolOption(name='Notify', description='Whether to show a dialog when done.', default_value=True),
+]
+
+
+@dataclass
+class Case:
+    name: str
+    message: Any
+    # Only for messages received from clients.
+    decode: bool = False
+
+
+CASES: List[Case] = [
+    # Roughly the size of a 640x360 JPEG frame.
+    Case('video_frame', VideoFrameMessage(image=b64encode(bytes(40_000)).decode())),
+    Case('result', ResultMessage(success=False, error_message='No program with name Test found')),
+    Case('current_program', CurrentProgramMessage(
+        metadata=ProgramMetadata(options=OPTIONS, name='Test', description='A program for benchmarking.'),
+        option_values={'Mode': 'Fast', 'Attempts': 10, 'Notify': True})),
+    Case('show_dialog', ShowDialogMessage(dialog=Dialog(title='Done', content='Found it!', buttons=['OK', 'Again']))),
+    Case('start_program', StartProgramMessage(program_name='Test', option_values={'Mode': 'Fast', 'Attempts': 10}),
+         decode=True),
+]
+
+
+def measure(function: Callable[[], Any], iterations: int) -> float:
+    """
+    :return: The mean time of a call in microseconds.
+    """
+    start_time = perf_counter()
+    for _ in range(iterations):
+        function()
+    return (perf_counter() - start_time) / iterations * 1_000_000.0
+
+
+def run_case(case: Case, iterations: int) -> Dict[str, float]:
+    message = case.message
+    message_type = type(message)
+    # The encoded output must not change, or clients would break.
+    if message_codec.encode(message) != message_type.to_dict(message):
+        raise Exception(f'Encoded {case.name} differs from dataclasses_json')
+
+    result = {
+        'dataclasses_json_us': measure(lambda: message_type.to_dict(message), iterations),
+        'codec_us': measure(lambda: message_codec.encode(message), iterations),
+        'json_bytes': len(json.dumps(message_codec.encode(message))),
+    }
+    if message_codec.msgpack is not None:
+        result['msgpack_us'] = measure(lambda: message_codec.encode_msgpack(message), iterations)
+        result['msgpack_bytes'] = len(message_codec.encode_msgpack(message))
+    if case.decode:
+        data = message_type.to_dict(message)
+        result['dataclasses_json_decode_us'] = measure(lambda: message_type.from_dict(data), iterations)
+        result['codec_decode_us'] = measure(lambda: message_codec.decode(message_type, data), iterations)
+    return result
+
+
+def print_results(results: Dict[str, Dict[str, float]]) -> None:
+    columns = ['dataclasses_json_us', 'codec_us', 'msgpack_us', 'json_bytes', 'msgpack_bytes',
+               'dataclasses_json_decode_us', 'codec_decode_us']
+    print(f'{"message":<18}' + ''.join(f'{column:>28}' for column in columns))
+    for name, result in results.items():
+        print(f'{name:<18}' + ''.join(f'{result.get(column, float("nan")):>28.2f}' for column in columns))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Benchmarks serializing messages sent to clients.')
+    parser.add_argument('-n', '--iterations', help='The number of times each message is serialized.',
+                        default=20000, type=int)
+    parser.add_argument('--json', help='Also write the results to this file to compare them later.', default=None)
+    args = parser.parse_args()
+
+    if message_codec.msgpack is None:
+        print('The msgpack package is not installed, skipping MessagePack.')
+    results = {case.name: run_case(case, args.iterations) for case in CASES}
+    print_results(results)
+    if args.json is not None:
+        with open(args.json, 'w', encoding='utf-8') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
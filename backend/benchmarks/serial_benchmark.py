@@ -0,0 +1,156 @@
+"""
+Measures the throughput and latency of SerialConnector against a fake controller on a pseudo terminal.
+
+Run from the backend directory on Linux or macOS:
+    python -m benchmarks.serial_benchmark
+"""
+import argparse
+import asyncio
+import json
+import math
+from dataclasses import dataclass
+from time import perf_counter
+from typing import Callable, Optional, List, Dict
+
+from switchbot.bot.serial_connector import SerialConnector
+from switchbot.bot.serial_writer import BackpressurePolicy
+from .fake_controller import FakeController
+
+
+@dataclass
+class Scenario:
+    name: str
+    # The firmware version the fake controller reports, which decides the protocol SerialConnector uses.
+    firmware_version: int
+    # Sends the i-th command and returns the future of the write. Every call must result in exactly one command.
+    send: Callable[[SerialConnector, int], asyncio.Future]
+    # Whether to wait for each command to be written before sending the next one.
+    sequential: bool = False
+    # The number of unacknowledged commands in flight, or 0 to not use acknowledgements.
+    ack_window: int = 0
+
+
+SCENARIOS: List[Scenario] = [
+    Scenario('tap', 1, lambda serial, i: serial.write_command('TA')),
+    Scenario('hold_release', 1, lambda serial, i: serial.write_command('HA' if i % 2 == 0 else 'RA')),
+    Scenario('stick', 1, lambda serial, i: serial.write_command(f'SL{(i % 200 - 100) / 100:0.2f},0.00')),
+    Scenario('state_flush', 1, lambda serial, i: serial.hold('A') if i % 2 == 0 else serial.release('A')),
+    Scenario('report', 2, lambda serial, i: serial.hold('A') if i % 2 == 0 else serial.release('A')),
+    Scenario('tap_sequential', 1, lambda serial, i: serial.write_command('TA'), sequential=True),
+    Scenario('tap_acked', 5, lambda serial, i: serial.write_command('TA'), ack_window=8),
+    Scenario('report_acked', 5, lambda serial, i: serial.hold('A') if i % 2 == 0 else serial.release('A'),
+             ack_window=8),
+    Scenario('tap_acked_sequential', 5, lambda serial, i: serial.write_command('TA'), sequential=True,
+             ack_window=8),
+]
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    """
+    :return: The nearest-rank percentile of the already sorted values.
+    """
+    if not sorted_values:
+        return math.nan
+    index = max(0, math.ceil(fraction * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+
+async def run_scenario(scenario: Scenario,
+                       count: int,
+                       rate: Optional[float],
+                       baud_rate: Optional[int],
+                       print_diagnostics: bool,
+                       loss_rate: float) -> Dict[str, float]:
+    # Only commands with acknowledgements are sent again, so others must not get lost.
+    controller = FakeController(scenario.firmware_version, baud_rate, print_diagnostics,
+                                loss_rate if scenario.ack_window > 0 else 0.0)
+    controller.start()
+    # Block instead of dropping or coalescing so that every command arrives and can be matched to its enqueue time.
+    serial = SerialConnector(max_queue_size=count, backpressure=BackpressurePolicy.BLOCK,
+                             ack_window=scenario.ack_window, ack_timeout=0.05)
+    try:
+        serial.connect(controller.port)
+        # Acknowledgements are enabled with a command of its own, which must not be counted.
+        while scenario.ack_window > 0 and not controller.is_ack_mode_enabled:
+            await asyncio.sleep(0.001)
+        controller.reset()
+
+        enqueue_times: List[float] = []
+        enqueue_costs: List[float] = []
+        futures: List[asyncio.Future] = []
+        start_time = perf_counter()
+        for i in range(count):
+            if rate is not None:
+                delay = start_time + i / rate - perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            enqueue_time = perf_counter()
+            future = scenario.send(serial, i)
+            enqueue_costs.append(perf_counter() - enqueue_time)
+            enqueue_times.append(enqueue_time)
+            futures.append(future)
+            if scenario.sequential:
+                await future
+        written = await asyncio.gather(*futures)
+
+        loop = asyncio.get_event_loop()
+        complete = await loop.run_in_executor(None, controller.wait_for_commands, count, 10.0)
+        if not complete:
+            raise Exception(f'Fake controller only received {len(controller.receive_times)} of {count} commands')
+
+        latencies = sorted(received - enqueued for received, enqueued in zip(controller.receive_times, enqueue_times))
+        duration = controller.receive_times[count - 1] - start_time
+        statistics = serial.statistics()
+        return {
+            'commands_per_second': count / duration,
+            'latency_p50_ms': percentile(latencies, 0.5) * 1000.0,
+            'latency_p99_ms': percentile(latencies, 0.99) * 1000.0,
+            'latency_max_ms': latencies[-1] * 1000.0,
+            'enqueue_cost_us': sum(enqueue_costs) / count * 1_000_000.0,
+            'not_written': written.count(False),
+            'dropped': statistics['writer'].get('dropped', 0),
+            'retransmitted': statistics['acks'].get('retransmitted', 0),
+            'invalid': controller.invalid_commands,
+        }
+    finally:
+        serial.disconnect()
+        controller.stop()
+
+
+def print_results(results: Dict[str, Dict[str, float]]) -> None:
+    columns = ['commands_per_second', 'latency_p50_ms', 'latency_p99_ms', 'latency_max_ms', 'enqueue_cost_us',
+               'dropped', 'retransmitted', 'invalid']
+    print(f'{"scenario":<22}' + ''.join(f'{column:>22}' for column in columns))
+    for name, result in results.items():
+        print(f'{name:<22}' + ''.join(f'{result[column]:>22.2f}' for column in columns))
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description='Benchmarks SerialConnector against a fake controller.')
+    parser.add_argument('-n', '--count', help='The number of commands per scenario.', default=5000, type=int)
+    parser.add_argument('-r', '--rate', help='Commands per second to send, sends as fast as possible if not set.',
+                        default=None, type=float)
+    parser.add_argument('-b', '--baud-rate', help='Simulates the transfer time of a real serial line.',
+                        default=None, type=int)
+    parser.add_argument('-s', '--scenario', help='Only run the scenarios with these names.', action='append',
+                        choices=[scenario.name for scenario in SCENARIOS])
+    parser.add_argument('--no-diagnostics', help='Do not print the firmware\'s diagnostics lines for commands.',
+                        action='store_true')
+    parser.add_argument('-l', '--loss-rate', help='The fraction of acknowledged commands the fake controller loses.',
+                        default=0.0, type=float)
+    parser.add_argument('--json', help='Also write the results to this file to compare them later.', default=None)
+    args = parser.parse_args()
+
+    results: Dict[str, Dict[str, float]] = {}
+    for scenario in SCENARIOS:
+        if args.scenario is None or scenario.name in args.scenario:
+            results[scenario.name] = await run_scenario(scenario, args.count, args.rate, args.baud_rate,
+                                                        not args.no_diagnostics, args.loss_rate)
+    print_results(results)
+    if args.json is not None:
+        with open(args.json, 'w', encoding='utf-8') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -3,22 +3,51 @@ import logging
 import socketio
 from aiohttp import web
 import argparse
+from pathlib import Path
 
-from switchbot.server.server import Server
+from switchbot.bot.serial_connector import OutagePolicy
+from switchbot.server.server import Server, LOG_STORE_PATH
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('-s', '--host', help='The to serve on.', default=None)
     parser.add_argument('-p', '--port', help='The port to serve on.', default=8765, type=int)
+    parser.add_argument('--encoder-threads', help='The number of threads used for encoding video frames.',
+                        default=2, type=int)
+    parser.add_argument('--ack-window', help='The number of commands sent to the controller before waiting for '
+                                             'acknowledgements, 0 to not wait for acknowledgements.',
+                        default=0, type=int)
+    parser.add_argument('--serial-outage-policy', help='What to do with commands sent while the controller is '
+                                                       'reconnecting: buffer them until reconnected or fail them.',
+                        default=OutagePolicy.BUFFER.value, choices=[policy.value for policy in OutagePolicy])
+    parser.add_argument('--msgpack', help='Send messages as MessagePack instead of JSON. Requires the msgpack package '
+                                          'and clients using the Socket.IO MessagePack parser.',
+                        action='store_true')
+    parser.add_argument('--log-store', help='The SQLite database storing the log records of programs.',
+                        default=str(LOG_STORE_PATH))
+    parser.add_argument('--log-retention-days', help='Stored log records older than this many days are deleted, '
+                                                     '0 to keep them regardless of their age.',
+                        default=30.0, type=float)
+    parser.add_argument('--log-max-records', help='Only this many of the newest log records are kept, 0 for no limit.',
+                        default=1_000_000, type=int)
 
     args = parser.parse_args()
 
-    sio = socketio.AsyncServer(async_mode='aiohttp', cors_allowed_origins='*')
+    sio = socketio.AsyncServer(async_mode='aiohttp', cors_allowed_origins='*',
+                               serializer='msgpack' if args.msgpack else 'default')
     app = web.Application()
     sio.attach(app)
 
-    bot_server = Server(sio)
+    bot_server = Server(sio, encoder_threads=args.encoder_threads, ack_window=args.ack_window,
+                        outage_policy=OutagePolicy(args.serial_outage_policy), log_store_path=Path(args.log_store),
+                        log_retention_days=args.log_retention_days or None,
+                        log_max_records=args.log_max_records or None)
+
+    async def shutdown(_app: web.Application) -> None:
+        await bot_server.shutdown()
+
+    app.on_cleanup.append(shutdown)
 
     logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
     web.run_app(app, host=args.host, port=args.port)
@@ -2,43 +2,50 @@
 A callable function that has the purpose to enter the encounter for a given Pokémon.
 This method is expected to advance the game until the game starts the battle animation and the screen
 turns dark or does whatever animation is played for the Pokémon.
+It logs its progress to the given logger, which is the program's.
 """
-from asyncio import sleep
+import logging
 from typing import Callable, Awaitable
 
+from switchbot.bot.macro import MacroBuilder, MacroPlayer, Macro
 from switchbot.bot.switch_bot import SwitchBot
 
-BattleEntryDelegate = Callable[[SwitchBot], Awaitable[None]]
+BattleEntryDelegate = Callable[[SwitchBot, logging.Logger], Awaitable[None]]
 
 
 class BattleEntry:
     @staticmethod
     def step_forward(steps: int, pre_battle_animation_timeout: float,
                      animation_timeout: float) -> BattleEntryDelegate:
-        async def do_entry(switch_bot: SwitchBot) -> None:
-            for _ in range(steps):
-                switch_bot.serial.tap_up()
-                # TODO: fine-tune these timeouts
-                await sleep(0.5)
-            await sleep(1.5)
-            switch_bot.serial.tap_a()
-            await sleep(pre_battle_animation_timeout)
-            switch_bot.serial.tap_a()
-            await sleep(animation_timeout)
-
-        return do_entry
+        builder = MacroBuilder('step_forward')
+        for _ in range(steps):
+            # TODO: fine-tune these timeouts
+            builder.tap('DU').wait(0.5)
+        macro = (builder
+                 .wait(1.5)
+                 .tap('A')
+                 .wait(pre_battle_animation_timeout)
+                 .tap('A')
+                 .wait(animation_timeout)
+                 .build())
+        return BattleEntry._play(macro)
 
     @staticmethod
     def simple(pre_battle_animation_timeout: float, animation_timeout: float) -> BattleEntryDelegate:
-        async def do_entry(switch_bot: SwitchBot) -> None:
-            # Press A to start the pre-battle animation which results in a textbox with the Pokémon's
-            # scream being displayed.
-            print('Opening encounter text box...')
-            switch_bot.serial.tap_a()
-            await sleep(pre_battle_animation_timeout)
-            print('Closing encounter text box...')
-            # Press A to close the textbox and play the animation of entering the battle.
-            switch_bot.serial.tap_a()
-            await sleep(animation_timeout)
+        macro = (MacroBuilder('simple')
+                 # Press A to start the pre-battle animation which results in a textbox with the Pokémon's
+                 # scream being displayed.
+                 .tap('A', label='Opening encounter text box...')
+                 .wait(pre_battle_animation_timeout)
+                 # Press A to close the textbox and play the animation of entering the battle.
+                 .tap('A', label='Closing encounter text box...')
+                 .wait(animation_timeout)
+                 .build())
+        return BattleEntry._play(macro)
+
+    @staticmethod
+    def _play(macro: Macro) -> BattleEntryDelegate:
+        async def do_entry(switch_bot: SwitchBot, logger: logging.Logger) -> None:
+            await MacroPlayer(switch_bot.serial, logger).play(macro)
 
         return do_entry
@@ -1,14 +1,31 @@
 import asyncio
 from typing import Optional
 
+from switchbot.bot.macro import MacroBuilder, MacroPlayer
 from . import enter_encounter_state
 from ..state_machine import State
 
+CLOSE_GAME_MACRO = (MacroBuilder('close_game')
+                    .tap('H', label='Entering home')
+                    .wait(0.5)
+                    .tap('X', label='Opening closing dialog')
+                    .wait(0.5)
+                    .tap('A', label='Confirming close dialog')
+                    # Closed software.
+                    .wait(2)
+                    .tap('A', label='Launching user selection dialog')
+                    .wait(2)
+                    .tap('A', label='Selected user')
+                    # Launched game.
+                    .wait(22.5)
+                    .build())
+
 
 class LaunchGameState(State):
     async def execute(self) -> Optional[State]:
         self.context.encounters += 1
-        self.context.program.logger.info(f'Encounter {self.context.encounters} starting...')
+        self.context.program.logger.info(f'Encounter {self.context.encounters} starting...',
+                                         extra={'encounter': self.context.encounters})
 
         await self.close_game()
         await self.enter_game()
@@ -19,23 +36,7 @@ class LaunchGameState(State):
         """
         Closes the game currently running on the Switch.
         """
-        self.context.program.logger.info('Entering home')
-        self.context.bot.serial.tap_home()
-        await asyncio.sleep(0.5)
-        self.context.program.logger.info('Opening closing dialog')
-        self.context.bot.serial.tap_x()
-        await asyncio.sleep(0.5)
-        self.context.program.logger.info('Confirming close dialog')
-        self.context.bot.serial.tap_a()
-        # closed software.
-        await asyncio.sleep(2)
-        self.context.program.logger.info('Launching user selection dialog')
-        self.context.bot.serial.tap_a()
-        await asyncio.sleep(2)
-        self.context.program.logger.info('Selected user')
-        self.context.bot.serial.tap_a()
-        # Launched game.
-        await asyncio.sleep(22.5)
+        await MacroPlayer(self.context.bot.serial, self.context.program.logger).play(CLOSE_GAME_MACRO)
 
     async def enter_game(self) -> None:
         """
@@ -1,5 +1,4 @@
-import asyncio
-from time import time
+from time import monotonic
 from typing import Optional
 
 import numpy as np
@@ -8,7 +7,7 @@ from ..state_machine import State
 from .launch_game_state import LaunchGameState
 from .update_times_state import UpdateTimesState
 from switchbot.bot.switch_bot import SwitchBot
-from switchbot.program.image_helper import Rect, count_colored_pixels
+from switchbot.program.image_helper import Rect, ColorRegion, ColorRegionDetector
 
 ENCOUNTER_RECT = Rect(
     x=170,
@@ -32,19 +31,22 @@ COLOR_RED_UPPER = np.array([85, 85, 255])
 async def wait_for_colored_region(switch_bot: SwitchBot, rect: Rect, lower_color: [float],
                                   upper_color: [float],
                                   minimum_count: int, max_wait_time: float) -> Optional[float]:
-    start_time = time()
-    pixel_count = 0
-    while pixel_count < minimum_count:
-        frame = switch_bot.video.read_frame()
-        if frame is not None:
-            pixel_count = count_colored_pixels(frame, rect, lower_color, upper_color)
-        current_time = time()
-        if current_time - start_time >= max_wait_time:
-            return None
-        # Small sleep for 1 frame to allow other processes to run.
-        await asyncio.sleep(1.0 / 60.0)
+    """
+    Waits until a frame contains at least minimum_count pixels of the given color inside rect.
 
-    return time() - start_time
+    :return: The time in seconds between calling this and capturing the first matching frame
+    or None if no frame matched within max_wait_time seconds.
+    """
+    start_time = monotonic()
+    detector = ColorRegionDetector([ColorRegion(rect, lower_color, upper_color)])
+    frame = await switch_bot.frames.wait_for(
+        lambda candidate: detector.count(candidate.image)[0] >= minimum_count,
+        timeout=max_wait_time,
+        name='wait_for_colored_region',
+    )
+    if frame is None:
+        return None
+    return frame.timestamp - start_time
 
 
 class MeasureTimeState(State):
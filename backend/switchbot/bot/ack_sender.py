@@ -0,0 +1,305 @@
+import asyncio
+import collections
+import logging
+import re
+from dataclasses import dataclass
+from time import monotonic
+from typing import Callable, Optional, Deque, Dict
+
+from serial import SerialException, SerialTimeoutException
+
+from .serial_reader import SerialReader
+from .serial_writer import SerialWriter, BackpressurePolicy, SerialQueueFullError, create_command_future
+
+logger = logging.getLogger('AckSender')
+
+# Printed by the controller for each sequenced command: K if it was executed, N if it was invalid.
+ACK_PATTERN = re.compile(r'([KN])(\d+)')
+# Printed by the controller once it handled a K1 command. All acknowledgements before it belong to earlier commands.
+ACK_RESYNC_LINE = 'K1 OK'
+# Sequence numbers are a single byte, so no more than half of them may be in flight to tell old from new ones.
+MAX_WINDOW_SIZE = 127
+
+
+@dataclass
+class SequencedCommand:
+    # Encodes the command with the given sequence number.
+    encode: Callable[[int], bytes]
+    # Resolves to True once acknowledged, to False if the controller rejected the command or it was dropped.
+    future: asyncio.Future
+    coalesce_key: Optional[str] = None
+    sequence: int = 0
+    sent_at: float = 0.0
+    transmissions: int = 0
+    # Whether a duplicate acknowledgement already made this command be sent again before its timeout.
+    fast_retransmitted: bool = False
+
+
+class AckSender:
+    """
+    Sends commands with sequence numbers and resolves them once the controller acknowledged them.
+
+    Up to window_size commands are in flight at the same time, so the round trip to the controller is only paid
+    once for a whole window of commands. The controller only executes commands in order. If the oldest command
+    was not acknowledged within the timeout, it and all commands after it are sent again.
+
+    When the controller receives a command after a lost one, it acknowledges the last command it executed again.
+    Such a duplicate acknowledgement makes the lost command and all commands after it be sent again right away,
+    once per lost command, instead of waiting for the timeout.
+
+    After giving up on a command, the controller is told to start over at sequence number 0. Until it confirmed
+    that, acknowledgements still belong to the old commands, so they are ignored and no new commands are sent.
+    Older firmware does not confirm, in which case sending resumes after the timeout.
+    """
+
+    def __init__(self,
+                 writer: SerialWriter,
+                 reader: SerialReader,
+                 loop: asyncio.AbstractEventLoop,
+                 window_size: int = 8,
+                 timeout: float = 1.0,
+                 max_transmissions: int = 5,
+                 max_queue_size: int = 64,
+                 policy: BackpressurePolicy = BackpressurePolicy.COALESCE):
+        if not 1 <= window_size <= MAX_WINDOW_SIZE:
+            raise ValueError(f'Window size must be between 1 and {MAX_WINDOW_SIZE}, was {window_size}')
+
+        self.writer: SerialWriter = writer
+        self.reader: SerialReader = reader
+        self.window_size: int = window_size
+        self.timeout: float = timeout
+        self.max_transmissions: int = max_transmissions
+        self.max_queue_size: int = max_queue_size
+        self.policy: BackpressurePolicy = policy
+        self._loop: asyncio.AbstractEventLoop = loop
+        # Commands waiting for space in the window and commands sent but not acknowledged yet, both oldest first.
+        self._pending: Deque[SequencedCommand] = collections.deque()
+        self._in_flight: Deque[SequencedCommand] = collections.deque()
+        self._next_sequence: int = 0
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._resync_timer: Optional[asyncio.TimerHandle] = None
+        self._space_available: asyncio.Event = asyncio.Event()
+        self.acknowledged: int = 0
+        self.rejected: int = 0
+        self.retransmitted: int = 0
+        self.fast_retransmits: int = 0
+        self.failed: int = 0
+        self.dropped: int = 0
+        self.coalesced: int = 0
+        reader.add_listener(self._on_line)
+
+    def submit(self, encode: Callable[[int], bytes], coalesce_key: Optional[str] = None) -> asyncio.Future:
+        """
+        Queues a command to be sent as soon as there is space in the window.
+
+        :param encode: Encodes the command with the sequence number it is sent with.
+        :param coalesce_key: Commands with the same key may replace each other while waiting for space.
+        :return: A future resolving to True once the controller acknowledged the command, to False if it
+        rejected the command or it was dropped. Fails with a SerialTimeoutException if it was never acknowledged.
+        :raises SerialQueueFullError: If too many commands are waiting and the policy is BLOCK.
+        """
+        future = create_command_future(self._loop)
+        command = SequencedCommand(encode=encode, future=future, coalesce_key=coalesce_key)
+
+        replaced: Optional[SequencedCommand] = None
+        if self.policy == BackpressurePolicy.COALESCE and coalesce_key is not None:
+            replaced = self._remove_pending(coalesce_key)
+        if replaced is None and len(self._pending) >= self.max_queue_size:
+            if self.policy == BackpressurePolicy.BLOCK:
+                raise SerialQueueFullError(f'{len(self._pending)} commands are already waiting to be sent')
+            replaced = self._pending.popleft()
+            self.dropped += 1
+        self._pending.append(command)
+
+        if replaced is not None:
+            self._resolve(replaced.future, False)
+        self._fill_window()
+        return future
+
+    async def submit_and_wait_for_space(self,
+                                        encode: Callable[[int], bytes],
+                                        coalesce_key: Optional[str] = None) -> asyncio.Future:
+        """
+        Like submit, but waits for space instead of raising if the policy is BLOCK.
+        """
+        while True:
+            try:
+                return self.submit(encode, coalesce_key)
+            except SerialQueueFullError:
+                self._space_available.clear()
+                await self._space_available.wait()
+
+    def stop(self) -> None:
+        """
+        Stops listening for acknowledgements. Commands that were not acknowledged yet fail with a SerialException.
+        """
+        self.reader.remove_listener(self._on_line)
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = None
+        if self._resync_timer is not None:
+            self._resync_timer.cancel()
+        self._resync_timer = None
+        self._fail_all(SerialException('Serial connection was closed before the command was acknowledged'))
+        self._space_available.set()
+
+    def statistics(self) -> Dict[str, int]:
+        return {
+            'pending': len(self._pending),
+            'in_flight': len(self._in_flight),
+            'acknowledged': self.acknowledged,
+            'rejected': self.rejected,
+            'retransmitted': self.retransmitted,
+            'fast_retransmits': self.fast_retransmits,
+            'failed': self.failed,
+            'dropped': self.dropped,
+            'coalesced': self.coalesced,
+        }
+
+    def _remove_pending(self, coalesce_key: str) -> Optional[SequencedCommand]:
+        # Commands in flight may already have been executed, so only waiting ones are removed. The new command is
+        # queued at the end, so it is still sent after everything submitted before it.
+        for index, pending in enumerate(self._pending):
+            if pending.coalesce_key == coalesce_key:
+                del self._pending[index]
+                self.coalesced += 1
+                return pending
+        return None
+
+    def _fill_window(self) -> None:
+        while self._resync_timer is None and self._pending and len(self._in_flight) < self.window_size:
+            command = self._pending.popleft()
+            command.sequence = self._next_sequence
+            self._next_sequence = (self._next_sequence + 1) & 0xFF
+            self._in_flight.append(command)
+            self._transmit(command)
+        if len(self._pending) < self.max_queue_size:
+            self._space_available.set()
+        self._schedule_timeout_check(self.timeout)
+
+    def _transmit(self, command: SequencedCommand) -> None:
+        command.sent_at = monotonic()
+        command.transmissions += 1
+        # If writing fails, the command times out and is sent again, so the result of the write doesn't matter.
+        try:
+            self.writer.submit(command.encode(command.sequence))
+        except SerialQueueFullError:
+            pass
+
+    def _on_line(self, line: str) -> None:
+        if line == ACK_RESYNC_LINE:
+            if self._resync_timer is not None:
+                self._finish_resync()
+            return
+        match = ACK_PATTERN.fullmatch(line)
+        if match is None or self._resync_timer is not None:
+            return
+
+        sequence = int(match.group(2))
+        index = next((index for index, command in enumerate(self._in_flight) if command.sequence == sequence), None)
+        if index is None:
+            # Acknowledges a command that was already acknowledged. If it's the one right before the oldest command
+            # in flight, the controller received a command after a lost one.
+            if self._in_flight and sequence == (self._in_flight[0].sequence - 1) & 0xFF:
+                self._fast_retransmit()
+            return
+
+        # Acknowledgements are cumulative, so all commands before this one were executed as well.
+        for _ in range(index):
+            self.acknowledged += 1
+            self._resolve(self._in_flight.popleft().future, True)
+        command = self._in_flight.popleft()
+        if match.group(1) == 'K':
+            self.acknowledged += 1
+            self._resolve(command.future, True)
+        else:
+            self.rejected += 1
+            self._resolve(command.future, False)
+        self._fill_window()
+
+    def _schedule_timeout_check(self, delay: float) -> None:
+        if self._timer is None and self._in_flight:
+            self._timer = self._loop.call_later(delay, self._check_timeout)
+
+    def _check_timeout(self) -> None:
+        self._timer = None
+        if not self._in_flight:
+            return
+
+        oldest = self._in_flight[0]
+        remaining_time = oldest.sent_at + self.timeout - monotonic()
+        if remaining_time > 0:
+            self._schedule_timeout_check(remaining_time)
+            return
+
+        if oldest.transmissions >= self.max_transmissions:
+            logger.error(f'Command {oldest.sequence} was not acknowledged after {oldest.transmissions} attempts.')
+            in_flight = list(self._in_flight)
+            self._in_flight.clear()
+            self.failed += len(in_flight)
+            for command in in_flight:
+                self._fail(command.future, SerialTimeoutException('Controller did not acknowledge the command'))
+            self._next_sequence = 0
+            self._resync()
+            return
+
+        # Commands after a lost one were ignored by the controller, so all of them are sent again in order.
+        logger.debug(f'Command {oldest.sequence} timed out, sending {len(self._in_flight)} commands again.')
+        for command in self._in_flight:
+            self.retransmitted += 1
+            self._transmit(command)
+        self._schedule_timeout_check(self.timeout)
+
+    def _fast_retransmit(self) -> None:
+        oldest = self._in_flight[0]
+        # The commands after the lost one cause duplicate acknowledgements as well, which must not send them again.
+        if oldest.fast_retransmitted or oldest.transmissions >= self.max_transmissions:
+            return
+        oldest.fast_retransmitted = True
+        self.fast_retransmits += 1
+        logger.debug(f'Command {oldest.sequence} was lost, sending {len(self._in_flight)} commands again.')
+        for command in self._in_flight:
+            self.retransmitted += 1
+            self._transmit(command)
+
+    def _resync(self) -> None:
+        """
+        Makes the controller expect sequence number 0 again, so the following commands can be executed.
+        """
+        try:
+            self.writer.submit(b'K1\n')
+        except SerialQueueFullError:
+            # No new commands are sent until the controller confirmed, so the queue drains and there is space later.
+            self._resync_timer = self._loop.call_later(self.timeout, self._resync)
+            return
+        except SerialException as e:
+            # The writer was stopped, so nothing waiting can be sent anymore.
+            logger.error(f'Failed to make the controller start over at sequence number 0: {e}')
+            self._resync_timer = None
+            self._fail_all(e)
+            self._space_available.set()
+            return
+        self._resync_timer = self._loop.call_later(self.timeout, self._finish_resync)
+
+    def _finish_resync(self) -> None:
+        if self._resync_timer is not None:
+            self._resync_timer.cancel()
+        self._resync_timer = None
+        self._fill_window()
+
+    def _fail_all(self, exception: BaseException) -> None:
+        commands = list(self._in_flight) + list(self._pending)
+        self._in_flight.clear()
+        self._pending.clear()
+        for command in commands:
+            self._fail(command.future, exception)
+
+    @staticmethod
+    def _resolve(future: asyncio.Future, result: bool) -> None:
+        if not future.done():
+            future.set_result(result)
+
+    @staticmethod
+    def _fail(future: asyncio.Future, exception: BaseException) -> None:
+        if not future.done():
+            future.set_exception(exception)
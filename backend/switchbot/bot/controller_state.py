@@ -0,0 +1,76 @@
+from dataclasses import dataclass, field
+from typing import Set, Optional, Tuple, List
+
+from .serial_protocol import ControllerReport, BUTTON_NAME_TO_BUTTON, DPAD_NAME_TO_HAT, Hat, STICK_NEUTRAL, \
+    stick_byte_to_text
+
+
+@dataclass
+class ControllerState:
+    """
+    The state of every input of the controller, using the button names of the text protocol.
+    """
+    held_buttons: Set[str] = field(default_factory=set)
+    # One of DU, DR, DD, DL or None if the D-Pad is not pressed.
+    dpad: Optional[str] = None
+    # Stick positions as (x, y) bytes, with 128 being neutral.
+    left_stick: Tuple[int, int] = (STICK_NEUTRAL, STICK_NEUTRAL)
+    right_stick: Tuple[int, int] = (STICK_NEUTRAL, STICK_NEUTRAL)
+
+    def copy(self) -> 'ControllerState':
+        return ControllerState(
+            held_buttons=set(self.held_buttons),
+            dpad=self.dpad,
+            left_stick=self.left_stick,
+            right_stick=self.right_stick,
+        )
+
+    def set_pressed(self, button_name: str, pressed: bool) -> None:
+        """
+        Presses or releases a button or a direction of the D-Pad.
+        """
+        if button_name in DPAD_NAME_TO_HAT:
+            if pressed:
+                self.dpad = button_name
+            elif self.dpad == button_name:
+                self.dpad = None
+        elif button_name in BUTTON_NAME_TO_BUTTON:
+            if pressed:
+                self.held_buttons.add(button_name)
+            else:
+                self.held_buttons.discard(button_name)
+        else:
+            raise ValueError(f'Unknown button {button_name}')
+
+    def is_pressed(self, button_name: str) -> bool:
+        if button_name in DPAD_NAME_TO_HAT:
+            return self.dpad == button_name
+        return button_name in self.held_buttons
+
+    def diff_commands(self, previous: 'ControllerState') -> List[str]:
+        """
+        Builds the shortest list of text commands that changes the controller from the previous state to this one.
+        """
+        commands = [f'R{name}' for name in sorted(previous.held_buttons - self.held_buttons)]
+        if self.dpad != previous.dpad:
+            # Holding another direction replaces the old one, so only release when nothing is held anymore.
+            commands.append(f'H{self.dpad}' if self.dpad is not None else f'R{previous.dpad}')
+        commands.extend(f'H{name}' for name in sorted(self.held_buttons - previous.held_buttons))
+        if self.left_stick != previous.left_stick:
+            commands.append(f'SL{stick_byte_to_text(self.left_stick[0])},{stick_byte_to_text(self.left_stick[1])}')
+        if self.right_stick != previous.right_stick:
+            commands.append(f'SR{stick_byte_to_text(self.right_stick[0])},{stick_byte_to_text(self.right_stick[1])}')
+        return commands
+
+    def to_report(self) -> ControllerReport:
+        buttons = 0
+        for name in self.held_buttons:
+            buttons |= 1 << BUTTON_NAME_TO_BUTTON[name]
+        return ControllerReport(
+            buttons=buttons,
+            hat=DPAD_NAME_TO_HAT[self.dpad] if self.dpad is not None else Hat.NEUTRAL,
+            left_x=self.left_stick[0],
+            left_y=self.left_stick[1],
+            right_x=self.right_stick[0],
+            right_y=self.right_stick[1],
+        )
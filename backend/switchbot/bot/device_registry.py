@@ -0,0 +1,142 @@
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from time import monotonic
+from typing import List, Optional, Callable, Tuple
+
+from .serial_connector import SerialConnector
+from .video_connector import VideoConnector, CameraDescriptor
+
+logger = logging.getLogger('DeviceRegistry')
+
+
+@dataclass
+class DeviceChanges:
+    added_cameras: List[CameraDescriptor] = field(default_factory=list)
+    removed_cameras: List[CameraDescriptor] = field(default_factory=list)
+    added_serial_ports: List[str] = field(default_factory=list)
+    removed_serial_ports: List[str] = field(default_factory=list)
+
+    def is_empty(self) -> bool:
+        return not (self.added_cameras or self.removed_cameras or self.added_serial_ports or self.removed_serial_ports)
+
+
+class DeviceRegistry:
+    """
+    Keeps the lists of available cameras and serial ports, so they don't have to be enumerated for every client.
+
+    Probing cameras can take hundreds of milliseconds, so devices are only ever enumerated on a worker thread.
+    The cached lists are enumerated again when refresh is called, when a device was plugged in or out, or when they
+    are read while older than ttl seconds. Serial ports are cheap to list and are polled every poll_interval seconds
+    to notice devices being plugged in or out, since USB cameras and controllers are usually plugged in around the
+    same time. Nothing else is enumerated in the background, so an idle server never probes the cameras.
+    Listeners are told about the differences after every enumeration that changed something.
+    """
+
+    def __init__(self, video: VideoConnector, ttl: float = 30.0, poll_interval: float = 2.0):
+        self.video: VideoConnector = video
+        self.ttl: float = ttl
+        self.poll_interval: float = poll_interval
+        self.cameras: List[CameraDescriptor] = []
+        self.serial_ports: List[str] = []
+        self._refreshed_at: Optional[float] = None
+        # A single thread so enumerations never run at the same time.
+        self._executor: ThreadPoolExecutor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='DeviceRegistry')
+        self._refresh_task: Optional[asyncio.Future] = None
+        self._watch_task: Optional[asyncio.Task] = None
+        self._listeners: List[Callable[[DeviceChanges], None]] = []
+
+    def start(self) -> None:
+        """
+        Enumerates all devices and starts watching for changes on the running event loop. Does nothing if already
+        started.
+        """
+        if self._watch_task is None:
+            self._watch_task = asyncio.ensure_future(self._watch())
+
+    def stop(self) -> None:
+        if self._watch_task is not None:
+            self._watch_task.cancel()
+        self._watch_task = None
+
+    def add_listener(self, listener: Callable[[DeviceChanges], None]) -> None:
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener: Callable[[DeviceChanges], None]) -> None:
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+
+    def is_stale(self) -> bool:
+        return self._refreshed_at is None or monotonic() - self._refreshed_at > self.ttl
+
+    async def get_cameras(self) -> List[CameraDescriptor]:
+        """
+        :return: The cached cameras, enumerated again first if the cache expired.
+        """
+        if self.is_stale():
+            await self.refresh()
+        return self.cameras
+
+    async def get_serial_ports(self) -> List[str]:
+        """
+        :return: The cached serial ports, enumerated again first if the cache expired.
+        """
+        if self.is_stale():
+            await self.refresh()
+        return self.serial_ports
+
+    def refresh(self) -> asyncio.Future:
+        """
+        Enumerates all devices again. Calls made while an enumeration is running share its result.
+
+        :return: A future resolving to the changes compared to the previous enumeration.
+        """
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.ensure_future(self._refresh())
+        return self._refresh_task
+
+    async def _refresh(self) -> DeviceChanges:
+        cameras, serial_ports = await asyncio.get_event_loop().run_in_executor(self._executor, self._enumerate)
+        return self._update(cameras, serial_ports)
+
+    def _enumerate(self) -> Tuple[List[CameraDescriptor], List[str]]:
+        try:
+            cameras = self.video.list_cameras()
+        except Exception as exception:
+            logger.error(f'Failed to enumerate cameras: {exception}')
+            cameras = self.cameras
+        return cameras, SerialConnector.list_serial_ports()
+
+    def _update(self, cameras: List[CameraDescriptor], serial_ports: List[str]) -> DeviceChanges:
+        changes = DeviceChanges(
+            added_cameras=[camera for camera in cameras if camera not in self.cameras],
+            removed_cameras=[camera for camera in self.cameras if camera not in cameras],
+            added_serial_ports=[port for port in serial_ports if port not in self.serial_ports],
+            removed_serial_ports=[port for port in self.serial_ports if port not in serial_ports],
+        )
+        self.cameras = cameras
+        self.serial_ports = serial_ports
+        self._refreshed_at = monotonic()
+        if not changes.is_empty():
+            logger.info(f'Devices changed: {changes}')
+            for listener in list(self._listeners):
+                listener(changes)
+        return changes
+
+    async def _watch(self) -> None:
+        loop = asyncio.get_event_loop()
+        while True:
+            try:
+                if self._refreshed_at is None:
+                    await self.refresh()
+                else:
+                    serial_ports = await loop.run_in_executor(self._executor, SerialConnector.list_serial_ports)
+                    if set(serial_ports) != set(self.serial_ports):
+                        # Something was plugged in or out, which might have been a camera as well.
+                        await self.refresh()
+            except asyncio.CancelledError:
+                raise
+            except Exception as exception:
+                logger.exception(f'Watching for device changes failed: {exception}')
+            await asyncio.sleep(self.poll_interval)
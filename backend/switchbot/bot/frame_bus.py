@@ -0,0 +1,212 @@
+import asyncio
+import collections
+import dataclasses
+import logging
+from enum import Enum
+from time import monotonic
+from typing import Optional, Dict, List, Deque, Callable
+
+from .frame_grabber import Frame
+from .video_connector import VideoConnector
+
+logger = logging.getLogger('FrameBus')
+
+
+class FramePolicy(Enum):
+    """
+    Decides which of the published frames a subscription keeps.
+    """
+    # Only keep the newest frame, replacing any frame that was not consumed yet.
+    LATEST = 'latest'
+    # Keep up to queue_size frames, dropping the oldest one when the queue is full.
+    QUEUE = 'queue'
+    # Only consider every n-th published frame, queued the same way as QUEUE.
+    EVERY_NTH = 'every_nth'
+
+
+class FrameSubscription:
+    """
+    A single consumer of the frames published on a FrameBus.
+
+    Can be used as an async context manager to unsubscribe automatically and as an async iterator over frames.
+    """
+
+    def __init__(self, bus: 'FrameBus', name: str, policy: FramePolicy, queue_size: int, nth: int):
+        if queue_size < 1:
+            raise ValueError(f'Queue size must be at least 1, was {queue_size}')
+        if nth < 1:
+            raise ValueError(f'n must be at least 1, was {nth}')
+
+        self.name: str = name
+        self.policy: FramePolicy = policy
+        self.nth: int = nth if policy == FramePolicy.EVERY_NTH else 1
+        self._bus: 'FrameBus' = bus
+        self._frames: Deque[Frame] = collections.deque(maxlen=1 if policy == FramePolicy.LATEST else queue_size)
+        self._frame_available: asyncio.Event = asyncio.Event()
+        self.closed: bool = False
+        # Counters for frames published while subscribed.
+        self.published: int = 0
+        self.skipped: int = 0
+        self.dropped: int = 0
+        self.delivered: int = 0
+
+    def offer(self, frame: Frame) -> None:
+        """
+        Called by the bus for each published frame.
+        """
+        self.published += 1
+        if self.published % self.nth != 0:
+            self.skipped += 1
+            return
+
+        if len(self._frames) == self._frames.maxlen:
+            # The deque discards the oldest frame itself on append.
+            self.dropped += 1
+        self._frames.append(frame)
+        self._frame_available.set()
+
+    async def next(self, timeout: Optional[float] = None) -> Optional[Frame]:
+        """
+        Waits for the next frame kept by this subscription.
+
+        :param timeout: The maximum time in seconds to wait or None to wait indefinitely.
+        :return: The next frame or None if the subscription was closed or the timeout elapsed.
+        """
+        while not self._frames:
+            if self.closed:
+                return None
+            self._frame_available.clear()
+            try:
+                await asyncio.wait_for(self._frame_available.wait(), timeout)
+            except asyncio.TimeoutError:
+                return None
+
+        self.delivered += 1
+        return self._frames.popleft()
+
+    def close(self) -> None:
+        self._bus.unsubscribe(self)
+
+    def statistics(self) -> Dict[str, int]:
+        return {
+            'published': self.published,
+            'skipped': self.skipped,
+            'dropped': self.dropped,
+            'delivered': self.delivered,
+            'pending': len(self._frames),
+        }
+
+    async def __aenter__(self) -> 'FrameSubscription':
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
+
+    def __aiter__(self) -> 'FrameSubscription':
+        return self
+
+    async def __anext__(self) -> Frame:
+        frame = await self.next()
+        if frame is None:
+            raise StopAsyncIteration
+        return frame
+
+
+class FrameBus:
+    """
+    Fans out every frame grabbed by a VideoConnector to any number of subscribers.
+
+    Subscribers never take frames away from each other. All of them receive the same read-only view of the
+    grabbed image, so publishing a frame does not copy any pixels.
+    All subscriptions are closed when the camera is disconnected.
+    """
+
+    def __init__(self, video: VideoConnector):
+        self._subscriptions: List[FrameSubscription] = []
+        video.add_frame_listener(self.publish)
+        # No frames follow anymore, so waiting subscribers would never wake up otherwise.
+        video.add_disconnect_listener(self.close_all)
+
+    def subscribe(self,
+                  name: str,
+                  policy: FramePolicy = FramePolicy.LATEST,
+                  queue_size: int = 1,
+                  nth: int = 1) -> FrameSubscription:
+        """
+        Creates a new subscription receiving all frames published from now on.
+
+        :param name: A name for the subscriber, used when reporting statistics.
+        :param policy: Decides which frames are kept when the subscriber is slower than the camera.
+        :param queue_size: The maximum number of frames kept for QUEUE and EVERY_NTH subscriptions.
+        :param nth: Only every n-th frame is considered for EVERY_NTH subscriptions.
+        :return: The new subscription.
+        """
+        subscription = FrameSubscription(self, name, policy, queue_size, nth)
+        self._subscriptions.append(subscription)
+        logger.debug(f'Added frame subscription "{name}" with policy {policy.value}.')
+        return subscription
+
+    def unsubscribe(self, subscription: FrameSubscription) -> None:
+        if subscription in self._subscriptions:
+            self._subscriptions.remove(subscription)
+            logger.debug(f'Removed frame subscription "{subscription.name}": {subscription.statistics()}')
+        subscription.closed = True
+        # Wake up a consumer waiting for frames so it notices the subscription was closed.
+        subscription._frame_available.set()
+
+    def close_all(self) -> None:
+        """
+        Closes all subscriptions, so consumers waiting for frames receive None.
+        """
+        for subscription in list(self._subscriptions):
+            self.unsubscribe(subscription)
+
+    def publish(self, frame: Frame) -> None:
+        if not self._subscriptions:
+            return
+
+        image = frame.image.view()
+        image.flags.writeable = False
+        read_only_frame = dataclasses.replace(frame, image=image)
+        for subscription in self._subscriptions:
+            subscription.offer(read_only_frame)
+
+    async def wait_for(self,
+                       predicate: Callable[[Frame], bool],
+                       timeout: Optional[float] = None,
+                       name: str = 'wait_for',
+                       queue_size: int = 4) -> Optional[Frame]:
+        """
+        Checks every new frame with the given predicate until it matches a frame.
+
+        Since the predicate is called on exactly the frames that were grabbed, the timestamp of the returned frame
+        tells when the matching image was captured, no matter how long it took to check it.
+
+        :param predicate: Called for each frame, returns whether the frame is the one being waited for.
+        :param timeout: The maximum time in seconds to wait or None to wait indefinitely.
+        Frames captured after the timeout has elapsed are not checked anymore.
+        :param name: A name for the subscription used while waiting, used when reporting statistics.
+        :param queue_size: The number of frames to queue if checking a frame takes longer than the camera's frame time.
+        :return: The first matching frame or None if no frame matched in time.
+        """
+        deadline = monotonic() + timeout if timeout is not None else None
+        async with self.subscribe(name, FramePolicy.QUEUE, queue_size=queue_size) as subscription:
+            while not subscription.closed:
+                remaining_time = max(0.0, deadline - monotonic()) if deadline is not None else None
+                # Frames that were queued before the deadline are still returned when the deadline has passed.
+                frame = await subscription.next(timeout=remaining_time)
+                if frame is None:
+                    if remaining_time == 0.0:
+                        return None
+                    continue
+                if deadline is not None and frame.timestamp > deadline:
+                    return None
+                if predicate(frame):
+                    return frame
+        return None
+
+    def statistics(self) -> Dict[str, Dict[str, int]]:
+        """
+        :return: The counters of all current subscriptions, keyed by the name of the subscription.
+        """
+        return {subscription.name: subscription.statistics() for subscription in self._subscriptions}
@@ -0,0 +1,140 @@
+import asyncio
+import logging
+import threading
+from dataclasses import dataclass
+from time import monotonic, sleep
+from typing import Optional, Callable
+
+import numpy as np
+from cv2 import VideoCapture, error
+
+logger = logging.getLogger('FrameGrabber')
+
+# Seconds to wait before reading again after the capture failed to deliver a frame.
+READ_RETRY_DELAY = 0.005
+
+
+@dataclass(frozen=True)
+class Frame:
+    """
+    A single frame grabbed from a camera together with the metadata describing when it was grabbed.
+    """
+    image: np.ndarray
+    # Increases by one for every grabbed frame, starting at 1 for the first one.
+    sequence: int
+    # Value of time.monotonic() directly after the frame was read from the capture.
+    timestamp: float
+
+
+class FrameGrabber:
+    """
+    Owns a VideoCapture and reads frames from it on a dedicated background thread.
+
+    Only the newest frame is kept. Any number of consumers on the event loop can wait for new frames without
+    blocking the loop and without taking frames away from each other.
+    """
+
+    def __init__(self,
+                 capture: VideoCapture,
+                 loop: asyncio.AbstractEventLoop,
+                 on_frame: Optional[Callable[[Frame], None]] = None):
+        self.capture: VideoCapture = capture
+        self._loop: asyncio.AbstractEventLoop = loop
+        # Called on the event loop's thread for every new frame.
+        self._on_frame: Optional[Callable[[Frame], None]] = on_frame
+        self._lock: threading.Lock = threading.Lock()
+        self._latest: Optional[Frame] = None
+        self._sequence: int = 0
+        self._running: threading.Event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        # Replaced whenever a new frame arrives. Waiters keep a reference to the old event, which is then set.
+        self._frame_event: asyncio.Event = asyncio.Event()
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+
+        self._running.set()
+        self._thread = threading.Thread(target=self._grab_frames, name='FrameGrabber', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._running.clear()
+        if self._thread is not None:
+            # A single read takes at most about one frame, so this should not take long.
+            self._thread.join(timeout=2.0)
+        self._thread = None
+        # Wake up all waiters so they can notice that no more frames will arrive.
+        self._notify_waiters()
+
+    def is_running(self) -> bool:
+        return self._running.is_set()
+
+    def latest(self) -> Optional[Frame]:
+        """
+        :return: The most recently grabbed frame or None if no frame was grabbed yet.
+        """
+        with self._lock:
+            return self._latest
+
+    async def wait_for_frame(self, after_sequence: int = 0) -> Optional[Frame]:
+        """
+        Waits until a frame newer than the given sequence number is available.
+
+        :param after_sequence: The sequence number of the last frame the caller has seen.
+        :return: The newest frame or None if the grabber was stopped before a new frame arrived.
+        """
+        while True:
+            frame = self.latest()
+            if frame is not None and frame.sequence > after_sequence:
+                return frame
+            if not self.is_running():
+                return None
+            await self._frame_event.wait()
+
+    def _grab_frames(self) -> None:
+        logger.debug('Frame grabber thread started.')
+        while self._running.is_set():
+            try:
+                success, image = self.capture.read()
+            except error:
+                # Rarely throws for some unknown reason, ignore it for now. A camera that keeps failing must not make
+                # this thread spin though.
+                sleep(READ_RETRY_DELAY)
+                continue
+            if not success:
+                if not self.capture.isOpened():
+                    break
+                # Don't spin on a capture that temporarily fails to deliver frames.
+                sleep(READ_RETRY_DELAY)
+                continue
+
+            timestamp = monotonic()
+            with self._lock:
+                self._sequence += 1
+                frame = Frame(image=image, sequence=self._sequence, timestamp=timestamp)
+                self._latest = frame
+
+            try:
+                self._loop.call_soon_threadsafe(self._on_frame_grabbed, frame)
+            except RuntimeError:
+                # The event loop was closed, nobody is left to consume frames.
+                break
+
+        self._running.clear()
+        try:
+            self._loop.call_soon_threadsafe(self._notify_waiters)
+        except RuntimeError:
+            pass
+        logger.debug('Frame grabber thread stopped.')
+
+    def _on_frame_grabbed(self, frame: Frame) -> None:
+        self._notify_waiters()
+        if self._on_frame is not None:
+            self._on_frame(frame)
+
+    def _notify_waiters(self) -> None:
+        # Must only be called on the event loop's thread.
+        event = self._frame_event
+        self._frame_event = asyncio.Event()
+        event.set()
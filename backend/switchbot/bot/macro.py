@@ -0,0 +1,276 @@
+import asyncio
+import json
+import logging
+import math
+from dataclasses import dataclass, field
+from enum import Enum
+from pathlib import Path
+from time import monotonic
+from typing import List, Optional, Dict, Tuple, Callable
+
+from dataclasses_json import dataclass_json
+
+from .controller_state import ControllerState
+from .serial_connector import SerialConnector, TAP_DURATION
+from .serial_protocol import ControllerMacroStep, MAX_MACRO_STEPS, MAX_MACRO_STEP_DELAY_MS
+
+# Sleeping is only accurate to about a millisecond, so the last part of the wait for a step is spent yielding to
+# the event loop until the step is due instead.
+SPIN_DURATION = 0.002
+
+
+class MacroAction(Enum):
+    TAP = 'tap'
+    HOLD = 'hold'
+    RELEASE = 'release'
+    STICK = 'stick'
+
+
+@dataclass_json
+@dataclass(kw_only=True)
+class MacroStep:
+    """
+    A single controller action of a macro.
+    """
+    # Seconds from the start of the macro at which the action is executed.
+    offset: float
+    action: MacroAction
+    # Button names as used by the serial protocol, for TAP, HOLD and RELEASE.
+    buttons: List[str] = field(default_factory=list)
+    # L or R, for STICK.
+    stick: Optional[str] = None
+    angle: float = 0.0
+    radius: float = 0.0
+    # Logged when the step is executed.
+    label: Optional[str] = None
+
+
+@dataclass_json
+@dataclass(kw_only=True)
+class Macro:
+    """
+    A fixed sequence of controller actions, each executed at a given time after the macro was started.
+    """
+    name: str
+    steps: List[MacroStep]
+    # Seconds from the start until the macro is finished, which may be later than the last step.
+    duration: float
+
+    def compile(self, initial_state: ControllerState) -> Tuple[List[ControllerMacroStep], ControllerState]:
+        """
+        Converts the macro to the steps stored on the controller, each containing the full state of the controller.
+        Taps are split into a press and a release TAP_DURATION later.
+
+        :param initial_state: The state of the controller before the macro is played.
+        :return: The steps and the state of the controller after playing them.
+        """
+        # Millisecond offsets and changes to the state at that time, in the order they were added.
+        changes: List[Tuple[int, Callable[[ControllerState], None]]] = []
+        for step in self.steps:
+            offset_ms = round(step.offset * 1000)
+            if step.action == MacroAction.TAP:
+                for button in step.buttons:
+                    changes.append((offset_ms, lambda state, name=button: state.set_pressed(name, True)))
+                    changes.append((offset_ms + round(TAP_DURATION * 1000),
+                                    lambda state, name=button: state.set_pressed(name, False)))
+            elif step.action in (MacroAction.HOLD, MacroAction.RELEASE):
+                pressed = step.action == MacroAction.HOLD
+                for button in step.buttons:
+                    changes.append((offset_ms, lambda state, name=button, down=pressed: state.set_pressed(name, down)))
+            elif step.action == MacroAction.STICK:
+                position = SerialConnector.polar_to_cartesian_joystick(step.angle, step.radius)
+                attribute = 'left_stick' if step.stick == 'L' else 'right_stick'
+                changes.append((offset_ms, lambda state, name=attribute, value=position: setattr(state, name, value)))
+        # The last step marks the end of the macro, so the controller reports it as finished at the right time.
+        changes.append((max([round(self.duration * 1000)] + [offset for offset, _ in changes]), lambda state: None))
+        # Sorting is stable, so changes at the same time are still applied in the order they were added.
+        changes.sort(key=lambda change: change[0])
+
+        state = initial_state.copy()
+        compiled: List[ControllerMacroStep] = []
+        previous_ms = 0
+        for index, (offset_ms, change) in enumerate(changes):
+            change(state)
+            # All changes at the same millisecond form a single step.
+            if index + 1 < len(changes) and changes[index + 1][0] == offset_ms:
+                continue
+            delay_ms = offset_ms - previous_ms
+            # Longer pauses are split into steps that don't change anything.
+            while delay_ms > MAX_MACRO_STEP_DELAY_MS:
+                compiled.append(ControllerMacroStep(delay_ms=MAX_MACRO_STEP_DELAY_MS,
+                                                    report=compiled[-1].report if compiled
+                                                    else initial_state.to_report()))
+                delay_ms -= MAX_MACRO_STEP_DELAY_MS
+            compiled.append(ControllerMacroStep(delay_ms=delay_ms, report=state.to_report()))
+            previous_ms = offset_ms
+        return compiled, state
+
+    def save(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(self.to_dict(encode_json=True), indent=2), encoding='utf-8')
+
+    @staticmethod
+    def load(path: Path) -> 'Macro':
+        return Macro.from_dict(json.loads(path.read_text(encoding='utf-8')))
+
+
+class MacroBuilder:
+    """
+    Builds a macro from actions and the pauses between them, similar to how sequences of taps and sleeps are written.
+    """
+
+    def __init__(self, name: str):
+        self.name: str = name
+        self._steps: List[MacroStep] = []
+        self._offset: float = 0.0
+
+    def tap(self, *buttons: str, label: Optional[str] = None) -> 'MacroBuilder':
+        return self._add(MacroStep(offset=self._offset, action=MacroAction.TAP, buttons=list(buttons), label=label))
+
+    def hold(self, *buttons: str, label: Optional[str] = None) -> 'MacroBuilder':
+        return self._add(MacroStep(offset=self._offset, action=MacroAction.HOLD, buttons=list(buttons), label=label))
+
+    def release(self, *buttons: str, label: Optional[str] = None) -> 'MacroBuilder':
+        return self._add(MacroStep(offset=self._offset, action=MacroAction.RELEASE, buttons=list(buttons),
+                                   label=label))
+
+    def stick(self, stick: str, angle: float, radius: float, label: Optional[str] = None) -> 'MacroBuilder':
+        return self._add(MacroStep(offset=self._offset, action=MacroAction.STICK, stick=stick, angle=angle,
+                                   radius=radius, label=label))
+
+    def wait(self, seconds: float) -> 'MacroBuilder':
+        self._offset += seconds
+        return self
+
+    def build(self) -> Macro:
+        return Macro(name=self.name, steps=list(self._steps), duration=self._offset)
+
+    def _add(self, step: MacroStep) -> 'MacroBuilder':
+        self._steps.append(step)
+        return self
+
+
+class MacroPlayer:
+    """
+    Executes macros against a monotonic clock.
+
+    Every step is scheduled relative to the start of the macro rather than to the previous step. A step that is
+    executed late therefore does not delay the following steps, which catch up instead of accumulating lateness.
+
+    If the controller supports it, the whole macro is uploaded to the controller and played there instead, so
+    neither the serial connection nor the event loop affect the timing of the steps.
+    """
+
+    def __init__(self, serial: SerialConnector, logger: Optional[logging.Logger] = None, on_controller: bool = True):
+        self.serial: SerialConnector = serial
+        self.on_controller: bool = on_controller
+        self.logger: logging.Logger = logger if logger is not None else logging.getLogger('MacroPlayer')
+        # Lateness of the steps of the last played macro in seconds.
+        self.max_lateness: float = 0.0
+        self.mean_lateness: float = 0.0
+
+    async def play(self, macro: Macro) -> None:
+        if self.on_controller and self.serial.supports_macros():
+            compiled, final_state = macro.compile(self.serial.state)
+            if len(compiled) <= MAX_MACRO_STEPS:
+                await self._play_on_controller(macro, compiled, final_state)
+                return
+            self.logger.debug(f'Macro "{macro.name}" has too many steps to be stored on the controller.')
+        await self._play_on_host(macro)
+
+    async def _play_on_controller(self,
+                                  macro: Macro,
+                                  compiled: List[ControllerMacroStep],
+                                  final_state: ControllerState) -> None:
+        self.logger.debug(f'Playing macro "{macro.name}" with {len(compiled)} steps on the controller.')
+        await self.serial.upload_macro(compiled)
+        # Labels are only informational, so logging them with host timing is good enough.
+        label_task = asyncio.ensure_future(self._log_labels(macro, monotonic()))
+        try:
+            # Leave some time for the serial connection on top of the macro itself.
+            finished = await self.serial.play_uploaded_macro(timeout=macro.duration + 5.0)
+        finally:
+            label_task.cancel()
+        self.serial.assume_state(final_state)
+        self.max_lateness = 0.0
+        self.mean_lateness = 0.0
+        if not finished:
+            self.logger.warning(f'Controller did not report that macro "{macro.name}" finished.')
+
+    async def _log_labels(self, macro: Macro, start_time: float) -> None:
+        for step in sorted(macro.steps, key=lambda macro_step: macro_step.offset):
+            if step.label is not None:
+                await self._wait_until(start_time + step.offset)
+                self.logger.info(step.label)
+
+    async def _play_on_host(self, macro: Macro) -> None:
+        self.logger.debug(f'Playing macro "{macro.name}" with {len(macro.steps)} steps.')
+        start_time = monotonic()
+        latenesses: List[float] = []
+        for step in sorted(macro.steps, key=lambda macro_step: macro_step.offset):
+            await self._wait_until(start_time + step.offset)
+            latenesses.append(monotonic() - start_time - step.offset)
+            if step.label is not None:
+                self.logger.info(step.label)
+            self._execute(step)
+        await self._wait_until(start_time + macro.duration)
+
+        self.max_lateness = max(latenesses, default=0.0)
+        self.mean_lateness = sum(latenesses) / len(latenesses) if latenesses else 0.0
+        self.logger.debug(f'Finished macro "{macro.name}", steps were up to {self.max_lateness * 1000:.1f} ms late.')
+
+    @staticmethod
+    async def _wait_until(deadline: float) -> None:
+        remaining_time = deadline - monotonic()
+        if remaining_time > SPIN_DURATION:
+            await asyncio.sleep(remaining_time - SPIN_DURATION)
+        while monotonic() < deadline:
+            await asyncio.sleep(0)
+
+    def _execute(self, step: MacroStep) -> None:
+        if step.action == MacroAction.TAP:
+            for button in step.buttons:
+                self.serial.tap(button)
+        elif step.action == MacroAction.HOLD:
+            self.serial.hold(*step.buttons)
+        elif step.action == MacroAction.RELEASE:
+            self.serial.release(*step.buttons)
+        elif step.action == MacroAction.STICK:
+            if step.stick == 'L':
+                self.serial.set_left_joystick(step.angle, step.radius)
+            else:
+                self.serial.set_right_joystick(step.angle, step.radius)
+
+
+class MacroRecorder:
+    """
+    Records manual controller input as a macro that can be played back later.
+    """
+
+    def __init__(self, name: str):
+        self.name: str = name
+        self._start_time: float = monotonic()
+        self._steps: List[MacroStep] = []
+        # Last recorded position per stick, to skip the many identical positions a joystick in the UI sends.
+        self._stick_positions: Dict[str, tuple[float, float]] = {}
+
+    def record_tap(self, button: str) -> None:
+        self._steps.append(MacroStep(offset=self._elapsed(), action=MacroAction.TAP, buttons=[button]))
+
+    def record_stick(self, stick: str, angle: float, radius: float) -> None:
+        position = (angle, radius)
+        previous = self._stick_positions.get(stick)
+        if previous is not None and math.isclose(previous[0], angle) and math.isclose(previous[1], radius):
+            return
+        self._stick_positions[stick] = position
+        self._steps.append(MacroStep(offset=self._elapsed(), action=MacroAction.STICK, stick=stick, angle=angle,
+                                     radius=radius))
+
+    def stop(self) -> Macro:
+        """
+        :return: The recorded macro, ending at the time it was stopped.
+        """
+        return Macro(name=self.name, steps=list(self._steps), duration=self._elapsed())
+
+    def _elapsed(self) -> float:
+        return monotonic() - self._start_time
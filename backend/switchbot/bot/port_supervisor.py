@@ -0,0 +1,114 @@
+import asyncio
+import logging
+from typing import Optional, Dict
+
+from serial import SerialException
+
+from .serial_connector import SerialConnector, ConnectionState
+
+logger = logging.getLogger('PortSupervisor')
+
+
+class PortSupervisor:
+    """
+    Watches the connection of a SerialConnector in the background and re-establishes it after it was lost.
+
+    Write and read errors mark the connection as lost right away. Since unplugging the controller does not always
+    cause an error until the next write, the list of serial ports is checked every poll_interval seconds as well.
+    Reconnect attempts are repeated with an exponentially growing delay until the controller is back.
+    """
+
+    def __init__(self,
+                 serial: SerialConnector,
+                 poll_interval: float = 1.0,
+                 initial_backoff: float = 0.5,
+                 max_backoff: float = 10.0):
+        self.serial: SerialConnector = serial
+        self.poll_interval: float = poll_interval
+        self.initial_backoff: float = initial_backoff
+        self.max_backoff: float = max_backoff
+        # Failed reconnect attempts since the connection was lost.
+        self.reconnect_attempts: int = 0
+        self.reconnects: int = 0
+        self._backoff: float = initial_backoff
+        self._task: Optional[asyncio.Task] = None
+        self._wake_up: Optional[asyncio.Event] = None
+        serial.add_connection_listener(self._on_connection_state)
+
+    def start(self) -> None:
+        """
+        Starts supervising on the running event loop. Does nothing if already started.
+        """
+        if self._task is None:
+            self._wake_up = asyncio.Event()
+            self._task = asyncio.ensure_future(self._supervise())
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+        self._task = None
+
+    def statistics(self) -> Dict[str, int]:
+        return {
+            'reconnects': self.reconnects,
+            'reconnect_attempts': self.reconnect_attempts,
+        }
+
+    def _on_connection_state(self, connection_state: ConnectionState) -> None:
+        if connection_state != ConnectionState.CONNECTED:
+            # Only count the attempts of the current outage.
+            self.reconnect_attempts = 0
+            self._backoff = self.initial_backoff
+        if self._wake_up is not None:
+            self._wake_up.set()
+
+    async def _supervise(self) -> None:
+        while True:
+            try:
+                if self.serial.connection_state == ConnectionState.CONNECTED:
+                    await self._check_port()
+                elif self.serial.connection_state == ConnectionState.RECONNECTING:
+                    await self._try_reconnect()
+                else:
+                    await self._sleep(self.poll_interval)
+            except asyncio.CancelledError:
+                raise
+            except Exception as exception:
+                logger.exception(f'Supervising the serial connection failed: {exception}')
+                await self._sleep(self.poll_interval)
+
+    async def _check_port(self) -> None:
+        port_identifier = self.serial.port_identifier
+        # Enumerating ports can take a while on some platforms, so don't block the event loop with it.
+        ports = await asyncio.get_event_loop().run_in_executor(None, SerialConnector.list_serial_ports)
+        if self.serial.connection_state == ConnectionState.CONNECTED \
+                and self.serial.port_identifier == port_identifier and port_identifier not in ports:
+            self.serial.mark_connection_lost('Port disappeared')
+            return
+        await self._sleep(self.poll_interval)
+
+    async def _try_reconnect(self) -> None:
+        try:
+            await self.serial.reconnect()
+        except (SerialException, OSError) as exception:
+            self.reconnect_attempts += 1
+            logger.info(f'Reconnect attempt {self.reconnect_attempts} failed, retrying in {self._backoff:.1f}s: '
+                        f'{exception}')
+            delay = self._backoff
+            self._backoff = min(self._backoff * 2, self.max_backoff)
+            await self._sleep(delay)
+            return
+
+        if self.serial.connection_state == ConnectionState.CONNECTED:
+            self.reconnects += 1
+            logger.info(f'Reconnected to port "{self.serial.port_identifier}"')
+
+    async def _sleep(self, seconds: float) -> None:
+        """
+        Waits for the given time or until the connection state changes.
+        """
+        self._wake_up.clear()
+        try:
+            await asyncio.wait_for(self._wake_up.wait(), seconds)
+        except asyncio.TimeoutError:
+            pass
@@ -1,26 +1,203 @@
+import asyncio
 import logging
+from enum import Enum
 from math import sin, cos
-from typing import Optional, List
+from time import monotonic
+from typing import Optional, List, Dict, Callable, Tuple
 
 import serial
-from serial import Serial
+from serial import Serial, SerialException
 from serial.tools.list_ports import comports
 from serial.tools.list_ports_common import ListPortInfo
 
+from .ack_sender import AckSender
+from .controller_state import ControllerState
+from .serial_protocol import SerialProtocol, ControllerReport, parse_firmware_version, BINARY_PROTOCOL_MIN_VERSION, \
+    MACRO_MIN_VERSION, ACK_MIN_VERSION, ControllerMacroStep, encode_macro, MACRO_STORED_PREFIX, MACRO_REJECTED_LINE, \
+    MACRO_FINISHED_LINE, MACRO_STOPPED_LINE
+from .serial_reader import SerialReader
+from .serial_writer import SerialWriter, BackpressurePolicy, PendingCommand, SerialQueueFullError, \
+    create_command_future
+from .stick_coalescer import StickCoalescer
+
 logger = logging.getLogger('SerialConnector')
 
+# How long a button is held when tapping it using binary reports, same as PRESS_DELAY_MILLIS in the firmware.
+TAP_DURATION = 0.05
+
+
+class ConnectionState(Enum):
+    DISCONNECTED = 'disconnected'
+    CONNECTED = 'connected'
+    # The connection was lost unexpectedly and is waiting to be established again, see PortSupervisor.
+    RECONNECTING = 'reconnecting'
+
+
+class OutagePolicy(Enum):
+    """
+    Decides what happens to commands sent while the connection is being re-established.
+    """
+    # Keep up to max_queue_size commands, dropping the oldest ones, and send them once reconnected.
+    BUFFER = 'buffer'
+    # Resolve the futures of the commands to False right away.
+    FAIL = 'fail'
+
 
 class SerialConnector:
     """
     Handles writing Switch-specific commands over a serial connection.
+
+    Commands are written by a SerialWriter on a separate thread, so none of the methods sending commands block.
+    They return a future that resolves once the command was written instead.
+
+    Joystick positions are sent at most max_stick_rate_hz times per second per stick, see StickCoalescer.
+
+    If the controller's firmware supports it, the compact binary protocol is used instead of the text protocol.
+    It sends the full state of the controller as a fixed-size report for every change.
+
+    Buttons can be held and released in any combination by changing the state and flushing it, see hold and release.
+
+    Firmware supporting it can also store a whole macro and play it without any further communication,
+    see upload_macro.
+
+    If ack_window is set and the firmware supports it, commands are acknowledged by the controller and sent again
+    if they got lost, see AckSender. The futures returned for commands then resolve once the command was executed.
+
+    If reading or writing fails, the connection is marked as lost instead of raising to the programs sending
+    commands. Commands sent until it is re-established are handled according to the outage policy, and the
+    full controller state is sent again after reconnecting. A PortSupervisor reconnects automatically.
     """
 
-    def __init__(self):
+    def __init__(self,
+                 max_queue_size: int = 64,
+                 backpressure: BackpressurePolicy = BackpressurePolicy.COALESCE,
+                 max_stick_rate_hz: float = 60.0,
+                 prefer_binary_protocol: bool = True,
+                 ack_window: int = 0,
+                 ack_timeout: float = 1.0,
+                 outage_policy: OutagePolicy = OutagePolicy.BUFFER):
         self.port_identifier: Optional[str] = None
         self.serial: Optional[Serial] = None
+        self.writer: Optional[SerialWriter] = None
+        self.reader: Optional[SerialReader] = None
+        self.acks: Optional[AckSender] = None
+        self.ack_window: int = ack_window
+        self.ack_timeout: float = ack_timeout
+        self.max_queue_size: int = max_queue_size
+        self.backpressure: BackpressurePolicy = backpressure
+        self.prefer_binary_protocol: bool = prefer_binary_protocol
+        self.protocol: SerialProtocol = SerialProtocol.TEXT
+        self.firmware_version: Optional[int] = None
+        self.connection_state: ConnectionState = ConnectionState.DISCONNECTED
+        self.outage_policy: OutagePolicy = outage_policy
+        # Sends a command that arrived during an outage, paired with the future returned for it, oldest first.
+        self._buffered: List[Tuple[Callable[[], asyncio.Future], asyncio.Future]] = []
+        # Resolves once the state changed during an outage was sent after reconnecting.
+        self._outage_flush: Optional[asyncio.Future] = None
+        self._connection_listeners: List[Callable[[ConnectionState], None]] = []
+        # The state programs change and the state that was last flushed to the controller.
+        self.state: ControllerState = ControllerState()
+        self._sent_state: ControllerState = ControllerState()
+        self._report_sequence: int = 0
+        # Releases the buttons tapped using the binary protocol, by button name.
+        self._tap_releases: Dict[str, asyncio.TimerHandle] = {}
+        self.left_stick: StickCoalescer = StickCoalescer(lambda x, y: self._write_stick('L', x, y),
+                                                         max_stick_rate_hz)
+        self.right_stick: StickCoalescer = StickCoalescer(lambda x, y: self._write_stick('R', x, y),
+                                                          max_stick_rate_hz)
 
     def connect(self, port_identifier: str) -> None:
-        self.serial = Serial(
+        if self.connection_state != ConnectionState.DISCONNECTED:
+            self.disconnect()
+
+        port, firmware_version = self._open_port(port_identifier)
+        self._use_port(port_identifier, port, firmware_version)
+        # The controller starts without any inputs after connecting.
+        self.state = ControllerState()
+        self._sent_state = ControllerState()
+        self._start_io()
+        self._set_connection_state(ConnectionState.CONNECTED)
+
+    async def reconnect(self) -> None:
+        """
+        Opens the port used before again without blocking the event loop, then sends the commands buffered
+        during the outage and the full controller state.
+
+        :raises SerialException: If the port can't be opened, such as while the controller is still unplugged.
+        """
+        if self.connection_state == ConnectionState.CONNECTED:
+            self.mark_connection_lost('Reconnect requested')
+        if self.connection_state != ConnectionState.RECONNECTING:
+            raise Exception('Serial connection was not opened yet')
+
+        logger.info(f'Reconnecting to port "{self.port_identifier}"')
+        port_identifier = self.port_identifier
+        port, firmware_version = await asyncio.get_event_loop().run_in_executor(None, self._open_port,
+                                                                                port_identifier)
+        if self.connection_state != ConnectionState.RECONNECTING or self.port_identifier != port_identifier:
+            # Disconnected or connected to another port while opening.
+            port.close()
+            return
+
+        self._use_port(port_identifier, port, firmware_version)
+        # The controller might have been reset while it was gone, so send the full state instead of the changes.
+        self._sent_state = ControllerState()
+        self._start_io()
+        self._set_connection_state(ConnectionState.CONNECTED)
+        buffered = self._buffered
+        self._buffered = []
+        for send, future in buffered:
+            # Resolved by whoever sent the command, because it is no use anymore after the outage.
+            if future.done():
+                continue
+            try:
+                self._forward_result(send(), future)
+            except SerialQueueFullError:
+                self._resolve(future, False)
+        outage_flush = self._outage_flush
+        self._outage_flush = None
+        future = self.flush()
+        if outage_flush is not None:
+            self._forward_result(future, outage_flush)
+
+    def mark_connection_lost(self, reason: str) -> None:
+        """
+        Closes the port after it failed or disappeared, but remembers it so it can be reconnected.
+        """
+        if self.connection_state != ConnectionState.CONNECTED:
+            return
+        logger.warning(f'Lost connection to port "{self.port_identifier}": {reason}')
+
+        # Sequenced commands are only valid for the old connection and are failed by the AckSender instead.
+        keep_unwritten = self.outage_policy == OutagePolicy.BUFFER and self.acks is None
+        for command in self._stop_io(keep_unwritten):
+            self._buffer(lambda data=command.data, key=command.coalesce_key: self.writer.submit(data, key),
+                         command.future)
+        self._set_connection_state(ConnectionState.RECONNECTING)
+
+    def add_connection_listener(self, listener: Callable[[ConnectionState], None]) -> None:
+        """
+        Calls the listener on the event loop's thread whenever the connection state changes.
+        """
+        self._connection_listeners.append(listener)
+
+    def remove_connection_listener(self, listener: Callable[[ConnectionState], None]) -> None:
+        if listener in self._connection_listeners:
+            self._connection_listeners.remove(listener)
+
+    def _set_connection_state(self, connection_state: ConnectionState) -> None:
+        self.connection_state = connection_state
+        for listener in list(self._connection_listeners):
+            try:
+                listener(connection_state)
+            except Exception as exception:
+                logger.error(f'Connection listener failed: {exception}')
+
+    def _open_port(self, port_identifier: str) -> Tuple[Serial, Optional[int]]:
+        """
+        Opens the port and asks the controller for its firmware version. Blocks for up to a second.
+        """
+        port = Serial(
             port=port_identifier,
             baudrate=115200,
             bytesize=serial.EIGHTBITS,
@@ -28,93 +205,392 @@ class SerialConnector:
             stopbits=serial.STOPBITS_ONE,
             timeout=1
         )
+        try:
+            return port, self._query_firmware_version(port)
+        except (SerialException, OSError):
+            port.close()
+            raise
+
+    def _use_port(self, port_identifier: str, port: Serial, firmware_version: Optional[int]) -> None:
         self.port_identifier = port_identifier
-        logger.info(f'Connected to port "{self.port_identifier}".')
+        self.serial = port
+        self.firmware_version = firmware_version
+        # Querying the version made the controller forget the sequence numbers of earlier reports.
+        self._report_sequence = 0
+        use_binary = (self.prefer_binary_protocol and firmware_version is not None
+                      and firmware_version >= BINARY_PROTOCOL_MIN_VERSION)
+        self.protocol = SerialProtocol.BINARY if use_binary else SerialProtocol.TEXT
+
+    def _start_io(self) -> None:
+        loop = asyncio.get_event_loop()
+        self.writer = SerialWriter(self.serial, loop, self.max_queue_size, self.backpressure,
+                                   on_error=self._on_io_error)
+        self.writer.start()
+        self.reader = SerialReader(self.serial, loop, on_error=self._on_io_error)
+        self.reader.start()
+        if self.ack_window > 0:
+            self._enable_acks()
+        logger.info(f'Connected to port "{self.port_identifier}" using the {self.protocol.value} protocol'
+                    f'{" with acknowledgements" if self.acks is not None else ""}.')
+
+    def _stop_io(self, keep_unwritten: bool) -> List[PendingCommand]:
+        """
+        Stops reading and writing and closes the port.
 
-    def is_connected(self) -> None:
+        :param keep_unwritten: Whether to return the commands that were not written yet instead of dropping them.
+        """
+        unwritten: List[PendingCommand] = []
+        if self.acks is not None:
+            self.acks.stop()
+        self.acks = None
+        # Stop writing before closing the port so the writer thread doesn't write to a closed port.
+        if self.writer is not None:
+            if keep_unwritten:
+                unwritten = self.writer.take_pending()
+            self.writer.stop()
+        self.writer = None
+        if self.reader is not None:
+            self.reader.stop()
+        self.reader = None
+        if self.serial is not None and not self.serial.closed:
+            try:
+                self.serial.close()
+            except (SerialException, OSError) as exception:
+                logger.debug(f'Failed to close port: {exception}')
+        self.serial = None
+        return unwritten
+
+    def _on_io_error(self, exception: BaseException) -> None:
+        self.mark_connection_lost(str(exception))
+
+    def _enable_acks(self) -> None:
+        if self.firmware_version is None or self.firmware_version < ACK_MIN_VERSION:
+            logger.warning(f'Controller firmware version {self.firmware_version} does not acknowledge commands.')
+            return
+        self.writer.submit(self._encode_command('K1'))
+        self.acks = AckSender(self.writer, self.reader, asyncio.get_event_loop(), self.ack_window, self.ack_timeout,
+                              max_queue_size=self.max_queue_size, policy=self.backpressure)
+
+    @staticmethod
+    def _query_firmware_version(port: Serial) -> Optional[int]:
+        """
+        Asks the controller for its firmware version to find out whether it understands binary reports and macros.
+        Must be called before the writer is started since it writes to the port directly.
+        """
+        port.reset_input_buffer()
+        port.write(b'V\n')
+        # The firmware might print other diagnostics before the version, so look at all lines for a short while.
+        deadline = monotonic() + 1.0
+        while monotonic() < deadline:
+            line = port.readline().decode('ascii', errors='replace')
+            version = parse_firmware_version(line)
+            if version is not None:
+                return version
+
+        logger.warning('Controller did not report its firmware version, falling back to the text protocol.')
+        return None
+
+    def is_connected(self) -> bool:
         return self.serial is not None
 
     def disconnect(self) -> None:
         logger.info(f'Disconnecting from port {self.port_identifier}')
 
-        if self.serial is not None and not self.serial.closed:
-            self.serial.close()
+        self.left_stick.cancel()
+        self.right_stick.cancel()
+        self._cancel_tap_release(*list(self._tap_releases))
+        self._stop_io(keep_unwritten=False)
+        buffered = self._buffered
+        self._buffered = []
+        for _, future in buffered:
+            self._resolve(future, False)
+        if self._outage_flush is not None:
+            self._resolve(self._outage_flush, False)
+        self._outage_flush = None
         self.port_identifier = None
-        self.serial = None
+        self._set_connection_state(ConnectionState.DISCONNECTED)
 
-    def reconnect(self) -> None:
-        logger.info(f'Reconnecting to port "{self.port_identifier}"')
+    def tap_a(self) -> asyncio.Future:
+        return self._write_tap_command('A')
 
-        original_port_identifier = self.port_identifier
-        self.disconnect()
-        self.connect(original_port_identifier)
+    def tap_b(self) -> asyncio.Future:
+        return self._write_tap_command('B')
 
-    def tap_a(self) -> None:
-        self._write_tap_command('A')
+    def tap_x(self) -> asyncio.Future:
+        return self._write_tap_command('X')
 
-    def tap_b(self) -> None:
-        self._write_tap_command('B')
+    def tap_y(self) -> asyncio.Future:
+        return self._write_tap_command('Y')
 
-    def tap_x(self) -> None:
-        self._write_tap_command('X')
+    def tap_home(self) -> asyncio.Future:
+        return self._write_tap_command('H')
 
-    def tap_y(self) -> None:
-        self._write_tap_command('Y')
+    def tap_minus(self) -> asyncio.Future:
+        return self._write_tap_command('M')
 
-    def tap_home(self) -> None:
-        self._write_tap_command('H')
+    def tap_plus(self) -> asyncio.Future:
+        return self._write_tap_command('P')
 
-    def tap_minus(self) -> None:
-        self._write_tap_command('M')
+    def tap_capture(self) -> asyncio.Future:
+        return self._write_tap_command('C')
 
-    def tap_plus(self) -> None:
-        self._write_tap_command('P')
+    def tap_l(self) -> asyncio.Future:
+        return self._write_tap_command('L')
 
-    def tap_capture(self) -> None:
-        self._write_tap_command('C')
+    def tap_r(self) -> asyncio.Future:
+        return self._write_tap_command('R')
 
-    def tap_l(self) -> None:
-        self._write_tap_command('L')
+    def tap_zl(self) -> asyncio.Future:
+        return self._write_tap_command('ZL')
 
-    def tap_r(self) -> None:
-        self._write_tap_command('R')
+    def tap_zr(self) -> asyncio.Future:
+        return self._write_tap_command('ZR')
 
-    def tap_zl(self) -> None:
-        self._write_tap_command('ZL')
+    def tap_left(self) -> asyncio.Future:
+        return self._write_tap_command('DL')
 
-    def tap_zr(self) -> None:
-        self._write_tap_command('ZR')
+    def tap_right(self) -> asyncio.Future:
+        return self._write_tap_command('DR')
 
-    def tap_left(self) -> None:
-        self._write_tap_command('DL')
+    def tap_up(self) -> asyncio.Future:
+        return self._write_tap_command('DU')
 
-    def tap_right(self) -> None:
-        self._write_tap_command('DR')
+    def tap_down(self) -> asyncio.Future:
+        return self._write_tap_command('DD')
 
-    def tap_up(self) -> None:
-        self._write_tap_command('DU')
+    async def test_connection(self, timeout: float = 1.0) -> Optional[str]:
+        """
+        :return: The version line printed by the controller or None if it did not respond in time.
+        """
+        return await self._write_and_wait_for_line(self._encode_command('V'),
+                                                   lambda line: parse_firmware_version(line) is not None,
+                                                   timeout)
 
-    def tap_down(self) -> None:
-        self._write_tap_command('DD')
+    def supports_macros(self) -> bool:
+        # Macros are only uploaded while connected, so programs fall back to sending the steps during an outage.
+        return (self.connection_state == ConnectionState.CONNECTED
+                and self.firmware_version is not None and self.firmware_version >= MACRO_MIN_VERSION)
 
-    def test_connection(self) -> str:
-        self.write_command('V')
-        return self.serial.readline().decode('ascii', errors='strict')
+    async def upload_macro(self, steps: List[ControllerMacroStep], timeout: float = 2.0) -> None:
+        """
+        Stores a macro on the controller with a single transfer, replacing any macro stored before.
 
-    def _write_tap_command(self, button_name: str) -> None:
-        self.write_command(f'T{button_name}')
+        :raises ValueError: If the macro has too many steps or a delay that is too long.
+        :raises Exception: If the controller does not support macros or rejected the macro.
+        """
+        if not self.supports_macros():
+            raise Exception(f'Controller firmware version {self.firmware_version} does not support macros')
+
+        line = await self._write_and_wait_for_line(
+            encode_macro(steps),
+            lambda received: received.startswith(MACRO_STORED_PREFIX) or received == MACRO_REJECTED_LINE,
+            timeout)
+        if line is None or line == MACRO_REJECTED_LINE:
+            raise Exception(f'Controller did not accept macro with {len(steps)} steps: {line}')
+
+    async def play_uploaded_macro(self, timeout: Optional[float] = None) -> bool:
+        """
+        Plays the macro stored on the controller and waits until the controller reports that it is done.
+        The controller executes every step itself, so the timing does not depend on this computer at all.
+
+        :return: True if the macro was played until the end, False if it was stopped or did not finish in time.
+        """
+        line = await self._write_and_wait_for_line(
+            self._encode_command('P'),
+            lambda received: received in (MACRO_FINISHED_LINE, MACRO_STOPPED_LINE),
+            timeout)
+        return line == MACRO_FINISHED_LINE
+
+    def stop_macro(self) -> asyncio.Future:
+        return self.write_command('Q')
+
+    async def _write_and_wait_for_line(self,
+                                       data: bytes,
+                                       predicate: Callable[[str], bool],
+                                       timeout: Optional[float]) -> Optional[str]:
+        """
+        Writes data and waits for the first line printed by the controller afterwards that matches the predicate.
 
-    def set_left_joystick(self, angle: float, radius: float) -> None:
+        :return: The matching line or None if no line matched in time or the connection was lost meanwhile.
+        """
+        if self.connection_state != ConnectionState.CONNECTED:
+            raise SerialException(f'Serial connection is {self.connection_state.value}')
+
+        response: asyncio.Future = asyncio.get_event_loop().create_future()
+        written: Optional[asyncio.Future] = None
+        # Losing the connection replaces the reader, so remember the one the listener is added to.
+        reader = self.reader
+
+        def on_line(line: str) -> None:
+            if not response.done() and predicate(line):
+                response.set_result(line)
+
+        def on_connection_state(_: ConnectionState) -> None:
+            # The response is lost with the connection, so don't send the data again after reconnecting either.
+            if written is not None:
+                self._resolve(written, False)
+            if not response.done():
+                response.set_result(None)
+
+        # Listen before writing so a fast response can't be missed.
+        reader.add_listener(on_line)
+        self.add_connection_listener(on_connection_state)
+        try:
+            written = self.writer.submit(data)
+            if not await written:
+                return None
+            return await asyncio.wait_for(response, timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            reader.remove_listener(on_line)
+            self.remove_connection_listener(on_connection_state)
+
+    def tap(self, button_name: str) -> asyncio.Future:
+        """
+        Taps a button given by its name in the serial protocol, such as A, ZL or DU.
+        """
+        return self._write_tap_command(button_name)
+
+    def _write_tap_command(self, button_name: str) -> asyncio.Future:
+        if self.protocol == SerialProtocol.BINARY:
+            # Every tap needs its own press, so a button that is still down from an earlier tap is released first
+            # instead of the tap being lost in an unchanged state.
+            self._cancel_tap_release(button_name)
+            if self.state.is_pressed(button_name):
+                self.release(button_name)
+            future = self.hold(button_name)
+            self._tap_releases[button_name] = asyncio.get_event_loop().call_later(
+                TAP_DURATION, self._release_tapped, button_name)
+            return future
+        return self.write_command(f'T{button_name}')
+
+    def _release_tapped(self, button_name: str) -> None:
+        self._tap_releases.pop(button_name, None)
+        self.release(button_name)
+
+    def _cancel_tap_release(self, *button_names: str) -> None:
+        for button_name in button_names:
+            timer = self._tap_releases.pop(button_name, None)
+            if timer is not None:
+                timer.cancel()
+
+    def hold(self, *button_names: str) -> asyncio.Future:
+        """
+        Presses the given buttons until they are released. All of them are pressed at the same time.
+
+        :param button_names: The names of the buttons as used by the serial protocol, such as A, ZL or DU.
+        :return: A future resolving to True once the change was written or to False if it was dropped.
+        """
+        # A button that is held is not released anymore by an earlier tap.
+        self._cancel_tap_release(*button_names)
+        for button_name in button_names:
+            self.state.set_pressed(button_name, True)
+        return self.flush()
+
+    def release(self, *button_names: str) -> asyncio.Future:
+        """
+        Releases the given buttons at the same time.
+        """
+        for button_name in button_names:
+            self.state.set_pressed(button_name, False)
+        return self.flush()
+
+    def release_all(self) -> asyncio.Future:
+        """
+        Releases all buttons and moves both sticks back to their neutral position.
+        """
+        self.left_stick.cancel()
+        self.right_stick.cancel()
+        self._cancel_tap_release(*list(self._tap_releases))
+        self.state = ControllerState()
+        return self.flush()
+
+    def flush(self) -> asyncio.Future:
+        """
+        Sends all changes made to self.state since the last flush with a single write, so that all of them
+        take effect at the same time.
+
+        The text protocol only sends the commands needed to get from the last sent state to the current one.
+        The binary protocol always sends a single report containing the full state.
+        :return: A future resolving to True once the changes were written or to False if they were dropped.
+        """
+        if self.connection_state == ConnectionState.RECONNECTING:
+            # The full state is sent after reconnecting, so all changes during the outage share that single write.
+            if self.outage_policy == OutagePolicy.FAIL:
+                return self._failed_future()
+            if self._outage_flush is None:
+                self._outage_flush = asyncio.get_event_loop().create_future()
+            return self._outage_flush
+        if not self.is_connected():
+            raise Exception('Serial connection was not opened yet')
+
+        if self.state == self._sent_state:
+            future = asyncio.get_event_loop().create_future()
+            future.set_result(True)
+            return future
+
+        if self.protocol == SerialProtocol.BINARY:
+            future = self.write_report(self.state.to_report())
+        else:
+            commands = self.state.diff_commands(self._sent_state)
+            # Only the newest position of a stick matters, so a pending change only moving the same stick may be
+            # replaced in the queue. Changes including buttons must never be replaced since that would lose presses.
+            coalesce_key = commands[0][:2] if len(commands) == 1 and commands[0].startswith('S') else None
+            if self.acks is not None:
+                # Each command is acknowledged on its own, but all of them are still sent right after each other.
+                future = self._all_written([self.write_command(command, coalesce_key) for command in commands])
+            else:
+                future = self.writer.submit(''.join(f'{command}\n' for command in commands).encode('ascii'),
+                                            coalesce_key)
+        self._sent_state = self.state.copy()
+        return future
+
+    def assume_state(self, state: ControllerState) -> None:
+        """
+        Records that the controller changed to the given state by itself, such as after playing a stored macro,
+        so following changes are computed against it.
+        """
+        self.state = state.copy()
+        self._sent_state = state.copy()
+
+    def _write_stick(self, side: str, x: int, y: int) -> asyncio.Future:
+        if side == 'L':
+            self.state.left_stick = (x, y)
+        else:
+            self.state.right_stick = (x, y)
+        return self.flush()
+
+    def write_report(self, report: ControllerReport) -> asyncio.Future:
+        """
+        Queues a report containing the full controller state. Only allowed when using the binary protocol.
+
+        Reports are never coalesced since replacing a pending report could reorder button presses and releases.
+        :return: A future resolving to True once the report was written or to False if it was dropped.
+        """
+        if self.connection_state == ConnectionState.RECONNECTING:
+            return self._buffer(lambda: self.write_report(report))
+        if not self.is_connected():
+            raise Exception('Serial connection was not opened yet')
+        if self.protocol != SerialProtocol.BINARY:
+            raise Exception('Controller reports can only be written when using the binary protocol')
+
+        if self.acks is not None:
+            return self.acks.submit(report.to_bytes)
+        self._report_sequence = (self._report_sequence + 1) & 0xFF
+        return self.writer.submit(report.to_bytes(self._report_sequence))
+
+    def set_left_joystick(self, angle: float, radius: float) -> asyncio.Future:
         """
         Sets the position of the left joystick using polar coordinates.
 
         :param angle: The angle in radians. Zero degrees are equal to pointing to the right.
         :param radius: The radius of the circle, or how far the joystick is pressed in the given direction.
         """
-        x, y, = self._polar_to_cartesian_joystick(angle, radius)
-        self.write_command(f'SL{x:0.2f},{y:0.2f}')
+        x, y, = self.polar_to_cartesian_joystick(angle, radius)
+        return self.left_stick.update(x, y)
 
-    def set_right_joystick(self, angle: float, radius: float) -> None:
+    def set_right_joystick(self, angle: float, radius: float) -> asyncio.Future:
         """
         Sets the position of the right joystick using polar coordinates.
 
@@ -122,11 +598,11 @@ class SerialConnector:
         :param radius: The radius of the circle, or how far the joystick is pressed in the given direction.
         """
 
-        x, y, = self._polar_to_cartesian_joystick(angle, radius)
-        self.write_command(f'SR{x:0.2f},{y:0.2f}')
+        x, y, = self.polar_to_cartesian_joystick(angle, radius)
+        return self.right_stick.update(x, y)
 
     @staticmethod
-    def _polar_to_cartesian_joystick(angle: float, radius: float) -> tuple[int, int]:
+    def polar_to_cartesian_joystick(angle: float, radius: float) -> tuple[int, int]:
         """
         Converts from polar coordinates to the joystick-specific cartesian coordinate system where
         (128, 128) is the neutral center position, (0, 128) is left, (255, 128) is right and so on.
@@ -143,22 +619,125 @@ class SerialConnector:
         # Hack: 128 is neutral and 0 is the minimum, but 256 is not the maximum (255 is) so clamp values >= 256.
         return min(x, 255), min(y, 255)
 
-    def write_command(self, command: str) -> None:
+    def write_command(self, command: str, coalesce_key: Optional[str] = None) -> asyncio.Future:
+        """
+        Queues a command to be written without blocking.
+
+        :param command: The command without the trailing newline.
+        :param coalesce_key: Pending commands with the same key may be replaced by this command,
+        depending on the backpressure policy.
+        :return: A future resolving to True once the command was written or to False if it was dropped.
+        """
+        if self.connection_state == ConnectionState.RECONNECTING:
+            return self._buffer(lambda: self.write_command(command, coalesce_key))
         if not self.is_connected():
             raise Exception('Serial connection was not opened yet')
 
+        command_bytes = self._encode_command(command)
+        if command_bytes is None:
+            return self._failed_future()
+        # Formatted lazily since this is called for every single command.
+        logger.debug('Queueing bytes %s for port "%s"', command_bytes, self.port_identifier)
+        if self.acks is not None:
+            return self.acks.submit(self._sequenced_command_encoder(command), coalesce_key)
+        # The diagnostics the Pro Micro prints in response are logged by the SerialReader at debug level.
+        return self.writer.submit(command_bytes, coalesce_key)
+
+    async def send_command(self, command: str, coalesce_key: Optional[str] = None) -> bool:
+        """
+        Writes a command and waits until it was written. Waits for space in the queue first if the backpressure
+        policy is BLOCK.
+
+        :return: Whether the command was written, False if it was dropped.
+        """
+        if self.connection_state == ConnectionState.RECONNECTING:
+            return await self._buffer(lambda: self.write_command(command, coalesce_key))
+        if not self.is_connected():
+            raise Exception('Serial connection was not opened yet')
+
+        command_bytes = self._encode_command(command)
+        if command_bytes is None:
+            return False
+        if self.acks is not None:
+            future = await self.acks.submit_and_wait_for_space(self._sequenced_command_encoder(command), coalesce_key)
+        else:
+            future = await self.writer.submit_and_wait_for_space(command_bytes, coalesce_key)
+        return await future
+
+    @staticmethod
+    def _encode_command(command: str) -> Optional[bytes]:
         try:
-            command_bytes = command.encode('ascii', errors='strict')
+            # Include the separator so each command is written as a single buffer.
+            return f'{command}\n'.encode('ascii', errors='strict')
         except UnicodeEncodeError as err:
             logger.error(f'Failed to write command "{command}" to serial: {err}')
-            return
+            return None
+
+    @staticmethod
+    def _sequenced_command_encoder(command: str) -> Callable[[int], bytes]:
+        return lambda sequence: f'#{sequence}{command}\n'.encode('ascii')
 
-        logger.debug(f'Writing bytes "{command_bytes}" to port "{self.port_identifier}"')
-        self.serial.write(command_bytes)
-        self.serial.write(b'\n')
-        # Uncomment when debugging to get diagnostics data from the Pro Micro. This does slow down command sending considerably, so the joysticks may not work correctly with this.
-        #response = self.serial.readline()
-        #logger.debug(f'Response was: {response}')
+    @staticmethod
+    def _all_written(futures: List[asyncio.Future]) -> asyncio.Future:
+        async def wait_for_all() -> bool:
+            return all(await asyncio.gather(*futures))
+
+        return asyncio.ensure_future(wait_for_all())
+
+    @staticmethod
+    def _failed_future() -> asyncio.Future:
+        future = asyncio.get_event_loop().create_future()
+        future.set_result(False)
+        return future
+
+    def _buffer(self, send: Callable[[], asyncio.Future], future: Optional[asyncio.Future] = None) -> asyncio.Future:
+        """
+        Keeps a command sent during an outage until reconnecting, or fails it right away, see OutagePolicy.
+
+        :param send: Sends the command once reconnected and returns its future.
+        :param future: The future already returned for the command, if any.
+        """
+        if future is None:
+            future = create_command_future(asyncio.get_event_loop())
+        if self.outage_policy == OutagePolicy.FAIL:
+            self._resolve(future, False)
+            return future
+
+        if len(self._buffered) >= self.max_queue_size:
+            _, dropped = self._buffered.pop(0)
+            self._resolve(dropped, False)
+        self._buffered.append((send, future))
+        return future
+
+    @staticmethod
+    def _forward_result(source: asyncio.Future, target: asyncio.Future) -> None:
+        def forward(done: asyncio.Future) -> None:
+            if target.done():
+                return
+            if done.cancelled():
+                target.set_result(False)
+            elif done.exception() is not None:
+                target.set_exception(done.exception())
+            else:
+                target.set_result(done.result())
+
+        source.add_done_callback(forward)
+
+    @staticmethod
+    def _resolve(future: asyncio.Future, result: bool) -> None:
+        if not future.done():
+            future.set_result(result)
+
+    def statistics(self) -> Dict[str, Dict[str, int]]:
+        """
+        :return: Counters describing the commands sent since connecting, such as how many stick updates were merged.
+        """
+        return {
+            'writer': self.writer.statistics() if self.writer is not None else {},
+            'acks': self.acks.statistics() if self.acks is not None else {},
+            'left_stick': self.left_stick.statistics(),
+            'right_stick': self.right_stick.statistics(),
+        }
 
     @staticmethod
     def list_serial_ports() -> List[str]:
@@ -0,0 +1,171 @@
+import re
+import struct
+from dataclasses import dataclass
+from enum import Enum, IntEnum
+from typing import Optional, Dict, List
+
+# The first firmware version that understands binary controller reports.
+BINARY_PROTOCOL_MIN_VERSION = 2
+# The first firmware version that can store and play macros.
+MACRO_MIN_VERSION = 3
+# The first firmware version that acknowledges sequenced commands.
+ACK_MIN_VERSION = 4
+_VERSION_PATTERN = re.compile(r'SwitchBot controller version (\d+)')
+
+REPORT_START_BYTE = 0xA5
+# Start byte, sequence number, buttons bitmask, hat, left stick X and Y, right stick X and Y, checksum.
+REPORT_STRUCT = struct.Struct('<BBHBBBBBB')
+
+MACRO_START_BYTE = 0xA6
+# Start byte and number of steps.
+MACRO_HEADER_STRUCT = struct.Struct('<BB')
+# Delay since the previous step in milliseconds, buttons bitmask, hat, left stick X and Y, right stick X and Y.
+MACRO_STEP_STRUCT = struct.Struct('<HHBBBBB')
+MAX_MACRO_STEPS = 64
+MAX_MACRO_STEP_DELAY_MS = 0xFFFF
+# Lines the firmware prints in response to macro uploads and while playing macros.
+MACRO_STORED_PREFIX = 'Macro stored'
+MACRO_REJECTED_LINE = 'Macro rejected'
+MACRO_FINISHED_LINE = 'Macro finished'
+MACRO_STOPPED_LINE = 'Macro stopped'
+
+STICK_NEUTRAL = 128
+
+
+class SerialProtocol(Enum):
+    # One plain-text command per line, see controller/serial-protocol.md.
+    TEXT = 'text'
+    # Fixed-size reports containing the full state of the controller.
+    BINARY = 'binary'
+
+
+class Button(IntEnum):
+    """
+    The bits of the buttons in a controller report, matching the button constants of the firmware.
+    """
+    Y = 0
+    B = 1
+    A = 2
+    X = 3
+    L = 4
+    R = 5
+    ZL = 6
+    ZR = 7
+    MINUS = 8
+    PLUS = 9
+    LSTICK = 10
+    RSTICK = 11
+    HOME = 12
+    CAPTURE = 13
+
+
+class Hat(IntEnum):
+    """
+    The directions of the D-Pad. Multiplied by 45 this is the angle the firmware sets the hat switch to.
+    """
+    UP = 0
+    UP_RIGHT = 1
+    RIGHT = 2
+    DOWN_RIGHT = 3
+    DOWN = 4
+    DOWN_LEFT = 5
+    LEFT = 6
+    UP_LEFT = 7
+    NEUTRAL = 8
+
+
+# Maps from the button names used by the text protocol to the buttons of a report.
+BUTTON_NAME_TO_BUTTON: Dict[str, Button] = {
+    'A': Button.A,
+    'B': Button.B,
+    'X': Button.X,
+    'Y': Button.Y,
+    'L': Button.L,
+    'R': Button.R,
+    'ZL': Button.ZL,
+    'ZR': Button.ZR,
+    'M': Button.MINUS,
+    'P': Button.PLUS,
+    'H': Button.HOME,
+    'C': Button.CAPTURE,
+}
+# Maps from the D-Pad names used by the text protocol to the direction of the hat.
+DPAD_NAME_TO_HAT: Dict[str, Hat] = {
+    'DU': Hat.UP,
+    'DR': Hat.RIGHT,
+    'DD': Hat.DOWN,
+    'DL': Hat.LEFT,
+}
+
+
+@dataclass
+class ControllerReport:
+    """
+    The full state of the controller as sent by the binary protocol.
+    """
+    # One bit per pressed button, see Button.
+    buttons: int = 0
+    hat: Hat = Hat.NEUTRAL
+    left_x: int = STICK_NEUTRAL
+    left_y: int = STICK_NEUTRAL
+    right_x: int = STICK_NEUTRAL
+    right_y: int = STICK_NEUTRAL
+
+    def to_bytes(self, sequence: int) -> bytes:
+        data = REPORT_STRUCT.pack(REPORT_START_BYTE, sequence & 0xFF, self.buttons, self.hat,
+                                  self.left_x, self.left_y, self.right_x, self.right_y, 0)
+        return data[:-1] + bytes([checksum(data[:-1])])
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'ControllerReport':
+        start, _, buttons, hat, left_x, left_y, right_x, right_y, report_checksum = REPORT_STRUCT.unpack(data)
+        if start != REPORT_START_BYTE or report_checksum != checksum(data[:-1]):
+            raise ValueError('Invalid controller report')
+        return cls(buttons=buttons, hat=Hat(hat), left_x=left_x, left_y=left_y, right_x=right_x, right_y=right_y)
+
+
+@dataclass
+class ControllerMacroStep:
+    """
+    A step of a macro stored on the controller: the full state the controller switches to after the delay.
+    """
+    # Milliseconds since the previous step was due, or since the macro was started for the first step.
+    delay_ms: int
+    report: ControllerReport
+
+
+def encode_macro(steps: List[ControllerMacroStep]) -> bytes:
+    """
+    Encodes steps to be uploaded to the controller in a single transfer.
+    """
+    if not 0 < len(steps) <= MAX_MACRO_STEPS:
+        raise ValueError(f'Macros must have between 1 and {MAX_MACRO_STEPS} steps, got {len(steps)}')
+
+    data = bytearray(MACRO_HEADER_STRUCT.pack(MACRO_START_BYTE, len(steps)))
+    for step in steps:
+        if not 0 <= step.delay_ms <= MAX_MACRO_STEP_DELAY_MS:
+            raise ValueError(f'Delay of macro step must be at most {MAX_MACRO_STEP_DELAY_MS} ms, was {step.delay_ms}')
+        report = step.report
+        data += MACRO_STEP_STRUCT.pack(step.delay_ms, report.buttons, report.hat, report.left_x, report.left_y,
+                                       report.right_x, report.right_y)
+    data.append(checksum(data))
+    return bytes(data)
+
+
+def checksum(data: bytes) -> int:
+    return sum(data) & 0xFF
+
+
+def parse_firmware_version(line: str) -> Optional[int]:
+    """
+    :return: The version from the response to a "V" command or None if the line is no such response.
+    """
+    match = _VERSION_PATTERN.search(line)
+    return int(match.group(1)) if match is not None else None
+
+
+def stick_byte_to_text(value: int) -> str:
+    """
+    Converts a stick axis from the byte range used by reports to the [-1.0, 1.0] range used by the text protocol.
+    """
+    return f'{max(-1.0, min(1.0, (value - STICK_NEUTRAL) / 127)):0.2f}'
@@ -0,0 +1,89 @@
+import asyncio
+import logging
+import threading
+from typing import Optional, Callable, List
+
+from serial import Serial, SerialException
+
+logger = logging.getLogger('SerialReader')
+
+
+class SerialReader:
+    """
+    Reads the lines the controller prints on a dedicated thread and passes them to listeners on the event loop.
+    """
+
+    def __init__(self,
+                 serial: Serial,
+                 loop: asyncio.AbstractEventLoop,
+                 on_error: Optional[Callable[[BaseException], None]] = None):
+        self.serial: Serial = serial
+        self._loop: asyncio.AbstractEventLoop = loop
+        # Called on the event loop's thread when reading fails, which usually means the port is gone.
+        self._on_error: Optional[Callable[[BaseException], None]] = on_error
+        # Called on the event loop's thread with each line, without the trailing newline.
+        self._listeners: List[Callable[[str], None]] = []
+        self._running: threading.Event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._running.set()
+        self._thread = threading.Thread(target=self._read_lines, name='SerialReader', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._running.clear()
+        if self._thread is not None:
+            # Reads time out after the serial port's timeout, so this should not take long.
+            self._thread.join(timeout=2.0)
+        self._thread = None
+
+    def add_listener(self, listener: Callable[[str], None]) -> None:
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener: Callable[[str], None]) -> None:
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+
+    def _read_lines(self) -> None:
+        pending = bytearray()
+        while self._running.is_set():
+            try:
+                # Read everything available at once, reading byte by byte like readline does is too slow to keep up
+                # with the diagnostics the firmware prints for every command.
+                data = self.serial.read(max(1, self.serial.in_waiting))
+            except (SerialException, OSError, TypeError) as exception:
+                # Reading from a port that is being closed raises all kinds of errors.
+                if self._running.is_set():
+                    logger.error(f'Failed to read from serial: {exception}')
+                    if self._on_error is not None:
+                        self._call_on_loop(self._on_error, exception)
+                break
+            if not data:
+                continue
+
+            pending += data
+            *lines, rest = pending.split(b'\n')
+            pending = bytearray(rest)
+            if not lines:
+                continue
+            if not self._call_on_loop(self._notify_listeners,
+                                      [line.decode('ascii', errors='replace').strip() for line in lines]):
+                break
+
+    def _call_on_loop(self, callback, *args) -> bool:
+        try:
+            self._loop.call_soon_threadsafe(callback, *args)
+            return True
+        except RuntimeError:
+            # The event loop was closed, nobody is listening anymore.
+            return False
+
+    def _notify_listeners(self, lines: List[str]) -> None:
+        for line in lines:
+            logger.debug('Received line "%s"', line)
+            # Listeners may remove themselves while being notified.
+            for listener in list(self._listeners):
+                listener(line)
@@ -0,0 +1,209 @@
+import asyncio
+import collections
+import logging
+import threading
+from dataclasses import dataclass
+from enum import Enum
+from typing import Optional, Deque, Dict, List, Callable
+
+from serial import Serial, SerialException
+
+logger = logging.getLogger('SerialWriter')
+
+
+class BackpressurePolicy(Enum):
+    """
+    Decides what happens when a command is submitted while the queue of pending commands is full.
+    """
+    # Wait until there is space in the queue. Synchronous submits raise a SerialQueueFullError instead.
+    BLOCK = 'block'
+    # Drop the oldest pending command to make space for the new one.
+    DROP_OLDEST = 'drop_oldest'
+    # Drop a pending command with the same coalescing key, such as an outdated stick position, even if the queue is
+    # not full. The new command is queued at the end, so it is still written after everything submitted before it.
+    # Falls back to dropping the oldest command if there is none.
+    COALESCE = 'coalesce'
+
+
+class SerialQueueFullError(Exception):
+    pass
+
+
+def create_command_future(loop: asyncio.AbstractEventLoop) -> asyncio.Future:
+    """
+    Creates a future for the outcome of a command. Nobody is forced to await it, so exceptions that were never
+    retrieved are not logged when it is garbage collected.
+    """
+    future = loop.create_future()
+    future.add_done_callback(lambda done: done.cancelled() or done.exception())
+    return future
+
+
+@dataclass
+class PendingCommand:
+    data: bytes
+    # Resolves to True once written, to False if the command was dropped or replaced.
+    future: asyncio.Future
+    coalesce_key: Optional[str] = None
+
+
+class SerialWriter:
+    """
+    Writes commands to a serial port on a dedicated thread so that slow or stalled ports never block the event loop.
+
+    Commands are taken from a bounded queue. All commands pending when the thread is ready to write
+    are joined and written with a single call.
+    """
+
+    def __init__(self,
+                 serial: Serial,
+                 loop: asyncio.AbstractEventLoop,
+                 max_queue_size: int = 64,
+                 policy: BackpressurePolicy = BackpressurePolicy.COALESCE,
+                 on_error: Optional[Callable[[BaseException], None]] = None):
+        self.serial: Serial = serial
+        self.policy: BackpressurePolicy = policy
+        self.max_queue_size: int = max_queue_size
+        self._loop: asyncio.AbstractEventLoop = loop
+        # Called on the event loop's thread when writing fails.
+        self._on_error: Optional[Callable[[BaseException], None]] = on_error
+        self._queue: Deque[PendingCommand] = collections.deque()
+        self._condition: threading.Condition = threading.Condition()
+        self._running: bool = False
+        self._thread: Optional[threading.Thread] = None
+        self._space_available: asyncio.Event = asyncio.Event()
+        self.written: int = 0
+        self.dropped: int = 0
+        self.coalesced: int = 0
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._write_commands, name='SerialWriter', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """
+        Stops the writer thread. Commands that were not written yet fail with a SerialException.
+        """
+        with self._condition:
+            self._running = False
+            remaining = list(self._queue)
+            self._queue.clear()
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=2.0)
+        self._thread = None
+        for command in remaining:
+            self._fail(command.future, SerialException('Serial connection was closed before writing the command'))
+        self._space_available.set()
+
+    def take_pending(self) -> List[PendingCommand]:
+        """
+        Removes all commands that were not written yet from the queue, for example to send them again later.
+        """
+        with self._condition:
+            pending = list(self._queue)
+            self._queue.clear()
+        return pending
+
+    def submit(self, data: bytes, coalesce_key: Optional[str] = None) -> asyncio.Future:
+        """
+        Queues the given data to be written without blocking. Must be called on the event loop's thread.
+
+        :param data: The bytes to write.
+        :param coalesce_key: Commands with the same key may replace each other while pending.
+        :return: A future resolving to True once the data was written or to False if it was dropped.
+        :raises SerialQueueFullError: If the queue is full and the policy is BLOCK.
+        """
+        future = create_command_future(self._loop)
+        command = PendingCommand(data=data, future=future, coalesce_key=coalesce_key)
+
+        replaced: Optional[PendingCommand] = None
+        with self._condition:
+            if not self._running:
+                raise SerialException('Serial writer is not running')
+            if self.policy == BackpressurePolicy.COALESCE and coalesce_key is not None:
+                replaced = self._remove_pending(coalesce_key)
+            if replaced is None and len(self._queue) >= self.max_queue_size:
+                if self.policy == BackpressurePolicy.BLOCK:
+                    raise SerialQueueFullError(f'{len(self._queue)} commands are already waiting to be written')
+                replaced = self._queue.popleft()
+                self.dropped += 1
+            self._queue.append(command)
+            self._condition.notify()
+
+        if replaced is not None:
+            self._resolve(replaced.future, False)
+        return future
+
+    async def submit_and_wait_for_space(self, data: bytes, coalesce_key: Optional[str] = None) -> asyncio.Future:
+        """
+        Like submit, but waits for space in the queue instead of raising if the policy is BLOCK.
+        """
+        while True:
+            try:
+                return self.submit(data, coalesce_key)
+            except SerialQueueFullError:
+                self._space_available.clear()
+                await self._space_available.wait()
+
+    def statistics(self) -> Dict[str, int]:
+        return {
+            'pending': len(self._queue),
+            'written': self.written,
+            'dropped': self.dropped,
+            'coalesced': self.coalesced,
+        }
+
+    def _remove_pending(self, coalesce_key: str) -> Optional[PendingCommand]:
+        # Must be called while holding the condition's lock.
+        for index, pending in enumerate(self._queue):
+            if pending.coalesce_key == coalesce_key:
+                del self._queue[index]
+                self.coalesced += 1
+                return pending
+        return None
+
+    def _write_commands(self) -> None:
+        while True:
+            with self._condition:
+                while self._running and not self._queue:
+                    self._condition.wait()
+                if not self._running:
+                    return
+                batch: List[PendingCommand] = list(self._queue)
+                self._queue.clear()
+            self._call_on_loop(self._space_available.set)
+
+            try:
+                self.serial.write(b''.join(command.data for command in batch))
+            except (SerialException, OSError) as exception:
+                logger.error(f'Failed to write {len(batch)} commands to serial: {exception}')
+                for command in batch:
+                    self._call_on_loop(self._fail, command.future, exception)
+                if self._on_error is not None:
+                    self._call_on_loop(self._on_error, exception)
+                continue
+
+            self.written += len(batch)
+            for command in batch:
+                self._call_on_loop(self._resolve, command.future, True)
+
+    def _call_on_loop(self, callback, *args) -> None:
+        try:
+            self._loop.call_soon_threadsafe(callback, *args)
+        except RuntimeError:
+            # The event loop was closed, nobody is waiting for the result anymore.
+            pass
+
+    @staticmethod
+    def _resolve(future: asyncio.Future, result: bool) -> None:
+        if not future.done():
+            future.set_result(result)
+
+    @staticmethod
+    def _fail(future: asyncio.Future, exception: BaseException) -> None:
+        if not future.done():
+            future.set_exception(exception)
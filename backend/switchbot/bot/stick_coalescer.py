@@ -0,0 +1,102 @@
+import asyncio
+from time import monotonic
+from typing import Optional, Tuple, Callable, Dict
+
+from .serial_writer import create_command_future
+
+
+class StickCoalescer:
+    """
+    Rate-limits the position updates of a single joystick.
+
+    Updates arriving faster than the maximum rate are merged so that only the newest position is sent once the
+    next update is allowed. The last position is always sent eventually, so the stick never gets stuck at an
+    outdated position. Must only be used from the event loop's thread.
+    """
+
+    def __init__(self, write: Callable[[float, float], asyncio.Future], max_rate_hz: float = 60.0):
+        self._write: Callable[[float, float], asyncio.Future] = write
+        self.min_interval: float = 1.0 / max_rate_hz
+        self._pending: Optional[Tuple[float, float]] = None
+        self._pending_future: Optional[asyncio.Future] = None
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._last_sent_time: float = float('-inf')
+        self.updates: int = 0
+        self.merged: int = 0
+        self.sent: int = 0
+
+    def update(self, x: float, y: float) -> asyncio.Future:
+        """
+        Sets the stick's position as soon as the rate limit allows.
+
+        :return: A future resolving once this position or a newer one that replaced it was written.
+        """
+        self.updates += 1
+        loop = asyncio.get_event_loop()
+        if self._pending is not None:
+            self.merged += 1
+        else:
+            self._pending_future = create_command_future(loop)
+        self._pending = (x, y)
+        future = self._pending_future
+
+        if self._flush_handle is None:
+            delay = self._last_sent_time + self.min_interval - monotonic()
+            if delay <= 0:
+                self.flush()
+            else:
+                self._flush_handle = loop.call_later(delay, self.flush)
+        return future
+
+    def flush(self) -> None:
+        """
+        Sends the pending position immediately, ignoring the rate limit.
+        """
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if self._pending is None:
+            return
+
+        x, y = self._pending
+        pending_future = self._pending_future
+        self._pending = None
+        self._pending_future = None
+        self._last_sent_time = monotonic()
+        self.sent += 1
+        try:
+            write_future = self._write(x, y)
+        except Exception as exception:
+            pending_future.set_exception(exception)
+            return
+        write_future.add_done_callback(lambda done: self._forward_result(done, pending_future))
+
+    def cancel(self) -> None:
+        """
+        Discards a pending position without sending it.
+        """
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if self._pending_future is not None and not self._pending_future.done():
+            self._pending_future.set_result(False)
+        self._pending = None
+        self._pending_future = None
+
+    def statistics(self) -> Dict[str, int]:
+        return {
+            'updates': self.updates,
+            'merged': self.merged,
+            'sent': self.sent,
+        }
+
+    @staticmethod
+    def _forward_result(write_future: asyncio.Future, pending_future: asyncio.Future) -> None:
+        if pending_future.done():
+            return
+        if write_future.cancelled():
+            pending_future.cancel()
+        elif write_future.exception() is not None:
+            pending_future.set_exception(write_future.exception())
+        else:
+            pending_future.set_result(write_future.result())
@@ -1,6 +1,8 @@
 import socketio
 
-from .serial_connector import SerialConnector
+from .device_registry import DeviceRegistry
+from .frame_bus import FrameBus
+from .serial_connector import SerialConnector, OutagePolicy
 from .ui_display import UiDisplay
 from .video_connector import VideoConnector
 
@@ -11,7 +13,11 @@ class SwitchBot:
     camera.
     """
 
-    def __init__(self, sio: socketio.Server):
+    def __init__(self, sio: socketio.Server, ack_window: int = 0, outage_policy: OutagePolicy = OutagePolicy.BUFFER):
         self.video: VideoConnector = VideoConnector()
-        self.serial: SerialConnector = SerialConnector()
+        # Use this instead of reading from video directly to not take frames away from other consumers.
+        self.frames: FrameBus = FrameBus(self.video)
+        self.serial: SerialConnector = SerialConnector(ack_window=ack_window, outage_policy=outage_policy)
         self.display: UiDisplay = UiDisplay(sio)
+        # Use this instead of listing cameras and serial ports directly since enumerating them is slow.
+        self.devices: DeviceRegistry = DeviceRegistry(self.video)
@@ -1,9 +1,10 @@
 from random import Random
-from typing import List
+from typing import List, Callable
 
 import socketio
 
 from ..program.dialog import Dialog
+from ..server import message_codec
 from ..server.message_identifiers import MessageIdentifiers
 from ..server.messages.show_dialog_message import ShowDialogMessage
 
@@ -13,13 +14,20 @@ class UiDisplay:
 
     def __init__(self, sio: socketio.Server):
         self.sio: socketio.Server = sio
+        # Called with every dialog shown to all clients.
+        self._dialog_listeners: List[Callable[[Dialog], None]] = []
+
+    def add_dialog_listener(self, listener: Callable[[Dialog], None]) -> None:
+        self._dialog_listeners.append(listener)
 
     async def show_dialog(self, title: str, content: str, buttons: List[str], sid=None) -> None:
-        message: ShowDialogMessage = ShowDialogMessage(
-            dialog=Dialog(
-                title=title,
-                content=content,
-                buttons=buttons
-            )
+        dialog = Dialog(
+            title=title,
+            content=content,
+            buttons=buttons
         )
-        await self.sio.emit(MessageIdentifiers.SHOW_DIALOG_REQUEST, ShowDialogMessage.to_dict(message), to=sid)
+        if sid is None:
+            for listener in self._dialog_listeners:
+                listener(dialog)
+        message: ShowDialogMessage = ShowDialogMessage(dialog=dialog)
+        await self.sio.emit(MessageIdentifiers.SHOW_DIALOG_REQUEST, message_codec.encode(message), to=sid)
@@ -1,5 +1,7 @@
+import asyncio
 from dataclasses import dataclass
-from typing import Union, Optional
+from time import monotonic
+from typing import Union, Optional, Callable, List
 
 import numpy as np
 from cv2 import VideoCapture, error
@@ -9,6 +11,8 @@ from cv2_enumerate_cameras import enumerate_cameras
 from cv2.videoio_registry import getBackendName
 from dataclasses_json import dataclass_json
 
+from .frame_grabber import FrameGrabber, Frame
+
 
 # dataclass has to be below dataclass_json or else everything breaks.
 @dataclass_json
@@ -22,11 +26,20 @@ class VideoConnector:
     """
     Wrapper around OpenCV's functionality for handling
     camera streams.
+
+    By default, frames are grabbed on a background thread that owns the capture, see FrameGrabber.
+    Pass threaded=False to read frames directly from the capture instead.
     """
 
-    def __init__(self):
+    def __init__(self, threaded: bool = True):
         self.active_camera_descriptor: Optional[CameraDescriptor] = None
         self.capture: Optional[VideoCapture] = None
+        self.threaded: bool = threaded
+        self.grabber: Optional[FrameGrabber] = None
+        # Only used for numbering frames when not grabbing frames on a background thread.
+        self._direct_sequence: int = 0
+        self._frame_listeners: List[Callable[[Frame], None]] = []
+        self._disconnect_listeners: List[Callable[[], None]] = []
 
     def connect(self, descriptor: CameraDescriptor) -> None:
         if self.is_connected():
@@ -35,22 +48,52 @@ class VideoConnector:
         self.active_camera_descriptor = descriptor
         self.capture = VideoCapture(descriptor.identifier)
         # TODO: raise error or return false if opening the camera fails.
+        if self.threaded:
+            self.grabber = FrameGrabber(self.capture, asyncio.get_event_loop(), on_frame=self._publish_frame)
+            self.grabber.start()
 
     def is_connected(self) -> bool:
         return self.capture is not None
 
+    def is_capturing(self) -> bool:
+        """
+        :return: Whether frames can currently be read from the connected camera.
+        """
+        if self.grabber is not None:
+            return self.grabber.is_running()
+        return self.capture is not None and self.capture.isOpened()
+
+    def add_disconnect_listener(self, listener: Callable[[], None]) -> None:
+        """
+        Calls the listener whenever the camera was disconnected, also when connecting to another camera.
+        """
+        self._disconnect_listeners.append(listener)
+
     def disconnect(self) -> None:
+        was_connected = self.is_connected()
         self.active_camera_descriptor = None
+        # Stop the grabber first so that the capture is not released while it is still being read from.
+        if self.grabber is not None:
+            self.grabber.stop()
+        self.grabber = None
         if self.capture is not None:
             self.capture.release()
         self.capture = None
+        if was_connected:
+            for listener in list(self._disconnect_listeners):
+                listener()
 
     def read_frame(self) -> Optional[np.ndarray]:
         """
         Wrapper around frame grabbing functionality from OpenCV.
         Waits until a frame is ready and grabs it. If the frame could not be grabbed, None is returned.
+
+        When grabbing frames on a background thread, this does not block and returns the newest frame instead.
         :return: The frame as a np.ndarray containing the image pixels or None if grabbing the frame failed.
         """
+        if self.grabber is not None:
+            frame = self.grabber.latest()
+            return frame.image if frame is not None else None
         if self.capture is None:
             return None
         try:
@@ -60,6 +103,40 @@ class VideoConnector:
             # Rarely throws for some unknown reason, ignore it for now.
             return None
 
+    async def wait_for_frame(self, after_sequence: int = 0) -> Optional[Frame]:
+        """
+        Waits for a frame newer than the frame with the given sequence number without blocking the event loop.
+
+        :param after_sequence: The sequence number of the last frame the caller has seen.
+        :return: The new frame or None if no frame could be grabbed.
+        """
+        if self.grabber is not None:
+            return await self.grabber.wait_for_frame(after_sequence)
+
+        # Without a grabber thread, run the blocking read in the default executor instead.
+        image = await asyncio.get_running_loop().run_in_executor(None, self.read_frame)
+        if image is None:
+            return None
+        self._direct_sequence += 1
+        frame = Frame(image=image, sequence=self._direct_sequence, timestamp=monotonic())
+        self._publish_frame(frame)
+        return frame
+
+    def add_frame_listener(self, listener: Callable[[Frame], None]) -> None:
+        """
+        Registers a callback that is called on the event loop for every newly grabbed frame.
+
+        Without a background grabber thread, listeners only see the frames read through wait_for_frame.
+        """
+        self._frame_listeners.append(listener)
+
+    def remove_frame_listener(self, listener: Callable[[Frame], None]) -> None:
+        self._frame_listeners.remove(listener)
+
+    def _publish_frame(self, frame: Frame) -> None:
+        for listener in self._frame_listeners:
+            listener(frame)
+
     # noinspection PyMethodMayBeStatic
     def list_cameras(self) -> list[CameraDescriptor]:
         """
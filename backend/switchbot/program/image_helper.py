@@ -1,3 +1,6 @@
+import math
+from typing import List
+
 import cv2
 import numpy as np
 
@@ -28,3 +31,82 @@ def count_colored_pixels(frame: np.ndarray, rect: Rect, lower_color: [float], up
     # OpenCV uses BGR instead of RGB, so index 2 is red
     mask = cv2.inRange(box, lower_color, upper_color)
     return cv2.countNonZero(mask)
+
+
+class ColorRegion:
+    """
+    A region of a frame together with the range of colors to look for inside it.
+    """
+
+    def __init__(self, rect: Rect, lower_color: [float], upper_color: [float]):
+        self.rect = rect
+        self.lower_color = np.asarray(lower_color)
+        self.upper_color = np.asarray(upper_color)
+
+
+class ColorRegionDetector:
+    """
+    Counts the pixels inside of the given color ranges for several regions of a frame at once.
+
+    Meant to be created once and then called for every frame: the masks OpenCV writes into are allocated up front
+    and reused, and the regions are read from the frame as views instead of copies.
+
+    With a subsample factor k > 1, only every k-th pixel in both directions is checked and the counts are
+    extrapolated, which is about k² times cheaper. The sampled pixels are treated as n independent samples,
+    so the fraction of matching pixels is off by more than fraction_error_bound() with a probability below 0.3%.
+    Use this for cheaply rejecting frames that are far from matching and count exactly for the remaining ones.
+    Note that OpenCV has to copy the (k² times smaller) subsampled view since its pixels are not contiguous.
+    """
+
+    def __init__(self, regions: List[ColorRegion], subsample: int = 1):
+        if subsample < 1:
+            raise ValueError(f'Subsample factor must be at least 1, was {subsample}')
+
+        self.regions: List[ColorRegion] = regions
+        self.subsample: int = subsample
+        self._masks: List[np.ndarray] = [
+            np.empty((math.ceil(region.rect.height / subsample), math.ceil(region.rect.width / subsample)),
+                     dtype=np.uint8)
+            for region in regions
+        ]
+
+    def count(self, frame: np.ndarray) -> List[int]:
+        """
+        Counts the pixels inside the color range of each region.
+
+        :param frame: The image to search in.
+        :return: The (estimated, if subsampling) number of matching pixels for each region, in the order the regions
+        were given in.
+        """
+        k = self.subsample
+        counts = []
+        for region, mask in zip(self.regions, self._masks):
+            rect = region.rect
+            # Y value before X value
+            full_box = frame[rect.y:rect.y + rect.height, rect.x:rect.x + rect.width]
+            box = full_box[::k, ::k] if k > 1 else full_box
+            if box.shape[:2] != mask.shape:
+                # Region reaches outside the frame, so it has fewer pixels than expected.
+                mask = np.empty(box.shape[:2], dtype=np.uint8)
+            cv2.inRange(box, region.lower_color, region.upper_color, dst=mask)
+            sampled_count = cv2.countNonZero(mask)
+            if k > 1:
+                sampled_count = round(sampled_count * full_box.shape[0] * full_box.shape[1] / mask.size)
+            counts.append(sampled_count)
+        return counts
+
+    def fractions(self, frame: np.ndarray) -> List[float]:
+        """
+        :return: The (estimated, if subsampling) fraction of matching pixels for each region.
+        """
+        return [count / region.rect.area() for count, region in zip(self.count(frame), self.regions)]
+
+    def fraction_error_bound(self, index: int) -> float:
+        """
+        :return: The bound for how far the fraction estimated for the region with the given index may be off
+        when subsampling, being three standard deviations of the worst case. Zero when not subsampling.
+        """
+        if self.subsample == 1:
+            return 0.0
+        sample_count = self._masks[index].size
+        return 3 * 0.5 / math.sqrt(sample_count)
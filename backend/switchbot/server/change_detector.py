@@ -0,0 +1,63 @@
+from time import monotonic
+from typing import Optional, Tuple
+
+import cv2
+import numpy as np
+
+
+class FrameChangeDetector:
+    """
+    Decides whether a frame differs enough from the last sent frame to be worth sending.
+
+    Frames are compared using small grayscale thumbnails, which is much cheaper than encoding them. A frame counts
+    as changed if enough thumbnail pixels differ noticeably from the last sent frame, so that small changes such as a
+    moving cursor are still detected while sensor noise is not.
+    Frames are always sent at least every keyframe_interval seconds so that clients joining late still get an image.
+    """
+
+    def __init__(self,
+                 keyframe_interval: float = 2.0,
+                 pixel_threshold: int = 12,
+                 min_changed_pixels: int = 2,
+                 thumbnail_size: Tuple[int, int] = (96, 54)):
+        self.keyframe_interval: float = keyframe_interval
+        self.pixel_threshold: int = pixel_threshold
+        self.min_changed_pixels: int = min_changed_pixels
+        self.thumbnail_size: Tuple[int, int] = thumbnail_size
+        self._reference: Optional[np.ndarray] = None
+        self._last_sent_time: float = 0.0
+        self._force_keyframe: bool = True
+
+    def force_keyframe(self) -> None:
+        """
+        Makes the next frame count as changed regardless of its content. Can be called from any thread. If a frame
+        is being checked right now, the one after it counts as changed.
+        """
+        self._force_keyframe = True
+
+    def has_changed(self, image: np.ndarray) -> bool:
+        """
+        Checks whether the given frame should be sent. If so, it becomes the frame following frames are compared to.
+
+        Safe to call from a worker thread, as long as only one thread calls it at a time.
+        """
+        thumbnail = cv2.resize(image, self.thumbnail_size, interpolation=cv2.INTER_AREA)
+        thumbnail = cv2.cvtColor(thumbnail, cv2.COLOR_BGR2GRAY)
+        now = monotonic()
+
+        force_keyframe = self._force_keyframe
+        # Cleared before checking, so a keyframe requested meanwhile is not lost.
+        self._force_keyframe = False
+        is_keyframe = force_keyframe \
+            or self._reference is None \
+            or now - self._last_sent_time >= self.keyframe_interval
+        if not is_keyframe:
+            difference = cv2.absdiff(thumbnail, self._reference)
+            _, changed_mask = cv2.threshold(difference, self.pixel_threshold, 255, cv2.THRESH_BINARY)
+            if cv2.countNonZero(changed_mask) < self.min_changed_pixels:
+                return False
+
+        # Compare against the last sent frame instead of the last seen one so that slow fades still add up.
+        self._reference = thumbnail
+        self._last_sent_time = now
+        return True
@@ -0,0 +1,181 @@
+"""
+Converts messages to and from the dicts that are sent to clients, as a faster replacement for dataclasses_json's
+to_dict and from_dict which look at the type hints of every field on every call.
+
+The first message of each class compiles a function converting exactly the fields of that class, which handles
+fields of simple types without any checks. The results are the same as the ones of dataclasses_json, except that
+enums are converted to their values.
+"""
+
+import dataclasses
+import typing
+from collections.abc import Mapping, Collection
+from enum import Enum
+from typing import Any, Callable, Dict, Optional, Type, TypeVar, get_type_hints
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+T = TypeVar('T')
+
+_PRIMITIVE_TYPES = (str, int, float, bool)
+_encoders: Dict[type, Callable[[Any], Dict[str, Any]]] = {}
+_decoders: Dict[type, Callable[[Dict[str, Any]], Any]] = {}
+
+
+def encode(message: Any) -> Dict[str, Any]:
+    """
+    Converts a dataclass instance to a dict that can be serialized to JSON or MessagePack.
+    """
+    encoder = _encoders.get(type(message))
+    if encoder is None:
+        encoder = _compile_encoder(type(message))
+    return encoder(message)
+
+
+def decode(message_type: Type[T], data: Dict[str, Any]) -> T:
+    """
+    Creates a dataclass instance from a dict received from a client.
+
+    :raises TypeError: If a field without a default value is missing.
+    """
+    decoder = _decoders.get(message_type)
+    if decoder is None:
+        decoder = _compile_decoder(message_type)
+    return decoder(data)
+
+
+def encode_msgpack(message: Any) -> bytes:
+    """
+    :raises RuntimeError: If the optional msgpack package is not installed.
+    """
+    if msgpack is None:
+        raise RuntimeError('Encoding messages as MessagePack requires the msgpack package')
+    return msgpack.packb(encode(message), use_bin_type=True)
+
+
+def decode_msgpack(message_type: Type[T], data: bytes) -> T:
+    """
+    :raises RuntimeError: If the optional msgpack package is not installed.
+    """
+    if msgpack is None:
+        raise RuntimeError('Decoding messages from MessagePack requires the msgpack package')
+    return decode(message_type, msgpack.unpackb(data, raw=False))
+
+
+def encode_value(value: Any) -> Any:
+    """
+    Converts a value of any type, used for fields whose type alone does not tell how to convert them.
+    """
+    if value is None or isinstance(value, _PRIMITIVE_TYPES):
+        return value
+    if dataclasses.is_dataclass(value) and not isinstance(value, type):
+        return encode(value)
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, Mapping):
+        return {key: encode_value(item) for key, item in value.items()}
+    if isinstance(value, Collection) and not isinstance(value, (bytes, bytearray)):
+        return [encode_value(item) for item in value]
+    return value
+
+
+def _compile_encoder(message_type: type) -> Callable[[Any], Dict[str, Any]]:
+    if not dataclasses.is_dataclass(message_type):
+        raise TypeError(f'{message_type.__name__} is not a dataclass')
+
+    type_hints = get_type_hints(message_type)
+    namespace: Dict[str, Any] = {}
+    items = []
+    for index, field in enumerate(dataclasses.fields(message_type)):
+        field_encoder = _field_encoder(type_hints.get(field.name, Any))
+        if field_encoder is None:
+            items.append(f'{field.name!r}: message.{field.name}')
+        else:
+            namespace[f'encode_{index}'] = field_encoder
+            items.append(f'{field.name!r}: encode_{index}(message.{field.name})')
+    exec(f'def encode(message):\n    return {{{", ".join(items)}}}\n', namespace)
+    _encoders[message_type] = namespace['encode']
+    return namespace['encode']
+
+
+def _field_encoder(type_hint: Any) -> Optional[Callable[[Any], Any]]:
+    """
+    :return: A function converting values of the type, or None if they can be used as they are.
+    """
+    if _is_primitive(type_hint):
+        return None
+    origin = typing.get_origin(type_hint)
+    arguments = typing.get_args(type_hint)
+    if origin in (list, set, frozenset, tuple) and arguments and all(_is_primitive(item) for item in arguments
+                                                                     if item is not Ellipsis):
+        return list
+    if origin is dict and len(arguments) == 2 and _is_primitive(arguments[1]):
+        return dict
+    # Anything else might contain dataclasses of a subclass of the declared type, or plain dicts of them.
+    return encode_value
+
+
+def _is_primitive(type_hint: Any) -> bool:
+    if type_hint in _PRIMITIVE_TYPES or type_hint is type(None):
+        return True
+    if typing.get_origin(type_hint) is typing.Union:
+        return all(_is_primitive(argument) for argument in typing.get_args(type_hint))
+    return False
+
+
+def _compile_decoder(message_type: type) -> Callable[[Dict[str, Any]], Any]:
+    if not dataclasses.is_dataclass(message_type):
+        raise TypeError(f'{message_type.__name__} is not a dataclass')
+
+    type_hints = get_type_hints(message_type)
+    namespace: Dict[str, Any] = {'message_type': message_type}
+    lines = ['def decode(data):', '    values = {}']
+    for index, field in enumerate(dataclasses.fields(message_type)):
+        if not field.init:
+            continue
+        field_decoder = _field_decoder(type_hints.get(field.name, Any))
+        value = f"data[{field.name!r}]"
+        if field_decoder is not None:
+            namespace[f'decode_{index}'] = field_decoder
+            value = f'decode_{index}({value})'
+        lines.append(f'    if {field.name!r} in data:')
+        lines.append(f'        values[{field.name!r}] = {value}')
+    lines.append('    return message_type(**values)')
+    exec('\n'.join(lines) + '\n', namespace)
+    _decoders[message_type] = namespace['decode']
+    return namespace['decode']
+
+
+def _field_decoder(type_hint: Any) -> Optional[Callable[[Any], Any]]:
+    """
+    :return: A function converting received values to the type, or None if they can be used as they are.
+    """
+    if _is_primitive(type_hint) or type_hint is Any or type_hint is object:
+        return None
+    if dataclasses.is_dataclass(type_hint):
+        return lambda value: decode(type_hint, value) if isinstance(value, Mapping) else value
+    if isinstance(type_hint, type) and issubclass(type_hint, Enum):
+        return type_hint
+
+    origin = typing.get_origin(type_hint)
+    arguments = typing.get_args(type_hint)
+    if origin is typing.Union:
+        not_none = [argument for argument in arguments if argument is not type(None)]
+        item_decoder = _field_decoder(not_none[0]) if len(not_none) == 1 else None
+        if item_decoder is None:
+            return None
+        return lambda value: None if value is None else item_decoder(value)
+    if origin in (list, set, frozenset, tuple):
+        item_decoder = _field_decoder(arguments[0]) if arguments else None
+        if item_decoder is None:
+            return origin
+        return lambda value: origin(item_decoder(item) for item in value)
+    if origin is dict and len(arguments) == 2:
+        item_decoder = _field_decoder(arguments[1])
+        if item_decoder is None:
+            return None
+        return lambda value: {key: item_decoder(item) for key, item in value.items()}
+    return None
@@ -1,5 +1,15 @@
 class MessageIdentifiers:
     VIDEO_FRAME_GRABBED = 'video_frame'
+    BINARY_VIDEO_FRAME_GRABBED = 'video_frame_binary'
+    TILE_DELTA_FRAME_GRABBED = 'video_frame_delta'
+    SET_VIDEO_TRANSPORT_REQUEST = 'set_video_transport'
+    SET_VIDEO_TRANSPORT_RESPONSE = 'set_video_transport_result'
+    SET_VIDEO_QUALITY_REQUEST = 'set_video_quality'
+    SET_VIDEO_QUALITY_RESPONSE = 'set_video_quality_result'
+    GET_STREAM_STATUS_REQUEST = 'get_stream_status'
+    GET_STREAM_STATUS_RESPONSE = 'stream_status'
+    UPDATE_STREAM_OPTION_VALUES = 'update_stream_option_values'
+    STREAM_PROBE = 'stream_probe'
     CURRENT_VIDEO_REQUEST = 'get_current_video'
     CURRENT_VIDEO_RESPONSE = 'current_video_result'
     CONNECT_VIDEO_REQUEST = 'connect_video'
@@ -7,11 +17,14 @@ class MessageIdentifiers:
     DISCONNECT_VIDEO = 'disconnect_video'
     ALL_VIDEO_REQUEST = 'get_available_video'
     ALL_VIDEO_RESPONSE = 'all_videos'
+    REFRESH_DEVICES = 'refresh_devices'
+    DEVICES_CHANGED = 'devices_changed'
     CURRENT_SERIAL_REQUEST = 'get_current_serial'
     CURRENT_SERIAL_RESPONSE = 'current_serial_result'
     CONNECT_SERIAL_REQUEST = 'connect_serial'
     CONNECT_SERIAL_RESPONSE = 'connect_serial_response'
     DISCONNECT_SERIAL = 'disconnect_serial'
+    SERIAL_CONNECTION_STATE = 'serial_connection_state'
     ALL_SERIALS_REQUEST = 'get_all_serial'
     ALL_SERIALS_RESPONSE = 'all_serials'
     GET_PROGRAMS_REQUEST = 'get_available_programs'
@@ -25,7 +38,19 @@ class MessageIdentifiers:
     # TODO: rename this, there should be separate messages for tapping, holding and releasing!
     PRESS_BUTTON = 'press_button'
     MOVE_JOYSTICK = 'move_joystick'
+    START_MACRO_RECORDING = 'start_macro_recording'
+    STOP_MACRO_RECORDING_REQUEST = 'stop_macro_recording'
+    STOP_MACRO_RECORDING_RESPONSE = 'stop_macro_recording_result'
+    PLAY_MACRO_REQUEST = 'play_macro'
+    PLAY_MACRO_RESPONSE = 'play_macro_result'
     DIALOG_CLOSED = 'close_dialog'
     SHOW_DIALOG_REQUEST = 'show_dialog'
     LOG_LINE_EMITTED = 'log_line'
+    LOG_LINES_EMITTED = 'log_lines'
+    SET_LOG_OPTIONS_REQUEST = 'set_log_options'
+    SET_LOG_OPTIONS_RESPONSE = 'set_log_options_result'
+    GET_LOG_HISTORY_REQUEST = 'get_log_history'
+    GET_LOG_HISTORY_RESPONSE = 'log_history'
     WELCOME = 'welcome'
+    STATE_PATCH = 'state_patch'
+    RESUME_STATE_REQUEST = 'resume_state'
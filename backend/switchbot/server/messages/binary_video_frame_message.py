@@ -0,0 +1,39 @@
+import struct
+from dataclasses import dataclass
+from typing import ClassVar
+
+CODEC_JPEG = 0
+
+
+@dataclass(kw_only=True)
+class BinaryVideoFrameMessage:
+    """
+    A video frame that is sent as a binary attachment instead of as base64 encoded JSON.
+
+    The wire format is a fixed-size little-endian header (see HEADER) directly followed by the encoded image.
+    """
+    # Sequence number (uint32), capture timestamp in seconds (float64), width and height (uint16 each), codec (uint8).
+    HEADER: ClassVar[struct.Struct] = struct.Struct('<IdHHB')
+
+    sequence: int
+    timestamp: float
+    width: int
+    height: int
+    codec: int = CODEC_JPEG
+    image: bytes
+
+    def to_bytes(self) -> bytes:
+        header = self.HEADER.pack(self.sequence & 0xFFFFFFFF, self.timestamp, self.width, self.height, self.codec)
+        return b''.join((header, self.image))
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'BinaryVideoFrameMessage':
+        sequence, timestamp, width, height, codec = cls.HEADER.unpack_from(data)
+        return cls(
+            sequence=sequence,
+            timestamp=timestamp,
+            width=width,
+            height=height,
+            codec=codec,
+            image=bytes(data[cls.HEADER.size:]),
+        )
@@ -0,0 +1,19 @@
+from dataclasses import dataclass
+from typing import List
+
+from dataclasses_json import dataclass_json
+
+from switchbot.bot.video_connector import CameraDescriptor
+
+
+@dataclass_json
+@dataclass(kw_only=True)
+class DeviceChangesMessage:
+    """
+    Sent to all clients when cameras or serial ports were plugged in or out, so they can update their lists
+    without asking for all devices again.
+    """
+    added_video: List[CameraDescriptor]
+    removed_video: List[CameraDescriptor]
+    added_serial: List[str]
+    removed_serial: List[str]
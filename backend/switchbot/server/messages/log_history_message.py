@@ -0,0 +1,19 @@
+from dataclasses import dataclass
+from typing import List, Optional
+
+from dataclasses_json import dataclass_json
+
+from ...util.log_store import StoredLogRecord
+
+
+@dataclass_json
+@dataclass(kw_only=True)
+class LogHistoryMessage:
+    """
+    A page of stored log records, newest first. The level of each record is the number of the logging level.
+    """
+    success: bool
+    error_message: Optional[str] = None
+    records: List[StoredLogRecord]
+    # Pass as before_id to get the next, older page, None if this is the last one.
+    next_before_id: Optional[int] = None
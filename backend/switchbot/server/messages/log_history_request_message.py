@@ -0,0 +1,23 @@
+from dataclasses import dataclass
+from typing import Optional
+
+from dataclasses_json import dataclass_json
+
+
+@dataclass_json
+@dataclass(kw_only=True)
+class LogHistoryRequestMessage:
+    """
+    Sent by clients to get a page of stored log records, newest first. All filters are optional.
+    """
+    program: Optional[str] = None
+    # The name of the lowest level to return, such as INFO.
+    min_level: Optional[str] = None
+    # Seconds since the epoch, records logged at this time or later.
+    since: Optional[float] = None
+    # Seconds since the epoch, records logged before this time.
+    until: Optional[float] = None
+    encounter: Optional[int] = None
+    # The next_before_id of the previous page, to continue with older records.
+    before_id: Optional[int] = None
+    limit: int = 100
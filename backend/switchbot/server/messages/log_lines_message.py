@@ -0,0 +1,15 @@
+from dataclasses import dataclass
+from typing import List
+
+from dataclasses_json import dataclass_json
+
+
+@dataclass_json
+@dataclass(kw_only=True)
+class LogLinesMessage:
+    """
+    A batch of log lines, oldest first.
+    """
+    lines: List[str]
+    # Lines that were dropped since the previous batch because clients could not keep up.
+    dropped: int
@@ -0,0 +1,16 @@
+from dataclasses import dataclass
+from typing import Optional
+
+from dataclasses_json import dataclass_json
+
+
+@dataclass_json
+@dataclass(kw_only=True)
+class LogOptionsMessage:
+    """
+    Sent by clients to choose which log lines they receive and how.
+    """
+    # The name of the lowest level to receive, such as INFO.
+    level: Optional[str] = None
+    # Whether to receive log_lines batches instead of a log_line message per line.
+    batched: bool = False
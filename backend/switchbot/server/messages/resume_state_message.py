@@ -0,0 +1,13 @@
+from dataclasses import dataclass
+
+from dataclasses_json import dataclass_json
+
+
+@dataclass_json
+@dataclass(kw_only=True)
+class ResumeStateMessage:
+    """
+    Sent by clients that reconnected to only receive the state patches they missed, see StatePatchMessage.
+    """
+    epoch: str
+    revision: int
@@ -0,0 +1,17 @@
+from dataclasses import dataclass
+from typing import Optional
+
+from dataclasses_json import dataclass_json
+
+
+@dataclass_json
+@dataclass(kw_only=True)
+class SerialConnectionStateMessage:
+    """
+    Sent to all clients whenever the connection to the controller is established, lost or closed.
+    """
+    # One of the values of ConnectionState.
+    state: str
+    port: Optional[str]
+    # Failed attempts to reconnect since the connection was lost.
+    reconnect_attempts: int
@@ -0,0 +1,16 @@
+from dataclasses import dataclass
+from typing import List, Dict
+
+from dataclasses_json import dataclass_json
+
+
+@dataclass_json
+@dataclass(kw_only=True)
+class StatePatchMessage:
+    """
+    The changes from revision - 1 to revision of the server's state document, as JSON Patch (RFC 6902) operations.
+    The document's fields are the same as the ones of WelcomeMessage.
+    """
+    epoch: str
+    revision: int
+    operations: List[Dict[str, object]]
@@ -0,0 +1,20 @@
+from dataclasses import dataclass
+from typing import List, Dict
+
+from dataclasses_json import dataclass_json
+
+from switchbot.program.option import Option
+
+
+@dataclass_json
+@dataclass(kw_only=True)
+class StreamStatusMessage:
+    """
+    Describes the targets of the adaptive video stream as options, together with the values
+    the stream controller currently chose and the measurements it based them on.
+    """
+    options: List[Option]
+    option_values: Dict[str, object]
+    metrics: Dict[str, float]
+    dropped_frames: Dict[str, int]
+    skipped_unchanged_frames: int
@@ -0,0 +1,68 @@
+import struct
+from dataclasses import dataclass, field
+from typing import ClassVar, List
+
+from .binary_video_frame_message import CODEC_JPEG
+
+
+@dataclass(kw_only=True)
+class Tile:
+    # Position of the tile's top left corner in pixels.
+    x: int
+    y: int
+    # The encoded image of the tile. Its size is stored in the image itself.
+    image: bytes
+
+
+@dataclass(kw_only=True)
+class TileDeltaMessage:
+    """
+    A video frame that only contains the regions that changed since the previous message, sent as a binary attachment.
+
+    A keyframe contains a single tile covering the whole frame and replaces everything a client has received before.
+    All other messages contain tiles that have to be drawn on top of the previously reconstructed frame.
+
+    The wire format is a fixed-size little-endian header (see HEADER) followed by tile_count tiles,
+    each consisting of a tile header (see TILE_HEADER) directly followed by the encoded tile image.
+    """
+    # Sequence number (uint32), capture timestamp in seconds (float64), width and height of the full frame
+    # (uint16 each), codec (uint8), whether this is a keyframe (bool), tile count (uint16).
+    HEADER: ClassVar[struct.Struct] = struct.Struct('<IdHHB?H')
+    # Position of the tile (uint16 each) and length of the encoded tile image in bytes (uint32).
+    TILE_HEADER: ClassVar[struct.Struct] = struct.Struct('<HHI')
+
+    sequence: int
+    timestamp: float
+    width: int
+    height: int
+    codec: int = CODEC_JPEG
+    is_keyframe: bool
+    tiles: List[Tile] = field(default_factory=list)
+
+    def to_bytes(self) -> bytes:
+        parts = [self.HEADER.pack(self.sequence & 0xFFFFFFFF, self.timestamp, self.width, self.height, self.codec,
+                                  self.is_keyframe, len(self.tiles))]
+        for tile in self.tiles:
+            parts.append(self.TILE_HEADER.pack(tile.x, tile.y, len(tile.image)))
+            parts.append(tile.image)
+        return b''.join(parts)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'TileDeltaMessage':
+        sequence, timestamp, width, height, codec, is_keyframe, tile_count = cls.HEADER.unpack_from(data)
+        offset = cls.HEADER.size
+        tiles: List[Tile] = []
+        for _ in range(tile_count):
+            x, y, length = cls.TILE_HEADER.unpack_from(data, offset)
+            offset += cls.TILE_HEADER.size
+            tiles.append(Tile(x=x, y=y, image=bytes(data[offset:offset + length])))
+            offset += length
+        return cls(
+            sequence=sequence,
+            timestamp=timestamp,
+            width=width,
+            height=height,
+            codec=codec,
+            is_keyframe=is_keyframe,
+            tiles=tiles,
+        )
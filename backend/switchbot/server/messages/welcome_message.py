@@ -18,5 +18,9 @@ class WelcomeMessage:
     current_video: Optional[CameraDescriptor]
     available_video: List[CameraDescriptor]
     current_serial: Optional[str]
+    serial_connection_state: str
     available_serial: List[str]
     current_dialog: Optional[Dialog]
+    # The revision of the state document these fields were taken from, see StateDocument.
+    state_epoch: str
+    state_revision: int
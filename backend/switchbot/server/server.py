@@ -1,28 +1,42 @@
 import asyncio
-import base64
 import logging
 import sys
-from asyncio import sleep
 from pathlib import Path
 from typing import Optional, Type, Dict, cast, List
 
-import cv2
 import socketio
 from serial import SerialException
 
 from .messages.start_program_message import StartProgramMessage
-from .messages.welcome_message import WelcomeMessage
+from ..bot.device_registry import DeviceChanges
+from ..bot.macro import MacroRecorder, Macro, MacroPlayer
+from ..bot.port_supervisor import PortSupervisor
+from ..bot.serial_connector import ConnectionState, OutagePolicy
 from ..bot.switch_bot import SwitchBot
 from ..bot.video_connector import CameraDescriptor
 from ..program.program import Program, ProgramMetadata
 from ..program.program_loader import import_program_from_directory
+from . import message_codec
 from .message_identifiers import MessageIdentifiers
 from .messages.current_program_message import CurrentProgramMessage
+from .messages.device_changes_message import DeviceChangesMessage
 from .messages.dialog_closed_message import DialogClosedMessage
+from .messages.log_history_message import LogHistoryMessage
+from .messages.log_history_request_message import LogHistoryRequestMessage
+from .messages.log_options_message import LogOptionsMessage
 from .messages.result_message import ResultMessage
-from .messages.video_frame_message import VideoFrameMessage
+from .messages.resume_state_message import ResumeStateMessage
+from .messages.state_patch_message import StatePatchMessage
+from .messages.serial_connection_state_message import SerialConnectionStateMessage
+from .messages.stream_status_message import StreamStatusMessage
+from .video_quality import QUALITY_TIERS
+from .video_streamer import VideoStreamer
+from .video_transport import VideoTransport
+from .welcome_snapshot import WelcomeSnapshot
 from ..util.cyclic_buffer_handler import CyclicBufferHandler
-from ..util.emitting_socket_handler import EmittingSocketHandler
+from ..util.emitting_socket_handler import EmittingSocketHandler, ClientLogSettings
+from ..util.log_store import LogStore, LogPage
+from ..util.storing_log_handler import StoringLogHandler
 
 logger = logging.getLogger('Server')
 handler = logging.StreamHandler(sys.stdout)
@@ -51,16 +65,47 @@ MESSAGE_BUTTON_TO_BUTTON_NAME = {
     'Down': 'DD',
 }
 
+# Recorded macros are stored as JSON files in this directory.
+MACROS_PATH = Path('./macros')
+# The log records of all programs are stored in this SQLite database.
+LOG_STORE_PATH = Path('./logs/program_logs.sqlite3')
+# The most log records a client can get at once.
+MAX_LOG_HISTORY_PAGE_SIZE = 1000
+
 
 class Server:
-    def __init__(self, sio: socketio.Server):
+    def __init__(self,
+                 sio: socketio.Server,
+                 encoder_threads: int = 2,
+                 ack_window: int = 0,
+                 outage_policy: OutagePolicy = OutagePolicy.BUFFER,
+                 log_store_path: Path = LOG_STORE_PATH,
+                 log_retention_days: Optional[float] = 30.0,
+                 log_max_records: Optional[int] = 1_000_000):
         self.sio: socketio.Server = sio
-        self.bot: SwitchBot = SwitchBot(sio)
+        self.bot: SwitchBot = SwitchBot(sio, ack_window=ack_window, outage_policy=outage_policy)
+        # Reconnects to the controller after it was unplugged, started with the first connection.
+        self.port_supervisor: PortSupervisor = PortSupervisor(self.bot.serial)
         self.emitter_task: Optional[asyncio.Task] = None
         self.programs: List[Program] = []
         self.program_task: Optional[asyncio.Task] = None
         self.program_instance: Optional[Program] = None
         self.log_buffer_handler = CyclicBufferHandler(level=logging.DEBUG)
+        # Shared by all programs so their lines are sent to clients in the same batches.
+        self.log_streaming_handler = EmittingSocketHandler(sio, level=logging.DEBUG)
+        # Keeps every line, for clients looking at what happened before they connected.
+        self.log_store: LogStore = LogStore(log_store_path, retention_days=log_retention_days,
+                                            max_records=log_max_records)
+        self.log_store.start()
+        self.log_store_handler = StoringLogHandler(self.log_store, level=logging.DEBUG)
+        # Updated whenever something sent to joining clients changes, instead of collecting it on every connect.
+        self.welcome_snapshot: WelcomeSnapshot = WelcomeSnapshot(self.log_buffer_handler)
+        self.video_streamer: VideoStreamer = VideoStreamer(sio, self.bot, encoder_threads=encoder_threads)
+        self.macro_recorder: Optional[MacroRecorder] = None
+        self.macro_task: Optional[asyncio.Task] = None
+        self.bot.serial.add_connection_listener(self._on_serial_connection_state)
+        self.bot.devices.add_listener(self._on_device_changes)
+        self.bot.display.add_dialog_listener(self.welcome_snapshot.set_current_dialog)
 
         sio.on('connect', self.connect)
         sio.on('disconnect', self.disconnect)
@@ -72,6 +117,7 @@ class Server:
         sio.on(MessageIdentifiers.DISCONNECT_VIDEO, self.disconnect_video)
         sio.on(MessageIdentifiers.CURRENT_VIDEO_REQUEST, self.emit_current_video)
         sio.on(MessageIdentifiers.ALL_VIDEO_REQUEST, self.emit_available_video)
+        sio.on(MessageIdentifiers.REFRESH_DEVICES, self.refresh_devices)
         sio.on(MessageIdentifiers.GET_PROGRAMS_REQUEST, self.emit_available_programs)
         sio.on(MessageIdentifiers.START_PROGRAM_REQUEST, self.start_program)
         sio.on(MessageIdentifiers.STOP_PROGRAM, self.stop_current_program)
@@ -79,116 +125,213 @@ class Server:
         sio.on(MessageIdentifiers.DIALOG_CLOSED, self.close_dialog)
         sio.on(MessageIdentifiers.PRESS_BUTTON, self.press_button)
         sio.on(MessageIdentifiers.MOVE_JOYSTICK, self.move_joystick)
+        sio.on(MessageIdentifiers.START_MACRO_RECORDING, self.start_macro_recording)
+        sio.on(MessageIdentifiers.STOP_MACRO_RECORDING_REQUEST, self.stop_macro_recording)
+        sio.on(MessageIdentifiers.PLAY_MACRO_REQUEST, self.play_macro)
         sio.on(MessageIdentifiers.GET_RUNNING_PROGRAM_REQUEST, self.emit_current_program)
+        sio.on(MessageIdentifiers.SET_VIDEO_TRANSPORT_REQUEST, self.set_video_transport)
+        sio.on(MessageIdentifiers.SET_VIDEO_QUALITY_REQUEST, self.set_video_quality)
+        sio.on(MessageIdentifiers.GET_STREAM_STATUS_REQUEST, self.emit_stream_status)
+        sio.on(MessageIdentifiers.UPDATE_STREAM_OPTION_VALUES, self.update_stream_option_values)
+        sio.on(MessageIdentifiers.RESUME_STATE_REQUEST, self.resume_state)
+        sio.on(MessageIdentifiers.SET_LOG_OPTIONS_REQUEST, self.set_log_options)
+        sio.on(MessageIdentifiers.GET_LOG_HISTORY_REQUEST, self.emit_log_history)
 
         # Load programs from directory when the server is started.
         self._do_reload_programs()
+        # Only push changes afterwards, there is no event loop and no client before the server runs.
+        self.welcome_snapshot.document.add_listener(self._on_state_patch)
+
+    async def shutdown(self) -> None:
+        """
+        Writes the log records that were not stored yet. Must be called when the server stops.
+        """
+        await asyncio.get_running_loop().run_in_executor(None, self.log_store.stop)
 
     async def connect(self, sid, environ, auth):
         logger.info(f'Client with ID {sid} connected.')
+        # Older clients only understand base64 frames in the default quality, so use those until the client asks
+        # for something else.
+        self.video_streamer.add_client(sid)
+        # Same for log lines, which are sent one by one until the client asks for batches.
+        self.log_streaming_handler.add_client(sid)
+        # Enumerates devices in the background on the first connection, clients are told about them once done.
+        self.bot.devices.start()
+
+        # Clients that were connected before can pass the state they know to only receive what they missed.
+        if isinstance(auth, dict) and 'state_epoch' in auth and 'state_revision' in auth:
+            await self.resume_state(sid, {'epoch': auth['state_epoch'], 'revision': auth['state_revision']})
+        else:
+            await self.sio.emit(MessageIdentifiers.WELCOME, self.welcome_snapshot.to_dict(), to=sid)
+            logger.info(f'Sent welcome message to client {sid}')
+
+    async def resume_state(self, sid, data: Dict[str, object]):
+        message: ResumeStateMessage = message_codec.decode(ResumeStateMessage, data)
+        patches = self.welcome_snapshot.document.patches_since(message.epoch, message.revision)
+        if patches is None:
+            await self.sio.emit(MessageIdentifiers.WELCOME, self.welcome_snapshot.to_dict(), to=sid)
+            logger.info(f'Client {sid} can\'t resume from revision {message.revision}, sent welcome message')
+            return
+        for patch in patches:
+            await self.sio.emit(MessageIdentifiers.STATE_PATCH, message_codec.encode(patch), to=sid)
+        logger.info(f'Client {sid} resumed from revision {message.revision} with {len(patches)} patches')
 
-        logger.debug(f'Building current state for client {sid}...')
-        welcome_message = WelcomeMessage(
-            available_programs=[ProgramMetadata.to_dict(program.metadata) for program in self.programs],
-            current_video=CameraDescriptor.to_dict(self.bot.video.active_camera_descriptor)
-            if self.bot.video.active_camera_descriptor is not None
-            else None,
-            available_video=[CameraDescriptor.to_dict(descriptor) for descriptor in self.bot.video.list_cameras()],
-            current_serial=self.bot.serial.port_identifier,
-            available_serial=self.bot.serial.list_serial_ports(),
-            current_dialog=self.program_instance.current_dialog.to_dict()
-            if self.program_instance is not None
-               and self.program_instance.current_dialog is not None else None,
-            current_program_name=self.program_instance.metadata.name if self.program_instance is not None else None,
-            current_program_options=self.program_instance.option_values if self.program_instance is not None else None,
-            recent_program_logs=list(self.log_buffer_handler.get_buffered_records()),
-        )
-        await self.sio.emit(MessageIdentifiers.WELCOME, WelcomeMessage.to_dict(welcome_message))
-        logger.info(f'Sent welcome message to client {sid}')
+    def _on_state_patch(self, patch: StatePatchMessage):
+        asyncio.ensure_future(self.sio.emit(MessageIdentifiers.STATE_PATCH, message_codec.encode(patch)))
 
     def disconnect(self, sid):
         logger.info(f'Client with ID {sid} disconnected.')
+        self.video_streamer.remove_client(sid)
+        self.log_streaming_handler.remove_client(sid)
+
+    async def set_log_options(self, sid, data: Dict[str, object]):
+        options: LogOptionsMessage = message_codec.decode(LogOptionsMessage, data)
+        level = logging.getLevelName(options.level) if options.level is not None else logging.DEBUG
+        if not isinstance(level, int):
+            message = ResultMessage(success=False, error_message=f'Unknown log level {options.level}')
+        else:
+            self.log_streaming_handler.add_client(sid, ClientLogSettings(level=level, batched=options.batched))
+            message = ResultMessage(success=True)
+        await self.sio.emit(MessageIdentifiers.SET_LOG_OPTIONS_RESPONSE, message_codec.encode(message), to=sid)
+
+    async def emit_log_history(self, sid, data: Dict[str, object]):
+        request: LogHistoryRequestMessage = message_codec.decode(LogHistoryRequestMessage, data or {})
+        min_level = logging.getLevelName(request.min_level) if request.min_level is not None else logging.NOTSET
+        if not isinstance(min_level, int):
+            message = LogHistoryMessage(success=False, error_message=f'Unknown log level {request.min_level}',
+                                        records=[])
+        else:
+            page: LogPage = await self.log_store.query_async(
+                program=request.program, min_level=min_level, since=request.since, until=request.until,
+                encounter=request.encounter, before_id=request.before_id,
+                limit=max(1, min(request.limit, MAX_LOG_HISTORY_PAGE_SIZE)))
+            message = LogHistoryMessage(success=True, records=page.records, next_before_id=page.next_before_id)
+        await self.sio.emit(MessageIdentifiers.GET_LOG_HISTORY_RESPONSE, message_codec.encode(message), to=sid)
+
+    async def set_video_transport(self, sid, transport_name: str):
+        try:
+            transport = VideoTransport(transport_name)
+        except ValueError:
+            message = ResultMessage(success=False, error_message=f'Unknown video transport {transport_name}')
+        else:
+            self.video_streamer.set_transport(sid, transport)
+            logger.info(f'Client {sid} now receives video frames using transport {transport.value}')
+            message = ResultMessage(success=True)
+        await self.sio.emit(MessageIdentifiers.SET_VIDEO_TRANSPORT_RESPONSE, message_codec.encode(message), to=sid)
+
+    async def set_video_quality(self, sid, tier_name: str):
+        tier = QUALITY_TIERS.get(tier_name, None)
+        if tier is None:
+            message = ResultMessage(success=False, error_message=f'Unknown video quality {tier_name}')
+        else:
+            self.video_streamer.set_quality_tier(sid, tier)
+            logger.info(f'Client {sid} now receives video frames in quality {tier.name}')
+            message = ResultMessage(success=True)
+        await self.sio.emit(MessageIdentifiers.SET_VIDEO_QUALITY_RESPONSE, message_codec.encode(message), to=sid)
 
     async def connect_serial(self, _sid, port: str):
         logger.info(f'Requested to connect to port {port}')
         try:
             self.bot.serial.connect(port)
+            self.port_supervisor.start()
             message = ResultMessage(success=True)
         except SerialException as exception:
             message = ResultMessage(success=False, error_message=str(exception))
-        await self.sio.emit(MessageIdentifiers.CONNECT_SERIAL_RESPONSE, ResultMessage.to_dict(message))
+        await self.sio.emit(MessageIdentifiers.CONNECT_SERIAL_RESPONSE, message_codec.encode(message))
 
     def disconnect_serial(self, _sid):
         self.bot.serial.disconnect()
 
+    def _on_serial_connection_state(self, connection_state: ConnectionState):
+        self.welcome_snapshot.set_serial(self.bot.serial.port_identifier, connection_state.value)
+        # Called from within the connector, so emit without waiting for it.
+        asyncio.ensure_future(self.emit_serial_connection_state())
+
+    async def emit_serial_connection_state(self, sid=None):
+        message = SerialConnectionStateMessage(
+            state=self.bot.serial.connection_state.value,
+            port=self.bot.serial.port_identifier,
+            reconnect_attempts=self.port_supervisor.reconnect_attempts,
+        )
+        await self.sio.emit(MessageIdentifiers.SERIAL_CONNECTION_STATE,
+                            message_codec.encode(message), to=sid)
+
     async def emit_current_serial(self, sid):
         await self.sio.emit(MessageIdentifiers.CURRENT_SERIAL_RESPONSE, self.bot.serial.port_identifier, to=sid)
 
     async def emit_available_serial(self, sid):
-        await self.sio.emit(MessageIdentifiers.ALL_SERIALS_RESPONSE, self.bot.serial.list_serial_ports(), to=sid)
+        await self.sio.emit(MessageIdentifiers.ALL_SERIALS_RESPONSE, await self.bot.devices.get_serial_ports(), to=sid)
+
+    async def refresh_devices(self, _sid):
+        # Changes are pushed to all clients by _on_device_changes.
+        await self.bot.devices.refresh()
+
+    def _on_device_changes(self, changes: DeviceChanges):
+        self.welcome_snapshot.set_available_devices(self.bot.devices.cameras, self.bot.devices.serial_ports)
+        asyncio.ensure_future(self.emit_device_changes(changes))
+
+    async def emit_device_changes(self, changes: DeviceChanges):
+        message = DeviceChangesMessage(
+            added_video=[message_codec.encode(descriptor) for descriptor in changes.added_cameras],
+            removed_video=[message_codec.encode(descriptor) for descriptor in changes.removed_cameras],
+            added_serial=changes.added_serial_ports,
+            removed_serial=changes.removed_serial_ports,
+        )
+        await self.sio.emit(MessageIdentifiers.DEVICES_CHANGED, message_codec.encode(message))
+
+    async def emit_stream_status(self, sid=None):
+        controller = self.video_streamer.controller
+        message = StreamStatusMessage(
+            options=controller.options,
+            option_values=controller.option_values,
+            metrics=controller.metrics,
+            dropped_frames=self.video_streamer.dropped_frames,
+            skipped_unchanged_frames=self.video_streamer.skipped_unchanged_frames,
+        )
+        await self.sio.emit(MessageIdentifiers.GET_STREAM_STATUS_RESPONSE, message_codec.encode(message), to=sid)
+
+    async def update_stream_option_values(self, _sid, option_values: Dict[str, object]):
+        self.video_streamer.controller.update_option_values(option_values)
+        # Let all clients know about the new targets.
+        await self.emit_stream_status()
 
     async def connect_video(self, sid, descriptor_json: Dict[str, object]):
-        descriptor = CameraDescriptor.from_dict(descriptor_json)
+        descriptor = message_codec.decode(CameraDescriptor, descriptor_json)
 
         self.bot.video.connect(descriptor)
+        self.welcome_snapshot.set_current_video(descriptor)
 
         if self.emitter_task is not None:
             self.emitter_task.cancel()
-        self.emitter_task = self.sio.start_background_task(target=self.emit_frames)
+        self.emitter_task = self.sio.start_background_task(target=self.video_streamer.run)
 
         message = ResultMessage(success=True)
-        await self.sio.emit(MessageIdentifiers.CONNECT_VIDEO_RESPONSE, ResultMessage.to_dict(message), to=sid)
-
-    async def emit_frames(self):
-        logger.debug('Starting to emit frames...')
-
-        if self.bot.video.capture is None:
-            logger.warning('Could not start emitting frames as capture is None!')
-            return
-        elif not self.bot.video.capture.isOpened():
-            logger.warning('Could not start emitting frames as capture is not open!')
-            return
-
-        while self.bot.video.capture is not None and self.bot.video.capture.isOpened():
-            success, frame = self.bot.video.capture.read()
-            if not success:
-                continue
-            # Scale down image to save on bandwidth
-            frame = cv2.resize(src=frame, dsize=(0, 0), fx=0.25, fy=0.25)
-            success, jpg = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 75])
-            if not success:
-                continue
-
-            b64_image: str = base64.b64encode(jpg).decode()
-            message: VideoFrameMessage = VideoFrameMessage(image=b64_image)
-            await self.sio.emit(MessageIdentifiers.VIDEO_FRAME_GRABBED, VideoFrameMessage.to_dict(message))
-            # Also sleep for a single video frame so that other tasks can run!
-            await sleep(1.0 / 60.0)
-        logger.debug('Stopped emitting frame because capture was closed.')
+        await self.sio.emit(MessageIdentifiers.CONNECT_VIDEO_RESPONSE, message_codec.encode(message), to=sid)
 
     async def disconnect_video(self, _sid):
         logger.info('Disconnecting video...')
         self.bot.video.disconnect()
+        self.welcome_snapshot.set_current_video(None)
         await self.emit_current_video()
 
     async def emit_current_video(self, sid=None):
-        await self.sio.emit(MessageIdentifiers.CURRENT_VIDEO_RESPONSE, CameraDescriptor.to_dict(
+        await self.sio.emit(MessageIdentifiers.CURRENT_VIDEO_RESPONSE, message_codec.encode(
             self.bot.video.active_camera_descriptor) if self.bot.video.active_camera_descriptor is not None else None,
                             to=sid)
 
     async def emit_available_video(self, sid=None):
-        data: List[CameraDescriptor] = [CameraDescriptor.to_dict(descriptor) for descriptor in
-                                        self.bot.video.list_cameras()]
+        data: List[CameraDescriptor] = [message_codec.encode(descriptor) for descriptor in
+                                        await self.bot.devices.get_cameras()]
         await self.sio.emit(MessageIdentifiers.ALL_VIDEO_RESPONSE, data, to=sid)
 
     async def emit_available_programs(self, sid=None):
-        identifier_metadata = [ProgramMetadata.to_dict(program.metadata) for program in
+        identifier_metadata = [message_codec.encode(program.metadata) for program in
                                self.programs]
         # todo: does this correctly only emit to the chosen sid?
         await self.sio.emit(MessageIdentifiers.GET_PROGRAMS_RESPONSE, identifier_metadata, to=sid)
 
     async def start_program(self, sid, data: Dict[str, object]):
-        start_message: StartProgramMessage = StartProgramMessage.from_dict(data)
+        start_message: StartProgramMessage = message_codec.decode(StartProgramMessage, data)
 
         program_instance: Program = next(
             (program for program in self.programs if program.metadata.name == start_message.program_name), None)
@@ -202,6 +345,7 @@ class Server:
 
             # Start the program task to execute the program.
             self.program_instance = program_instance
+            self.welcome_snapshot.set_current_program(program_instance)
 
             async def do_run():
                 await program_instance.run(self.bot)
@@ -215,16 +359,17 @@ class Server:
             # Indicate that program start failed.
             message = ResultMessage(success=False,
                                     error_message=f'No program with name {start_message.program_name} found')
-        await self.sio.emit(MessageIdentifiers.START_PROGRAM_RESPONSE, ResultMessage.to_dict(message), to=sid)
+        await self.sio.emit(MessageIdentifiers.START_PROGRAM_RESPONSE, message_codec.encode(message), to=sid)
         await self.emit_current_program(sid)
 
     def _create_program_logger(self, name: str):
-        # Create a logging handler to emit each log line to the clients.
+        # Send the log lines to the clients.
         program_logger: logging.Logger = logging.getLogger(name)
-        emitting_handler = EmittingSocketHandler(self.sio, level=logging.DEBUG)
-        program_logger.addHandler(emitting_handler)
+        program_logger.addHandler(self.log_streaming_handler)
         # Also add the buffering handler that keeps the last log lines to emit on login.
         program_logger.addHandler(self.log_buffer_handler)
+        # And store all of them for history queries.
+        program_logger.addHandler(self.log_store_handler)
         console_handler = logging.StreamHandler()
         console_handler.setLevel(logging.DEBUG)
         formatter = logging.Formatter('%(asctime)s PROGRAM - %(name)s - %(levelname)s - %(message)s')
@@ -238,15 +383,18 @@ class Server:
         # Clear task to show that no program is running anymore.
         self.program_task = None
         self.program_instance = None
+        self.welcome_snapshot.set_current_program(None)
         await self.emit_current_program()
 
     def press_button(self, _sid, message_button_name: str):
         serial_button_name: Optional[str] = MESSAGE_BUTTON_TO_BUTTON_NAME.get(message_button_name, None)
         if serial_button_name is None:
             # todo: respond with error
-            pass
+            return
         # todo: handle exceptions and relay them in a message to the caller
-        self.bot.serial.write_command(f'T{serial_button_name}')
+        self.bot.serial.tap(serial_button_name)
+        if self.macro_recorder is not None:
+            self.macro_recorder.record_tap(serial_button_name)
 
     def move_joystick(self, _sid, data: Dict[str, object]):
         joystick: str = cast(str, data['joystick'])
@@ -258,12 +406,54 @@ class Server:
             self.bot.serial.set_left_joystick(angle, radius)
         elif joystick == 'right':
             self.bot.serial.set_right_joystick(angle, radius)
+        else:
+            return
+        if self.macro_recorder is not None:
+            self.macro_recorder.record_stick('L' if joystick == 'left' else 'R', angle, radius)
+
+    def start_macro_recording(self, _sid, name: str):
+        logger.info(f'Recording macro "{name}".')
+        self.macro_recorder = MacroRecorder(name)
+
+    async def stop_macro_recording(self, sid):
+        if self.macro_recorder is None:
+            message = ResultMessage(success=False, error_message='No macro is being recorded')
+        else:
+            macro = self.macro_recorder.stop()
+            self.macro_recorder = None
+            try:
+                macro.save(self._macro_path(macro.name))
+                logger.info(f'Saved macro "{macro.name}" with {len(macro.steps)} steps.')
+                message = ResultMessage(success=True)
+            except OSError as err:
+                message = ResultMessage(success=False, error_message=f'Failed to save macro: {err}')
+        await self.sio.emit(MessageIdentifiers.STOP_MACRO_RECORDING_RESPONSE, message_codec.encode(message), to=sid)
+
+    @staticmethod
+    def _macro_path(name: str) -> Path:
+        # Only use the last path component so clients can't read or write files outside the macro directory.
+        return MACROS_PATH / f'{Path(name).name}.json'
+
+    async def play_macro(self, sid, name: str):
+        try:
+            macro = Macro.load(self._macro_path(name))
+        except (OSError, ValueError, KeyError) as err:
+            message = ResultMessage(success=False, error_message=f'Failed to load macro {name}: {err}')
+            await self.sio.emit(MessageIdentifiers.PLAY_MACRO_RESPONSE, message_codec.encode(message), to=sid)
+            return
+
+        if self.macro_task is not None:
+            self.macro_task.cancel()
+        self.macro_task = self.sio.start_background_task(MacroPlayer(self.bot.serial).play, macro)
+        await self.sio.emit(MessageIdentifiers.PLAY_MACRO_RESPONSE, message_codec.encode(ResultMessage(success=True)),
+                            to=sid)
 
     async def stop_current_program(self, _sid):
         if self.program_task is not None:
             self.program_task.cancel()
             self.program_task = None
             self.program_instance = None
+            self.welcome_snapshot.set_current_program(None)
             # Only emit this update if we actually stopped anything.
             await self.emit_current_program()
 
@@ -273,7 +463,8 @@ class Server:
 
     async def close_dialog(self, _sid, data):
         logger.debug('Dialog closed handler called')
-        message: DialogClosedMessage = DialogClosedMessage.from_dict(data)
+        message: DialogClosedMessage = message_codec.decode(DialogClosedMessage, data)
+        self.welcome_snapshot.set_current_dialog(None)
         self.program_instance.on_user_interaction(message.button)
 
     async def emit_current_program(self, sid=None):
@@ -288,7 +479,7 @@ class Server:
         else:
             message = CurrentProgramMessage(metadata=None, option_values=None)
 
-        await self.sio.emit(MessageIdentifiers.GET_RUNNING_PROGRAM_RESPONSE, CurrentProgramMessage.to_dict(message),
+        await self.sio.emit(MessageIdentifiers.GET_RUNNING_PROGRAM_RESPONSE, message_codec.encode(message),
                             to=sid)
 
     def _do_reload_programs(self):
@@ -304,3 +495,4 @@ class Server:
                 self.programs.append(program_instance)
             else:
                 logger.info(f'Directory at {program_directory} contained no valid program definition.')
+        self.welcome_snapshot.set_programs(self.programs)
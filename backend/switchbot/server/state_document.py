@@ -0,0 +1,68 @@
+import collections
+import uuid
+from typing import Dict, List, Optional, Callable, Deque
+
+from .messages.state_patch_message import StatePatchMessage
+
+
+class StateDocument:
+    """
+    A JSON object describing the server's state with a revision that increases with every change.
+
+    Each change is recorded as a patch replacing the changed top-level fields, so clients that already know an
+    earlier revision only need the patches after it instead of the whole document. The last history_size patches
+    are kept for clients that resume after reconnecting.
+    """
+
+    def __init__(self, fields: Dict[str, object], history_size: int = 256):
+        self._fields: Dict[str, object] = dict(fields)
+        # Revisions start at 0 again when the server restarts, so clients must only resume with the same epoch.
+        self.epoch: str = uuid.uuid4().hex
+        self.revision: int = 0
+        self._history: Deque[StatePatchMessage] = collections.deque(maxlen=history_size)
+        self._listeners: List[Callable[[StatePatchMessage], None]] = []
+
+    def add_listener(self, listener: Callable[[StatePatchMessage], None]) -> None:
+        """
+        Calls the listener with every patch right after it was applied.
+        """
+        self._listeners.append(listener)
+
+    def get(self, name: str) -> object:
+        return self._fields[name]
+
+    def to_dict(self) -> Dict[str, object]:
+        return dict(self._fields)
+
+    def update(self, fields: Dict[str, object]) -> Optional[StatePatchMessage]:
+        """
+        Changes the given fields at once in a single revision. Fields with the same value as before are skipped.
+
+        :param fields: Values that can be serialized to JSON as they are.
+        :return: The patch applied, or None if nothing changed.
+        """
+        operations = [{'op': 'replace', 'path': f'/{name}', 'value': value}
+                      for name, value in fields.items() if self._fields.get(name) != value]
+        if not operations:
+            return None
+
+        self._fields.update(fields)
+        self.revision += 1
+        patch = StatePatchMessage(epoch=self.epoch, revision=self.revision, operations=operations)
+        self._history.append(patch)
+        for listener in list(self._listeners):
+            listener(patch)
+        return patch
+
+    def patches_since(self, epoch: str, revision: int) -> Optional[List[StatePatchMessage]]:
+        """
+        :return: The patches needed to get from the given revision to the current one, or None if some of them are
+        not kept anymore or the revision is unknown, in which case the whole document has to be sent.
+        """
+        if epoch != self.epoch:
+            return None
+        if revision == self.revision:
+            return []
+        if revision > self.revision or not self._history or self._history[0].revision > revision + 1:
+            return None
+        return [patch for patch in self._history if patch.revision > revision]
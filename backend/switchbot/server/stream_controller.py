@@ -0,0 +1,196 @@
+import logging
+from dataclasses import dataclass
+from time import monotonic
+from typing import Dict, List, Tuple, Optional
+
+from .video_quality import QualityTier
+from ..program.option import Option, IntOption, BoolOption
+
+logger = logging.getLogger('StreamController')
+
+MIN_FPS = 2.0
+MIN_SCALE_FACTOR = 0.25
+MIN_JPEG_QUALITY = 30
+# How much of a budget may be used before the controller starts to raise the stream quality again.
+HEADROOM = 0.6
+
+
+@dataclass
+class StreamTargets:
+    """
+    The limits the adaptive stream controller tries to stay within.
+    """
+    adaptive: bool = False
+    max_fps: int = 60
+    # The maximum time in milliseconds between grabbing a frame and it being sent to clients.
+    max_latency_ms: int = 200
+    # The maximum number of kilobytes per second sent to all clients combined.
+    max_bandwidth_kbps: int = 4000
+
+
+@dataclass
+class StreamDecisions:
+    """
+    The values the adaptive stream controller currently chose.
+    """
+    fps: float
+    # Multiplied with the scale of each quality tier.
+    scale_factor: float = 1.0
+    # Subtracted from the JPEG quality of each quality tier.
+    quality_reduction: int = 0
+
+
+class AdaptiveStreamController:
+    """
+    Adjusts the frame rate, scale and JPEG quality of the video stream so that the stream stays within the
+    configured latency and bandwidth targets.
+
+    The controller is updated once per interval with the measurements collected since the last update.
+    When a target is exceeded, quality is lowered first, then the frame rate and finally the resolution.
+    When there is enough headroom, the same steps are undone in reverse order.
+    """
+
+    def __init__(self, targets: Optional[StreamTargets] = None, interval: float = 1.0):
+        targets = targets if targets is not None else StreamTargets()
+        self.targets: StreamTargets = targets
+        self.decisions: StreamDecisions = StreamDecisions(fps=targets.max_fps)
+        self.interval: float = interval
+        self._window_start: float = monotonic()
+        self._window_bytes: int = 0
+        self._window_encode_times: List[float] = []
+        self._window_max_backlog: int = 0
+        self.metrics: Dict[str, float] = {}
+
+        self.adaptive_option = BoolOption(
+            name='Adaptive streaming',
+            description='Whether to automatically adjust frame rate and quality of the video stream',
+            default_value=targets.adaptive,
+            allow_change_at_runtime=True,
+        )
+        self.max_fps_option = IntOption(
+            name='Max FPS',
+            description='The maximum number of frames sent per second',
+            default_value=targets.max_fps,
+            min_value=1,
+            max_value=60,
+            allow_change_at_runtime=True,
+        )
+        self.max_latency_option = IntOption(
+            name='Max latency (ms)',
+            description='The maximum delay between a frame being grabbed and it being sent',
+            default_value=targets.max_latency_ms,
+            min_value=10,
+            allow_change_at_runtime=True,
+        )
+        self.max_bandwidth_option = IntOption(
+            name='Max bandwidth (kB/s)',
+            description='The maximum bandwidth used for the video stream of all clients combined',
+            default_value=targets.max_bandwidth_kbps,
+            min_value=50,
+            allow_change_at_runtime=True,
+        )
+
+    @property
+    def options(self) -> List[Option]:
+        return [self.adaptive_option, self.max_fps_option, self.max_latency_option, self.max_bandwidth_option]
+
+    @property
+    def option_values(self) -> Dict[str, object]:
+        return {
+            self.adaptive_option.name: self.targets.adaptive,
+            self.max_fps_option.name: self.targets.max_fps,
+            self.max_latency_option.name: self.targets.max_latency_ms,
+            self.max_bandwidth_option.name: self.targets.max_bandwidth_kbps,
+        }
+
+    def update_option_values(self, option_values: Dict[str, object]) -> None:
+        self.targets = StreamTargets(
+            adaptive=bool(option_values.get(self.adaptive_option.name, self.targets.adaptive)),
+            max_fps=int(option_values.get(self.max_fps_option.name, self.targets.max_fps)),
+            max_latency_ms=int(option_values.get(self.max_latency_option.name, self.targets.max_latency_ms)),
+            max_bandwidth_kbps=int(option_values.get(self.max_bandwidth_option.name,
+                                                     self.targets.max_bandwidth_kbps)),
+        )
+        if not self.targets.adaptive:
+            self.decisions = StreamDecisions(fps=self.targets.max_fps)
+        else:
+            self.decisions.fps = min(self.decisions.fps, self.targets.max_fps)
+        logger.info(f'Updated stream targets to {self.targets}')
+
+    def apply(self, tier: QualityTier) -> Tuple[float, int]:
+        """
+        :return: The scale and JPEG quality to encode frames of the given tier with.
+        """
+        return (tier.scale * self.decisions.scale_factor,
+                max(MIN_JPEG_QUALITY, tier.jpeg_quality - self.decisions.quality_reduction))
+
+    def record_encode(self, duration: float) -> None:
+        self._window_encode_times.append(duration)
+
+    def record_sent(self, byte_count: int) -> None:
+        self._window_bytes += byte_count
+
+    def record_backlog(self, queued_packets: int) -> None:
+        self._window_max_backlog = max(self._window_max_backlog, queued_packets)
+
+    def update(self) -> None:
+        """
+        Adjusts the decisions if the current interval is over. Cheap enough to be called for every frame.
+        """
+        now = monotonic()
+        elapsed = now - self._window_start
+        if elapsed < self.interval:
+            return
+
+        encode_time = max(self._window_encode_times, default=0.0)
+        bandwidth_kbps = self._window_bytes / elapsed / 1000.0
+        # Every queued packet has to be sent before a new frame arrives at the client.
+        latency_ms = (encode_time + self._window_max_backlog / max(self.decisions.fps, MIN_FPS)) * 1000.0
+        self.metrics = {
+            'latency_ms': latency_ms,
+            'bandwidth_kbps': bandwidth_kbps,
+            'encode_time_ms': encode_time * 1000.0,
+            'send_backlog': self._window_max_backlog,
+            'fps': self.decisions.fps,
+            'scale_factor': self.decisions.scale_factor,
+            'quality_reduction': self.decisions.quality_reduction,
+        }
+
+        self._window_start = now
+        self._window_bytes = 0
+        self._window_encode_times.clear()
+        self._window_max_backlog = 0
+
+        if not self.targets.adaptive:
+            return
+
+        latency_usage = latency_ms / self.targets.max_latency_ms
+        bandwidth_usage = bandwidth_kbps / self.targets.max_bandwidth_kbps
+        if latency_usage > 1.0 or bandwidth_usage > 1.0:
+            self._degrade()
+        elif latency_usage < HEADROOM and bandwidth_usage < HEADROOM:
+            self._improve()
+
+    def _degrade(self) -> None:
+        decisions = self.decisions
+        if decisions.quality_reduction < 40:
+            decisions.quality_reduction += 10
+        elif decisions.fps > MIN_FPS:
+            decisions.fps = max(MIN_FPS, decisions.fps * 0.75)
+        elif decisions.scale_factor > MIN_SCALE_FACTOR:
+            decisions.scale_factor = max(MIN_SCALE_FACTOR, decisions.scale_factor * 0.75)
+        else:
+            return
+        logger.debug(f'Lowered stream quality to {decisions}')
+
+    def _improve(self) -> None:
+        decisions = self.decisions
+        if decisions.scale_factor < 1.0:
+            decisions.scale_factor = min(1.0, decisions.scale_factor / 0.75)
+        elif decisions.fps < self.targets.max_fps:
+            decisions.fps = min(self.targets.max_fps, decisions.fps / 0.75)
+        elif decisions.quality_reduction > 0:
+            decisions.quality_reduction = max(0, decisions.quality_reduction - 5)
+        else:
+            return
+        logger.debug(f'Raised stream quality to {decisions}')
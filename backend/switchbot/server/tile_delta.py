@@ -0,0 +1,131 @@
+import math
+from time import monotonic
+from typing import Optional
+
+import cv2
+import numpy as np
+
+from .messages.binary_video_frame_message import CODEC_JPEG
+from .messages.tile_delta_message import TileDeltaMessage, Tile
+from ..bot.frame_grabber import Frame
+
+
+class TileDeltaEncoder:
+    """
+    Encodes frames into TileDeltaMessages that only contain the tiles which changed since the previous message.
+
+    The encoder keeps a copy of what the clients currently display, built from the decoded JPEG images it sent, and
+    compares each new frame against it, so changes that are too small to be sent on their own still add up until
+    they are sent. Pixels may differ by as much as the compression artifacts they were sent with before counting as
+    changed, otherwise tiles with sharp edges would be sent again for every frame.
+    Only a single frame may be encoded at a time, but force_keyframe may be called from any thread meanwhile.
+    """
+
+    def __init__(self,
+                 tile_size: int = 64,
+                 pixel_threshold: int = 12,
+                 keyframe_interval: float = 10.0,
+                 max_changed_ratio: float = 0.5):
+        self.tile_size: int = tile_size
+        self.pixel_threshold: int = pixel_threshold
+        self.keyframe_interval: float = keyframe_interval
+        # If more tiles than this changed, a keyframe is smaller and cheaper than sending all the tiles.
+        self.max_changed_ratio: float = max_changed_ratio
+        self._reference: Optional[np.ndarray] = None
+        # How much each pixel of the reference differs from the frame it was encoded from.
+        self._artifacts: Optional[np.ndarray] = None
+        self._last_keyframe_time: float = 0.0
+        self._force_keyframe: bool = True
+
+    def force_keyframe(self) -> None:
+        """
+        Makes the next encoded frame a keyframe. If a frame is being encoded right now, the one after it is.
+        """
+        self._force_keyframe = True
+
+    def encode(self, frame: Frame, scale: float, jpeg_quality: int) -> Optional[TileDeltaMessage]:
+        """
+        Scales the given frame and encodes the tiles that changed.
+
+        :return: The message to send or None if nothing changed or encoding failed.
+        """
+        image = frame.image
+        if scale != 1.0:
+            image = cv2.resize(src=image, dsize=(0, 0), fx=scale, fy=scale)
+        height, width = image.shape[:2]
+        now = monotonic()
+
+        force_keyframe = self._force_keyframe
+        # Cleared before encoding, so a keyframe requested while this frame is encoded is not lost.
+        self._force_keyframe = False
+        is_keyframe = force_keyframe \
+            or self._reference is None \
+            or self._reference.shape != image.shape \
+            or now - self._last_keyframe_time >= self.keyframe_interval
+
+        changed_tiles = None
+        if not is_keyframe:
+            changed_tiles = self._find_changed_tiles(image)
+            changed_count = np.count_nonzero(changed_tiles)
+            if changed_count == 0:
+                return None
+            is_keyframe = changed_count > self.max_changed_ratio * changed_tiles.size
+
+        message = TileDeltaMessage(
+            sequence=frame.sequence,
+            timestamp=frame.timestamp,
+            width=width,
+            height=height,
+            codec=CODEC_JPEG,
+            is_keyframe=is_keyframe,
+        )
+        encode_parameters = [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality]
+        if is_keyframe:
+            success, jpg = cv2.imencode('.jpg', image, encode_parameters)
+            if not success:
+                self._force_keyframe = True
+                return None
+            message.tiles.append(Tile(x=0, y=0, image=jpg.tobytes()))
+            self._reference = cv2.imdecode(jpg, cv2.IMREAD_UNCHANGED)
+            self._artifacts = _difference(image, self._reference)
+            self._last_keyframe_time = now
+            return message
+
+        for tile_row, tile_column in zip(*np.nonzero(changed_tiles)):
+            x = int(tile_column) * self.tile_size
+            y = int(tile_row) * self.tile_size
+            tile_image = image[y:y + self.tile_size, x:x + self.tile_size]
+            success, jpg = cv2.imencode('.jpg', tile_image, encode_parameters)
+            if not success:
+                # Some tiles of the reference might already be updated, so start over with a keyframe.
+                self._force_keyframe = True
+                return None
+            message.tiles.append(Tile(x=x, y=y, image=jpg.tobytes()))
+            decoded_tile = cv2.imdecode(jpg, cv2.IMREAD_UNCHANGED)
+            self._reference[y:y + self.tile_size, x:x + self.tile_size] = decoded_tile
+            self._artifacts[y:y + self.tile_size, x:x + self.tile_size] = _difference(tile_image, decoded_tile)
+        return message
+
+    def _find_changed_tiles(self, image: np.ndarray) -> np.ndarray:
+        """
+        :return: A boolean array with one entry per tile that is True if the tile changed.
+        """
+        # Saturates at zero where the frame is closer to the reference than the artifacts were.
+        difference = cv2.subtract(_difference(image, self._reference), self._artifacts)
+        changed_pixels = difference > self.pixel_threshold
+
+        height, width = changed_pixels.shape
+        rows = math.ceil(height / self.tile_size)
+        columns = math.ceil(width / self.tile_size)
+        # Pad to a multiple of the tile size so the mask can be reshaped into tiles.
+        padded = np.zeros((rows * self.tile_size, columns * self.tile_size), dtype=bool)
+        padded[:height, :width] = changed_pixels
+        return padded.reshape(rows, self.tile_size, columns, self.tile_size).any(axis=(1, 3))
+
+
+def _difference(image: np.ndarray, other: np.ndarray) -> np.ndarray:
+    """
+    :return: The largest difference of any channel for each pixel.
+    """
+    difference = cv2.absdiff(image, other)
+    return difference.max(axis=2) if difference.ndim == 3 else difference
@@ -0,0 +1,23 @@
+from dataclasses import dataclass
+from typing import Dict
+
+
+@dataclass(frozen=True)
+class QualityTier:
+    """
+    Describes how frames are scaled and compressed before they are sent to a client.
+    """
+    name: str
+    # Factor both dimensions of the frame are scaled by.
+    scale: float
+    # JPEG quality between 0 and 100.
+    jpeg_quality: int
+
+
+QUALITY_TIERS: Dict[str, QualityTier] = {tier.name: tier for tier in [
+    QualityTier(name='low', scale=0.25, jpeg_quality=75),
+    QualityTier(name='medium', scale=0.5, jpeg_quality=85),
+    QualityTier(name='high', scale=1.0, jpeg_quality=90),
+]}
+# Matches the quality frames were always sent with, so clients that never choose a tier see no difference.
+DEFAULT_QUALITY_TIER: QualityTier = QUALITY_TIERS['low']
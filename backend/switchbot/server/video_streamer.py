@@ -0,0 +1,280 @@
+import asyncio
+import base64
+import logging
+from asyncio import sleep
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from time import monotonic
+from typing import Dict, Optional, Set
+
+import cv2
+import numpy as np
+import socketio
+
+from .change_detector import FrameChangeDetector
+from . import message_codec
+from .message_identifiers import MessageIdentifiers
+from .messages.binary_video_frame_message import BinaryVideoFrameMessage, CODEC_JPEG
+from .messages.video_frame_message import VideoFrameMessage
+from .stream_controller import AdaptiveStreamController
+from .tile_delta import TileDeltaEncoder
+from .video_quality import QualityTier, DEFAULT_QUALITY_TIER
+from .video_transport import VideoTransport
+from ..bot.frame_bus import FramePolicy
+from ..bot.frame_grabber import Frame
+from ..bot.switch_bot import SwitchBot
+
+logger = logging.getLogger('VideoStreamer')
+
+# The least time in seconds between two probes sent to the same client.
+PROBE_INTERVAL = 0.5
+
+
+@dataclass
+class ClientVideoSettings:
+    transport: VideoTransport = VideoTransport.BASE64
+    tier: QualityTier = DEFAULT_QUALITY_TIER
+
+    @property
+    def room(self) -> str:
+        return room_name(self.tier, self.transport)
+
+
+@dataclass
+class ClientBacklog:
+    """
+    Measures how many frames sent to a client have not arrived yet.
+
+    Probes are sent in between the frames and acknowledged by the client once received, so all frames sent before
+    an acknowledged probe have arrived. Clients that never acknowledged a probe are not measured, since older clients
+    don't answer them.
+    """
+    sent_frames: int = 0
+    # The number of frames sent before the probe that was not acknowledged yet, or None if no probe is pending.
+    pending_probe: Optional[int] = None
+    probe_sent_at: float = 0.0
+    acknowledged_probes: int = 0
+
+    @property
+    def backlog(self) -> int:
+        if self.pending_probe is None or self.acknowledged_probes == 0:
+            return 0
+        return self.sent_frames - self.pending_probe
+
+
+def room_name(tier: QualityTier, transport: VideoTransport) -> str:
+    return f'video/{tier.name}/{transport.value}'
+
+
+@dataclass(frozen=True)
+class EncodedFrame:
+    jpg: np.ndarray
+    width: int
+    height: int
+    # The time in seconds it took to scale and encode the frame.
+    encode_time: float
+
+
+def encode_frame(image: np.ndarray, scale: float, jpeg_quality: int) -> Optional[EncodedFrame]:
+    """
+    Scales and compresses the given image.
+
+    :return: The encoded image or None if encoding failed.
+    """
+    start_time = monotonic()
+    if scale != 1.0:
+        image = cv2.resize(src=image, dsize=(0, 0), fx=scale, fy=scale)
+    success, jpg = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality])
+    if not success:
+        return None
+    return EncodedFrame(jpg=jpg, width=image.shape[1], height=image.shape[0], encode_time=monotonic() - start_time)
+
+
+class VideoStreamer:
+    """
+    Sends the frames grabbed from the camera to all connected clients.
+
+    Every frame is encoded at most once per quality tier, and only for the tiers at least one client has chosen.
+    Clients receive the frames in their chosen tier using their chosen transport.
+
+    Scaling and encoding runs on a thread pool so that it does not block the event loop. Each tier only has a single
+    frame being encoded at a time: frames arriving while the previous one is still encoded are dropped for that tier
+    instead of queueing up and adding latency.
+
+    The frame rate, scale and quality are adjusted to the configured targets by an AdaptiveStreamController if
+    adaptive streaming was turned on. The clients' backlog is then measured with probes, see ClientBacklog.
+    Frames that look the same as the last sent frame are not encoded at all, see FrameChangeDetector.
+    """
+
+    def __init__(self, sio: socketio.Server, bot: SwitchBot, encoder_threads: int = 2):
+        self.sio: socketio.Server = sio
+        self.bot: SwitchBot = bot
+        self.clients: Dict[str, ClientVideoSettings] = {}
+        # OpenCV releases the GIL while resizing and encoding, so these threads really run in parallel.
+        self._encoder_pool: ThreadPoolExecutor = ThreadPoolExecutor(max_workers=encoder_threads,
+                                                                    thread_name_prefix='VideoEncoder')
+        self._encoding_tasks: Dict[QualityTier, asyncio.Task] = {}
+        # Number of frames per tier that were skipped because the previous frame was still being encoded.
+        self.dropped_frames: Dict[str, int] = {}
+        self.controller: AdaptiveStreamController = AdaptiveStreamController()
+        self.change_detector: FrameChangeDetector = FrameChangeDetector()
+        self._delta_encoders: Dict[QualityTier, TileDeltaEncoder] = {}
+        self.skipped_unchanged_frames: int = 0
+        self._backlogs: Dict[str, ClientBacklog] = {}
+
+    def add_client(self, sid) -> None:
+        self._update_client(sid, ClientVideoSettings())
+
+    def remove_client(self, sid) -> None:
+        self._leave_room(sid)
+        self._backlogs.pop(sid, None)
+
+    def _leave_room(self, sid) -> None:
+        settings: Optional[ClientVideoSettings] = self.clients.pop(sid, None)
+        if settings is not None:
+            self.sio.leave_room(sid, settings.room)
+
+    def set_transport(self, sid, transport: VideoTransport) -> None:
+        settings = self.clients.get(sid, ClientVideoSettings())
+        self._update_client(sid, ClientVideoSettings(transport=transport, tier=settings.tier))
+
+    def set_quality_tier(self, sid, tier: QualityTier) -> None:
+        settings = self.clients.get(sid, ClientVideoSettings())
+        self._update_client(sid, ClientVideoSettings(transport=settings.transport, tier=tier))
+
+    def _update_client(self, sid, settings: ClientVideoSettings) -> None:
+        self._leave_room(sid)
+        self.sio.enter_room(sid, settings.room)
+        self.clients[sid] = settings
+        self._backlogs.setdefault(sid, ClientBacklog())
+        # The client might not have any image for its room yet.
+        self.change_detector.force_keyframe()
+        if settings.transport == VideoTransport.DELTA and settings.tier in self._delta_encoders:
+            self._delta_encoders[settings.tier].force_keyframe()
+
+    def _used_rooms(self) -> Dict[QualityTier, Set[VideoTransport]]:
+        used: Dict[QualityTier, Set[VideoTransport]] = {}
+        for settings in self.clients.values():
+            used.setdefault(settings.tier, set()).add(settings.transport)
+        return used
+
+    async def run(self) -> None:
+        logger.debug('Starting to emit frames...')
+
+        async with self.bot.frames.subscribe('stream', FramePolicy.LATEST) as subscription:
+            # The subscription is closed when the camera is disconnected or replaced by another one.
+            while self.bot.video.is_capturing() and not subscription.closed:
+                # Use a timeout so that the loop notices when the capture is closed.
+                frame = await subscription.next(timeout=1.0)
+                if frame is None:
+                    continue
+                dispatch_time = monotonic()
+                if self.controller.targets.adaptive:
+                    await self._probe_clients()
+                    self.controller.record_backlog(self._send_backlog())
+                self.controller.update()
+                await self._dispatch_frame(frame)
+                # Wait until the next frame is due according to the frame rate chosen by the controller.
+                await sleep(max(0.0, dispatch_time + 1.0 / self.controller.decisions.fps - monotonic()))
+
+        for task in list(self._encoding_tasks.values()):
+            task.cancel()
+        logger.debug('Stopped emitting frame because capture was closed.')
+
+    async def _dispatch_frame(self, frame: Frame) -> None:
+        used_rooms = self._used_rooms()
+        # Tiers that no client has chosen are never encoded.
+        if not used_rooms:
+            return
+
+        loop = asyncio.get_running_loop()
+        has_changed = await loop.run_in_executor(self._encoder_pool, self.change_detector.has_changed, frame.image)
+        if not has_changed:
+            self.skipped_unchanged_frames += 1
+            return
+
+        for tier, transports in used_rooms.items():
+            if tier in self._encoding_tasks:
+                self.dropped_frames[tier.name] = self.dropped_frames.get(tier.name, 0) + 1
+                # This tier misses the change, so make sure the next frame is sent even if nothing changes anymore.
+                self.change_detector.force_keyframe()
+                continue
+            task = asyncio.create_task(self._encode_and_emit(frame, tier, transports))
+            self._encoding_tasks[tier] = task
+            task.add_done_callback(lambda _, finished_tier=tier: self._encoding_tasks.pop(finished_tier, None))
+
+    async def _encode_and_emit(self, frame: Frame, tier: QualityTier, transports: Set[VideoTransport]) -> None:
+        loop = asyncio.get_running_loop()
+        scale, jpeg_quality = self.controller.apply(tier)
+
+        # Full frames are only encoded if any client of this tier actually receives them.
+        full_frame_transports = transports - {VideoTransport.DELTA}
+        if full_frame_transports:
+            encoded = await loop.run_in_executor(self._encoder_pool, encode_frame, frame.image, scale, jpeg_quality)
+            if encoded is not None:
+                self.controller.record_encode(encoded.encode_time)
+                await self._emit_encoded_frame(frame, tier, full_frame_transports, encoded)
+
+        if VideoTransport.DELTA in transports:
+            delta_encoder = self._delta_encoders.setdefault(tier, TileDeltaEncoder())
+            delta_message = await loop.run_in_executor(self._encoder_pool, delta_encoder.encode, frame, scale,
+                                                       jpeg_quality)
+            if delta_message is None:
+                return
+            payload = delta_message.to_bytes()
+            self._record_frame_sent(tier, VideoTransport.DELTA, len(payload))
+            await self.sio.emit(MessageIdentifiers.TILE_DELTA_FRAME_GRABBED, payload,
+                                to=room_name(tier, VideoTransport.DELTA))
+
+    def _send_backlog(self) -> int:
+        """
+        :return: The largest number of frames sent to any single client that did not arrive yet.
+        """
+        return max((backlog.backlog for backlog in self._backlogs.values()), default=0)
+
+    async def _probe_clients(self) -> None:
+        now = monotonic()
+        for sid, backlog in list(self._backlogs.items()):
+            if backlog.pending_probe is not None or now - backlog.probe_sent_at < PROBE_INTERVAL:
+                continue
+            backlog.pending_probe = backlog.sent_frames
+            backlog.probe_sent_at = now
+            await self.sio.emit(MessageIdentifiers.STREAM_PROBE, to=sid,
+                                callback=lambda *_, acknowledged=backlog: self._on_probe_acknowledged(acknowledged))
+
+    @staticmethod
+    def _on_probe_acknowledged(backlog: ClientBacklog) -> None:
+        backlog.pending_probe = None
+        backlog.acknowledged_probes += 1
+
+    def _record_frame_sent(self, tier: QualityTier, transport: VideoTransport, byte_count: int) -> None:
+        receivers = [sid for sid, settings in self.clients.items()
+                     if settings.tier == tier and settings.transport == transport]
+        for sid in receivers:
+            self._backlogs.setdefault(sid, ClientBacklog()).sent_frames += 1
+        self.controller.record_sent(byte_count * len(receivers))
+
+    async def _emit_encoded_frame(self,
+                                  frame: Frame,
+                                  tier: QualityTier,
+                                  transports: Set[VideoTransport],
+                                  encoded: EncodedFrame) -> None:
+        if VideoTransport.BINARY in transports:
+            binary_message = BinaryVideoFrameMessage(
+                sequence=frame.sequence,
+                timestamp=frame.timestamp,
+                width=encoded.width,
+                height=encoded.height,
+                codec=CODEC_JPEG,
+                image=encoded.jpg.tobytes(),
+            )
+            payload = binary_message.to_bytes()
+            self._record_frame_sent(tier, VideoTransport.BINARY, len(payload))
+            await self.sio.emit(MessageIdentifiers.BINARY_VIDEO_FRAME_GRABBED, payload,
+                                to=room_name(tier, VideoTransport.BINARY))
+        if VideoTransport.BASE64 in transports:
+            b64_image: str = base64.b64encode(encoded.jpg).decode()
+            message: VideoFrameMessage = VideoFrameMessage(image=b64_image)
+            self._record_frame_sent(tier, VideoTransport.BASE64, len(b64_image))
+            await self.sio.emit(MessageIdentifiers.VIDEO_FRAME_GRABBED, message_codec.encode(message),
+                                to=room_name(tier, VideoTransport.BASE64))
@@ -0,0 +1,13 @@
+from enum import Enum
+
+
+class VideoTransport(Enum):
+    """
+    The ways video frames can be sent to a client.
+    """
+    # JPEG images encoded as base64 inside a JSON message, supported by all clients.
+    BASE64 = 'base64'
+    # Raw JPEG images with a small binary header, sent as a binary attachment.
+    BINARY = 'binary'
+    # Only the tiles that changed since the previous frame, see TileDeltaMessage.
+    DELTA = 'delta'
@@ -0,0 +1,82 @@
+from typing import Dict, List, Optional
+
+from . import message_codec
+from .messages.welcome_message import WelcomeMessage
+from .state_document import StateDocument
+from ..bot.video_connector import CameraDescriptor
+from ..program.dialog import Dialog
+from ..program.program import Program
+from ..util.cyclic_buffer_handler import CyclicBufferHandler
+
+
+class WelcomeSnapshot:
+    """
+    The state sent to clients when they connect, kept up to date by the server whenever a part of it changes.
+
+    Every part is stored already serialized in a StateDocument and the welcome message is only built again after
+    a change, so a connecting client only costs copying the recent log lines. Clients that were connected before
+    can catch up using the document's patches instead, see StateDocument.patches_since.
+    """
+
+    def __init__(self, log_buffer_handler: CyclicBufferHandler):
+        self._log_buffer_handler: CyclicBufferHandler = log_buffer_handler
+        self.document: StateDocument = StateDocument({
+            'available_programs': [],
+            'current_program_name': None,
+            'current_program_options': None,
+            'current_video': None,
+            'available_video': [],
+            'current_serial': None,
+            'serial_connection_state': 'disconnected',
+            'available_serial': [],
+            'current_dialog': None,
+        })
+        self._payload: Optional[Dict[str, object]] = None
+        self.document.add_listener(lambda _patch: self._invalidate())
+
+    def set_programs(self, programs: List[Program]) -> None:
+        self.document.update({
+            'available_programs': [message_codec.encode(program.metadata) for program in programs],
+        })
+
+    def set_current_program(self, program: Optional[Program]) -> None:
+        self.document.update({
+            'current_program_name': program.metadata.name if program is not None else None,
+            'current_program_options': program.option_values if program is not None else None,
+            # A new program starts without a dialog, and one shown by a stopped program is gone.
+            'current_dialog': None,
+        })
+
+    def set_current_dialog(self, dialog: Optional[Dialog]) -> None:
+        self.document.update({'current_dialog': message_codec.encode(dialog) if dialog is not None else None})
+
+    def set_current_video(self, descriptor: Optional[CameraDescriptor]) -> None:
+        self.document.update({
+            'current_video': message_codec.encode(descriptor) if descriptor is not None else None,
+        })
+
+    def set_available_devices(self, cameras: List[CameraDescriptor], serial_ports: List[str]) -> None:
+        self.document.update({
+            'available_video': [message_codec.encode(descriptor) for descriptor in cameras],
+            'available_serial': list(serial_ports),
+        })
+
+    def set_serial(self, port_identifier: Optional[str], connection_state: str) -> None:
+        self.document.update({'current_serial': port_identifier, 'serial_connection_state': connection_state})
+
+    def to_dict(self) -> Dict[str, object]:
+        """
+        :return: The serialized welcome message, sharing everything but the log lines with earlier calls.
+        """
+        if self._payload is None:
+            self._payload = message_codec.encode(WelcomeMessage(
+                recent_program_logs=[],
+                state_epoch=self.document.epoch,
+                state_revision=self.document.revision,
+                **self.document.to_dict()))
+        payload = dict(self._payload)
+        payload['recent_program_logs'] = list(self._log_buffer_handler.get_buffered_records())
+        return payload
+
+    def _invalidate(self) -> None:
+        self._payload = None
@@ -1,21 +1,133 @@
 import asyncio
+import collections
 import logging
+from dataclasses import dataclass
 from logging import LogRecord
-from typing import Union
+from typing import Union, Deque, Dict, Optional, Tuple, List
 
 import socketio
 
+from ..server import message_codec
 from ..server.message_identifiers import MessageIdentifiers
+from ..server.messages.log_lines_message import LogLinesMessage
+
+
+@dataclass(frozen=True)
+class ClientLogSettings:
+    # Only lines of this level or above are sent to the client.
+    level: int = logging.DEBUG
+    # Whether the client receives log_lines batches instead of a log_line message per line.
+    batched: bool = False
+
+    @property
+    def room(self) -> str:
+        return f'logs/{logging.getLevelName(self.level)}/{"batched" if self.batched else "lines"}'
 
 
 class EmittingSocketHandler(logging.Handler):
-    def __init__(self, socket: socketio.Server, level: Union[int, str], event_name: str = MessageIdentifiers.LOG_LINE_EMITTED):
+    """
+    Sends log lines to the connected clients.
+
+    Records are collected in a buffer and sent every flush_interval seconds, or as soon as batch_size lines are
+    waiting, with a single message per client. Only one batch is sent at a time, so if clients can't keep up, the
+    buffer fills up and the oldest lines are dropped once max_buffered_lines are waiting. The number of dropped lines
+    is sent along with the next batch.
+
+    Each client chooses the lowest level it receives. Older clients that don't ask for batches still receive a
+    log_line message per line, but only when a batch is sent.
+    """
+
+    def __init__(self,
+                 socket: socketio.Server,
+                 level: Union[int, str],
+                 flush_interval: float = 0.1,
+                 batch_size: int = 100,
+                 max_buffered_lines: int = 1000):
         super(EmittingSocketHandler, self).__init__(level)
         self.socket = socket
-        self.event_name = event_name
+        self.flush_interval: float = flush_interval
+        self.batch_size: int = batch_size
+        self.max_buffered_lines: int = max_buffered_lines
+        self.clients: Dict[str, ClientLogSettings] = {}
+        # Level and formatted line of each record that was not sent yet, oldest first.
+        self._records: Deque[Tuple[int, str]] = collections.deque()
+        self.dropped: int = 0
+        self._dropped_since_flush: int = 0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._flush_timer: Optional[asyncio.TimerHandle] = None
+        self._flush_task: Optional[asyncio.Task] = None
+
+    def add_client(self, sid, settings: ClientLogSettings = ClientLogSettings()) -> None:
+        self.remove_client(sid)
+        self.socket.enter_room(sid, settings.room)
+        self.clients[sid] = settings
+
+    def remove_client(self, sid) -> None:
+        settings: Optional[ClientLogSettings] = self.clients.pop(sid, None)
+        if settings is not None:
+            self.socket.leave_room(sid, settings.room)
 
     def emit(self, record: LogRecord) -> None:
-        loop = asyncio.get_event_loop()
-        emitter_coroutine = self.socket.emit(self.event_name, self.format(record))
-        # This should run the coroutine later on the existing loop.
-        asyncio.ensure_future(emitter_coroutine, loop=loop)
+        # Called with the handler's lock held, possibly from other threads than the event loop's.
+        line = self.format(record)
+        if len(self._records) >= self.max_buffered_lines:
+            self._records.popleft()
+            self.dropped += 1
+            self._dropped_since_flush += 1
+        self._records.append((record.levelno, line))
+        self._request_flush(len(self._records) >= self.batch_size)
+
+    def _request_flush(self, immediately: bool) -> None:
+        try:
+            self._loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Logged from another thread, or before the server runs in which case nobody is listening yet.
+            if self._loop is not None and not self._loop.is_closed():
+                self._loop.call_soon_threadsafe(self._schedule_flush, immediately)
+            return
+        self._schedule_flush(immediately)
+
+    def _schedule_flush(self, immediately: bool) -> None:
+        if self._flush_task is not None:
+            # The running flush checks for new records once it's done.
+            return
+        if immediately:
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+            self._start_flush()
+        elif self._flush_timer is None:
+            self._flush_timer = self._loop.call_later(self.flush_interval, self._start_flush)
+
+    def _start_flush(self) -> None:
+        self._flush_timer = None
+        self._flush_task = asyncio.ensure_future(self._flush())
+
+    async def _flush(self) -> None:
+        try:
+            self.acquire()
+            try:
+                records = list(self._records)
+                self._records.clear()
+                dropped = self._dropped_since_flush
+                self._dropped_since_flush = 0
+            finally:
+                self.release()
+            for settings in set(self.clients.values()):
+                await self._send(settings, [line for level, line in records if level >= settings.level], dropped)
+        finally:
+            self._flush_task = None
+            if self._records:
+                self._schedule_flush(len(self._records) >= self.batch_size)
+
+    async def _send(self, settings: ClientLogSettings, lines: List[str], dropped: int) -> None:
+        if settings.batched:
+            if lines or dropped:
+                message = LogLinesMessage(lines=lines, dropped=dropped)
+                await self.socket.emit(MessageIdentifiers.LOG_LINES_EMITTED, message_codec.encode(message),
+                                       room=settings.room)
+            return
+
+        if dropped:
+            lines = [f'{dropped} log lines were dropped.'] + lines
+        for line in lines:
+            await self.socket.emit(MessageIdentifiers.LOG_LINE_EMITTED, line, room=settings.room)
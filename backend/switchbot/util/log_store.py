@@ -0,0 +1,264 @@
+import asyncio
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional, List, Tuple
+
+from dataclasses_json import dataclass_json
+
+logger = logging.getLogger('LogStore')
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS log_records (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    timestamp REAL NOT NULL,
+    program TEXT NOT NULL,
+    level INTEGER NOT NULL,
+    encounter INTEGER,
+    message TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS log_records_timestamp ON log_records (timestamp);
+DROP INDEX IF EXISTS log_records_program;
+CREATE INDEX IF NOT EXISTS log_records_program_id ON log_records (program, id);
+'''
+_INSERT = 'INSERT INTO log_records (timestamp, program, level, encounter, message) VALUES (?, ?, ?, ?, ?)'
+_COLUMNS = 'id, timestamp, program, level, encounter, message'
+# The value PRAGMA auto_vacuum returns for INCREMENTAL.
+_AUTO_VACUUM_INCREMENTAL = 2
+# Put in the queue to stop the writer thread once everything before it is written.
+_STOP = object()
+
+
+@dataclass_json
+@dataclass(kw_only=True)
+class StoredLogRecord:
+    # Increases with every record, also used as the cursor to page through older records.
+    id: Optional[int] = None
+    # Seconds since the epoch.
+    timestamp: float
+    program: str
+    level: int
+    # The encounter the program was at when logging, for programs counting them.
+    encounter: Optional[int] = None
+    message: str
+
+
+@dataclass
+class LogPage:
+    # Newest first.
+    records: List[StoredLogRecord]
+    # Pass as before_id to get the next, older page, None if there are no older records matching the query.
+    next_before_id: Optional[int]
+
+
+class LogStore:
+    """
+    Keeps the log records of programs in an SQLite database, so clients can page through the history of runs that
+    lasted for hours instead of only seeing the last few lines.
+
+    Records are appended to a queue and written in batches on a thread of their own, so logging never waits for
+    the disk. Queries run on another thread with a separate connection. They page through the records by ID, which
+    increases in the order records were logged, so time ranges are looked up as ID ranges first and each page is
+    read from the rowid or the (program, id) index without sorting.
+    Records older than retention_days or beyond the newest max_records are deleted every compact_interval seconds,
+    after which the freed pages are returned to the file system.
+    """
+
+    def __init__(self,
+                 path: Path,
+                 retention_days: Optional[float] = 30.0,
+                 max_records: Optional[int] = 1_000_000,
+                 compact_interval: float = 3600.0,
+                 batch_size: int = 500):
+        self.path: Path = path
+        self.retention_days: Optional[float] = retention_days
+        self.max_records: Optional[int] = max_records
+        self.compact_interval: float = compact_interval
+        self.batch_size: int = batch_size
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._writer: Optional[threading.Thread] = None
+        # A single thread so the connection used for queries is never shared between threads.
+        self._executor: ThreadPoolExecutor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='LogStore')
+        self._query_connection: Optional[sqlite3.Connection] = None
+
+    def start(self) -> None:
+        """
+        Creates the database if needed and starts writing records. Does nothing if already started.
+        """
+        if self._writer is not None:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # Compacting frees pages without rewriting the whole file only with incremental auto vacuum. It must be set
+        # before the database switches to WAL and before any table exists, otherwise only VACUUM can change it.
+        connection = sqlite3.connect(self.path)
+        connection.execute('PRAGMA journal_mode = DELETE')
+        connection.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        if connection.execute('PRAGMA auto_vacuum').fetchone()[0] != _AUTO_VACUUM_INCREMENTAL:
+            connection.execute('VACUUM')
+        connection.executescript(_SCHEMA)
+        connection.close()
+        self._writer = threading.Thread(target=self._write_records, name='LogStoreWriter', daemon=True)
+        self._writer.start()
+
+    def stop(self) -> None:
+        """
+        Writes the remaining records and waits for the writer thread to finish.
+        """
+        if self._writer is None:
+            return
+        self._queue.put(_STOP)
+        self._writer.join()
+        self._writer = None
+        # The connection for queries can only be used by the thread that opened it.
+        self._executor.submit(self._close_query_connection).result()
+
+    def _close_query_connection(self) -> None:
+        if self._query_connection is not None:
+            self._query_connection.close()
+            self._query_connection = None
+
+    def append(self, record: StoredLogRecord) -> None:
+        """
+        Queues the record to be written, can be called from any thread.
+        """
+        self._queue.put(record)
+
+    async def query_async(self, **kwargs) -> LogPage:
+        """
+        Runs query without blocking the event loop.
+        """
+        return await asyncio.get_running_loop().run_in_executor(self._executor, lambda: self.query(**kwargs))
+
+    def query(self,
+              program: Optional[str] = None,
+              min_level: int = logging.NOTSET,
+              since: Optional[float] = None,
+              until: Optional[float] = None,
+              encounter: Optional[int] = None,
+              before_id: Optional[int] = None,
+              limit: int = 100) -> LogPage:
+        """
+        Blocks until the page was read, so call it from a worker thread or use query_async.
+
+        :param since: Only records logged at this time or later, in seconds since the epoch.
+        :param until: Only records logged before this time, in seconds since the epoch.
+        :param before_id: Only records older than the one with this ID, to get the page after an earlier one.
+        :param limit: The maximum number of records returned.
+        """
+        if self._query_connection is None:
+            self._query_connection = self._connect()
+        connection = self._query_connection
+
+        conditions: List[str] = []
+        parameters: List[object] = []
+        # Look up the time range as a range of IDs, so the page can be read in ID order without sorting.
+        if since is not None:
+            first_id = self._first_id_at(connection, since)
+            if first_id is None:
+                return LogPage(records=[], next_before_id=None)
+            conditions.append('id >= ?')
+            parameters.append(first_id)
+        if until is not None:
+            end_id = self._first_id_at(connection, until)
+            if end_id is not None:
+                conditions.append('id < ?')
+                parameters.append(end_id)
+        if program is not None:
+            conditions.append('program = ?')
+            parameters.append(program)
+        if min_level > logging.NOTSET:
+            conditions.append('level >= ?')
+            parameters.append(min_level)
+        if encounter is not None:
+            conditions.append('encounter = ?')
+            parameters.append(encounter)
+        if before_id is not None:
+            conditions.append('id < ?')
+            parameters.append(before_id)
+        where = f'WHERE {" AND ".join(conditions)}' if conditions else ''
+        # Read one more record than requested to know whether there is another page.
+        parameters.append(limit + 1)
+
+        rows: List[Tuple] = connection.execute(
+            f'SELECT {_COLUMNS} FROM log_records {where} ORDER BY id DESC LIMIT ?', parameters).fetchall()
+        records = [StoredLogRecord(id=row[0], timestamp=row[1], program=row[2], level=row[3], encounter=row[4],
+                                   message=row[5]) for row in rows[:limit]]
+        next_before_id = records[-1].id if len(rows) > limit else None
+        return LogPage(records=records, next_before_id=next_before_id)
+
+    @staticmethod
+    def _first_id_at(connection: sqlite3.Connection, timestamp: float) -> Optional[int]:
+        """
+        :return: The ID of the first record logged at the given time or later, None if there is none.
+        """
+        row = connection.execute('SELECT id FROM log_records WHERE timestamp >= ? ORDER BY timestamp LIMIT 1',
+                                 (timestamp,)).fetchone()
+        return row[0] if row is not None else None
+
+    def compact(self, connection: sqlite3.Connection) -> int:
+        """
+        Deletes the records that are not retained anymore.
+
+        :return: The number of deleted records.
+        """
+        deleted = 0
+        if self.retention_days is not None:
+            cutoff = time.time() - self.retention_days * 24 * 60 * 60
+            deleted += connection.execute('DELETE FROM log_records WHERE timestamp < ?', (cutoff,)).rowcount
+        if self.max_records is not None:
+            deleted += connection.execute(
+                'DELETE FROM log_records WHERE id <= (SELECT id FROM log_records ORDER BY id DESC LIMIT 1 OFFSET ?)',
+                (self.max_records,)).rowcount
+        connection.commit()
+        if deleted:
+            # The pragma frees one page per step and execute only runs the first one, unlike executescript. The file
+            # only shrinks once the freed pages were moved out of the write-ahead log.
+            connection.executescript('PRAGMA incremental_vacuum;')
+            connection.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        return deleted
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path)
+        # Lets queries read while records are written.
+        connection.execute('PRAGMA journal_mode = WAL')
+        connection.execute('PRAGMA synchronous = NORMAL')
+        return connection
+
+    def _write_records(self) -> None:
+        connection = self._connect()
+        next_compaction = time.monotonic()
+        stopping = False
+        while not stopping:
+            try:
+                items = [self._queue.get(timeout=1.0)]
+            except queue.Empty:
+                items = []
+            while items and len(items) < self.batch_size:
+                try:
+                    items.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if _STOP in items:
+                stopping = True
+                items = [item for item in items if item is not _STOP]
+
+            try:
+                if items:
+                    connection.executemany(_INSERT, [(record.timestamp, record.program, record.level,
+                                                      record.encounter, record.message) for record in items])
+                    connection.commit()
+                if time.monotonic() >= next_compaction:
+                    next_compaction = time.monotonic() + self.compact_interval
+                    deleted = self.compact(connection)
+                    if deleted:
+                        logger.info(f'Deleted {deleted} old log records.')
+            except sqlite3.Error as e:
+                # Losing some log lines is better than stopping the program that logged them.
+                logger.error(f'Failed to write {len(items)} log records: {e}')
+                connection.rollback()
+        connection.close()
@@ -0,0 +1,31 @@
+import logging
+from logging import LogRecord
+from typing import Union, Dict, Optional
+
+from .log_store import LogStore, StoredLogRecord
+
+_exception_formatter = logging.Formatter()
+
+
+class StoringLogHandler(logging.Handler):
+    """
+    A handler that writes log records to a LogStore.
+
+    Programs counting encounters pass the current one as extra={'encounter': number}. The records logged after it
+    by the same program are stored with that encounter as well, until the program passes another one.
+    """
+
+    def __init__(self, store: LogStore, level: Union[int, str]):
+        super(StoringLogHandler, self).__init__(level)
+        self.store: LogStore = store
+        self._encounters: Dict[str, Optional[int]] = {}
+
+    def emit(self, record: LogRecord) -> None:
+        encounter = getattr(record, 'encounter', None)
+        if encounter is not None:
+            self._encounters[record.name] = encounter
+        message = record.getMessage()
+        if record.exc_info:
+            message = f'{message}\n{_exception_formatter.formatException(record.exc_info)}'
+        self.store.append(StoredLogRecord(timestamp=record.created, program=record.name, level=record.levelno,
+                                          encounter=self._encounters.get(record.name), message=message))
@@ -0,0 +1,57 @@
+import asyncio
+
+from benchmarks.fake_controller import FakeController
+from switchbot.bot.serial_connector import SerialConnector, ConnectionState
+
+# The first firmware version that can store and play macros.
+FIRMWARE_VERSION = 3
+
+
+async def wait_until_received(controller: FakeController, command_type: str) -> None:
+    while controller.command_types[command_type] == 0:
+        await asyncio.sleep(0.01)
+
+
+def test_losing_the_connection_while_waiting_for_a_response():
+    async def run() -> None:
+        controller = FakeController(FIRMWARE_VERSION)
+        controller.start()
+        serial = SerialConnector()
+        try:
+            serial.connect(controller.port)
+            # The fake controller never reports that a macro finished, so this waits until the port is dropped.
+            playing = asyncio.ensure_future(serial.play_uploaded_macro(timeout=5.0))
+            await asyncio.wait_for(wait_until_received(controller, 'P'), 1.0)
+
+            serial.mark_connection_lost('Port disappeared')
+            assert serial.connection_state == ConnectionState.RECONNECTING
+            assert await asyncio.wait_for(playing, 1.0) is False
+        finally:
+            serial.disconnect()
+            controller.stop()
+
+    asyncio.run(run())
+
+
+def test_request_is_not_sent_again_after_reconnecting():
+    async def run() -> None:
+        controller = FakeController(FIRMWARE_VERSION)
+        controller.start()
+        serial = SerialConnector()
+        try:
+            serial.connect(controller.port)
+            playing = asyncio.ensure_future(serial.play_uploaded_macro(timeout=5.0))
+            # Let the request be submitted, it may or may not be written before the port is dropped.
+            await asyncio.sleep(0)
+
+            serial.mark_connection_lost('Port disappeared')
+            assert await asyncio.wait_for(playing, 1.0) is False
+            await serial.reconnect()
+            assert serial.connection_state == ConnectionState.CONNECTED
+            await asyncio.sleep(0.2)
+            assert controller.command_types['P'] <= 1
+        finally:
+            serial.disconnect()
+            controller.stop()
+
+    asyncio.run(run())
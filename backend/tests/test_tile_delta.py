@@ -0,0 +1,113 @@
+from typing import Optional, List
+
+import cv2
+import numpy as np
+
+from switchbot.bot.frame_grabber import Frame
+from switchbot.server.messages.tile_delta_message import TileDeltaMessage
+from switchbot.server.tile_delta import TileDeltaEncoder
+
+WIDTH = 320
+HEIGHT = 192
+JPEG_QUALITY = 90
+
+
+class TileDeltaDecoder:
+    """
+    Reconstructs frames from TileDeltaMessages the way clients do.
+    """
+
+    def __init__(self):
+        self.frame: Optional[np.ndarray] = None
+
+    def apply(self, message: TileDeltaMessage) -> Optional[np.ndarray]:
+        """
+        :return: The reconstructed frame or None if no keyframe was received yet.
+        """
+        if message.is_keyframe:
+            self.frame = cv2.imdecode(np.frombuffer(message.tiles[0].image, dtype=np.uint8), cv2.IMREAD_COLOR)
+        elif self.frame is None or self.frame.shape[:2] != (message.height, message.width):
+            return None
+        else:
+            for tile in message.tiles:
+                tile_image = cv2.imdecode(np.frombuffer(tile.image, dtype=np.uint8), cv2.IMREAD_COLOR)
+                tile_height, tile_width = tile_image.shape[:2]
+                self.frame[tile.y:tile.y + tile_height, tile.x:tile.x + tile_width] = tile_image
+        return self.frame
+
+
+def make_frame(sequence: int) -> Frame:
+    """
+    A smooth background with a square moving across it, which only changes a few tiles from frame to frame.
+    """
+    gradient = np.tile(np.linspace(40, 200, WIDTH, dtype=np.uint8), (HEIGHT, 1))
+    image = cv2.merge([gradient, gradient[::-1], np.full_like(gradient, 90)])
+    x = 10 + sequence * 12
+    cv2.rectangle(image, (x, 60), (x + 40, 100), (255, 255, 255), thickness=-1)
+    return Frame(image=image, sequence=sequence, timestamp=float(sequence))
+
+
+def assert_matches(reconstructed: np.ndarray, expected: np.ndarray) -> None:
+    assert reconstructed.shape == expected.shape
+    difference = cv2.absdiff(reconstructed, expected)
+    # JPEG artifacts and changes below the encoder's pixel threshold are allowed, missing tiles are not.
+    assert difference.mean() < 3.0
+    assert np.percentile(difference, 99.9) < 40
+
+
+def test_round_trip_reconstructs_frames():
+    encoder = TileDeltaEncoder(keyframe_interval=1000.0)
+    decoder = TileDeltaDecoder()
+    messages: List[TileDeltaMessage] = []
+
+    for sequence in range(1, 21):
+        if sequence == 10:
+            encoder.force_keyframe()
+        frame = make_frame(sequence)
+        message = encoder.encode(frame, scale=1.0, jpeg_quality=JPEG_QUALITY)
+        messages.append(message)
+        # Decode what was actually sent.
+        reconstructed = decoder.apply(TileDeltaMessage.from_bytes(message.to_bytes()))
+        assert_matches(reconstructed, frame.image)
+
+    assert [index + 1 for index, message in enumerate(messages) if message.is_keyframe] == [1, 10]
+    # Only the tiles around the moving square are sent in between keyframes.
+    assert all(0 < len(message.tiles) < 12 for message in messages if not message.is_keyframe)
+
+
+def test_deltas_are_ignored_until_a_keyframe_arrives():
+    encoder = TileDeltaEncoder(keyframe_interval=1000.0)
+    keyframe = encoder.encode(make_frame(1), scale=1.0, jpeg_quality=JPEG_QUALITY)
+    delta = encoder.encode(make_frame(2), scale=1.0, jpeg_quality=JPEG_QUALITY)
+    assert keyframe.is_keyframe and not delta.is_keyframe
+
+    decoder = TileDeltaDecoder()
+    assert decoder.apply(delta) is None
+    assert_matches(decoder.apply(keyframe), make_frame(1).image)
+
+
+def test_large_changes_are_sent_as_keyframe():
+    encoder = TileDeltaEncoder(keyframe_interval=1000.0)
+    decoder = TileDeltaDecoder()
+    decoder.apply(encoder.encode(make_frame(1), scale=1.0, jpeg_quality=JPEG_QUALITY))
+
+    inverted = Frame(image=255 - make_frame(2).image, sequence=2, timestamp=2.0)
+    message = encoder.encode(inverted, scale=1.0, jpeg_quality=JPEG_QUALITY)
+    assert message.is_keyframe
+    assert_matches(decoder.apply(message), inverted.image)
+
+
+def test_unchanged_frames_are_not_sent():
+    encoder = TileDeltaEncoder(keyframe_interval=1000.0)
+    assert encoder.encode(make_frame(1), scale=1.0, jpeg_quality=JPEG_QUALITY).is_keyframe
+    assert encoder.encode(make_frame(1), scale=1.0, jpeg_quality=JPEG_QUALITY) is None
+
+
+def test_reference_matches_what_clients_display():
+    encoder = TileDeltaEncoder(keyframe_interval=1000.0)
+    decoder = TileDeltaDecoder()
+    for sequence in range(1, 6):
+        message = encoder.encode(make_frame(sequence), scale=1.0, jpeg_quality=JPEG_QUALITY)
+        reconstructed = decoder.apply(TileDeltaMessage.from_bytes(message.to_bytes()))
+        # Otherwise the JPEG artifacts of the sent tiles are never compared against and build up on the clients.
+        assert np.array_equal(encoder._reference, reconstructed)
@@ -172,7 +172,8 @@ bool CommandExecutor::doStickCommand(const char* command)
         return false;
     }
 
-    double y = strtod(endOfToken, &endOfToken);
+    // Skip the comma, strtod does not and would stop right at it.
+    double y = strtod(endOfToken + 1, &endOfToken);
     // Check whether the second number marks the end of the command by being followed by a null byte.
     if (*endOfToken != '\0')
     {
@@ -207,7 +208,9 @@ bool CommandExecutor::doStickCommand(const char* command)
 
 void CommandExecutor::printVersion() const
 {
-    backend.println("SwitchBot controller version 1");
+    // Version 2 and later understand binary controller reports, version 3 and later macros and version 4 and later
+    // acknowledge commands. Version 5 and later report lost commands and confirm K1.
+    backend.println("SwitchBot controller version 5");
 }
 
 void CommandExecutor::setLeftStick(byte x, byte y)
@@ -246,10 +249,239 @@ bool CommandExecutor::executeCommandFromBuffer(const char* buffer)
     case 'S':
         return doStickCommand(&buffer[1]);
     case 'V':
+        // The host asks for the version whenever it connects, after which its report sequence starts over.
+        hasReceivedReport = false;
         printVersion();
         return true;
+    case 'P':
+        return doPlayMacroCommand();
+    case 'Q':
+        return doStopMacroCommand();
+    case 'K':
+        return doAckModeCommand(&buffer[1]);
     default:
         // Invalid command prefix, ignore.
         return false;
     }
 }
+
+bool CommandExecutor::executeReport(const uint8_t* report)
+{
+    uint8_t checksum = 0;
+    for (size_t i = 0; i < REPORT_SIZE - 1; i++)
+    {
+        checksum += report[i];
+    }
+    if (report[0] != REPORT_START_BYTE || checksum != report[REPORT_SIZE - 1])
+    {
+        return false;
+    }
+
+    const uint8_t sequence = report[1];
+    if (isAckModeEnabled)
+    {
+        const int8_t difference = compareToExpectedSequence(sequence);
+        if (difference == 0)
+        {
+            expectedSequence++;
+            applyState(&report[2]);
+            acknowledge(sequence, true);
+        }
+        else
+        {
+            // Either already executed and the host probably missed the acknowledgement, or a command before this one
+            // was lost. Acknowledging the last executed command again tells the host where to continue.
+            acknowledge(expectedSequence - 1, true);
+        }
+        return true;
+    }
+
+    // Ignore reports that are not newer than the last one, such as duplicates.
+    if (hasReceivedReport && static_cast<int8_t>(sequence - lastReportSequence) <= 0)
+    {
+        return false;
+    }
+    hasReceivedReport = true;
+    lastReportSequence = sequence;
+
+    applyState(&report[2]);
+    return true;
+}
+
+void CommandExecutor::applyState(const uint8_t* state)
+{
+    const uint16_t buttons = state[0] | (state[1] << 8);
+    for (uint8_t button = Y; button <= CAPTURE; button++)
+    {
+        if (buttons & (1 << button))
+        {
+            joystick.pressButton(button);
+        }
+        else
+        {
+            joystick.releaseButton(button);
+        }
+    }
+
+    // 0 to 7 are the directions in steps of 45 degrees, anything else is neutral.
+    const uint8_t hat = state[2];
+    joystick.setHatSwitch(hat < 8 ? hat * 45 : -1);
+
+    setLeftStick(state[3], state[4]);
+    setRightStick(state[5], state[6]);
+}
+
+bool CommandExecutor::doAckModeCommand(const char* command)
+{
+    if (command[0] == '1' && command[1] == '\0')
+    {
+        // Also used by the host to start over after giving up on a command. Acknowledgements printed before the
+        // confirmation belong to the commands it gave up on.
+        isAckModeEnabled = true;
+        expectedSequence = 0;
+        backend.println("K1 OK");
+        return true;
+    }
+    if (command[0] == '0' && command[1] == '\0')
+    {
+        isAckModeEnabled = false;
+        return true;
+    }
+    return false;
+}
+
+bool CommandExecutor::executeSequencedCommand(const char* buffer)
+{
+    char* endOfSequence;
+    const unsigned long sequence = strtoul(&buffer[1], &endOfSequence, 10);
+    if (!isAckModeEnabled || endOfSequence == &buffer[1] || sequence > 255)
+    {
+        return false;
+    }
+
+    const int8_t difference = compareToExpectedSequence(static_cast<uint8_t>(sequence));
+    if (difference < 0)
+    {
+        // Already executed, the host probably missed the acknowledgement.
+        acknowledge(expectedSequence - 1, true);
+        return true;
+    }
+    if (difference > 0)
+    {
+        // A command before this one was lost. Acknowledging the last executed command again tells the host to send
+        // the lost one and everything after it right away.
+        acknowledge(expectedSequence - 1, true);
+        return true;
+    }
+
+    expectedSequence++;
+    acknowledge(static_cast<uint8_t>(sequence), executeCommandFromBuffer(endOfSequence));
+    return true;
+}
+
+int8_t CommandExecutor::compareToExpectedSequence(uint8_t sequence) const
+{
+    // The host never has more than 127 commands in flight, so the difference can't be ambiguous.
+    return static_cast<int8_t>(sequence - expectedSequence);
+}
+
+void CommandExecutor::acknowledge(uint8_t sequence, bool wasValid)
+{
+    // Acknowledgements are cumulative: they also confirm all commands before this one.
+    backend.print(wasValid ? 'K' : 'N');
+    backend.println(sequence);
+}
+
+bool CommandExecutor::receiveMacroByte(uint8_t value)
+{
+    if (macroUploadIndex == 0)
+    {
+        // The new macro overwrites the old one, so it can't be played anymore.
+        isPlayingMacro = false;
+        macroStepCount = 0;
+    }
+    macroData[macroUploadIndex++] = value;
+    if (macroUploadIndex <= MACRO_HEADER_SIZE)
+    {
+        return false;
+    }
+
+    const size_t stepCount = macroData[1];
+    if (stepCount == 0 || stepCount > MAX_MACRO_STEPS)
+    {
+        macroUploadIndex = 0;
+        backend.println("Macro rejected");
+        return true;
+    }
+    const size_t macroSize = MACRO_HEADER_SIZE + stepCount * MACRO_STEP_SIZE + 1;
+    if (macroUploadIndex < macroSize)
+    {
+        return false;
+    }
+
+    macroUploadIndex = 0;
+    uint8_t checksum = 0;
+    for (size_t i = 0; i < macroSize - 1; i++)
+    {
+        checksum += macroData[i];
+    }
+    if (checksum != macroData[macroSize - 1])
+    {
+        backend.println("Macro rejected");
+        return true;
+    }
+
+    macroStepCount = stepCount;
+    backend.print("Macro stored: ");
+    backend.println(macroStepCount);
+    return true;
+}
+
+bool CommandExecutor::doPlayMacroCommand()
+{
+    if (macroStepCount == 0)
+    {
+        return false;
+    }
+    nextMacroStep = 0;
+    lastMacroStepMillis = millis();
+    isPlayingMacro = true;
+    return true;
+}
+
+bool CommandExecutor::doStopMacroCommand()
+{
+    if (!isPlayingMacro)
+    {
+        return false;
+    }
+    isPlayingMacro = false;
+    backend.println("Macro stopped");
+    return true;
+}
+
+void CommandExecutor::updateMacro()
+{
+    if (!isPlayingMacro)
+    {
+        return;
+    }
+
+    const unsigned long now = millis();
+    while (nextMacroStep < macroStepCount)
+    {
+        const uint8_t* step = &macroData[MACRO_HEADER_SIZE + nextMacroStep * MACRO_STEP_SIZE];
+        const uint16_t delayMillis = step[0] | (step[1] << 8);
+        if (now - lastMacroStepMillis < delayMillis)
+        {
+            return;
+        }
+        // Relative to when the previous step was due rather than when it was executed, so delays don't add up.
+        lastMacroStepMillis += delayMillis;
+        applyState(&step[2]);
+        nextMacroStep++;
+    }
+
+    isPlayingMacro = false;
+    backend.println("Macro finished");
+}
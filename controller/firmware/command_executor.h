@@ -9,18 +9,63 @@ public:
 
     // The delay between holding down and releasing a button again when simulating a press.
     static const unsigned int PRESS_DELAY_MILLIS = 50;
+    // The first byte of a binary controller report. Text commands never start with this byte.
+    static const uint8_t REPORT_START_BYTE = 0xA5;
+    // Start byte, sequence number, 2 bytes of buttons, hat, 4 stick axes and checksum.
+    static const size_t REPORT_SIZE = 10;
+    // The first byte of an uploaded macro. Text commands never start with this byte.
+    static const uint8_t MACRO_START_BYTE = 0xA6;
+    // Start byte and step count.
+    static const size_t MACRO_HEADER_SIZE = 2;
+    // 2 bytes of delay, 2 bytes of buttons, hat and 4 stick axes.
+    static const size_t MACRO_STEP_SIZE = 9;
+    static const size_t MAX_MACRO_STEPS = 64;
+    // Header, steps and checksum.
+    static const size_t MAX_MACRO_SIZE = MACRO_HEADER_SIZE + MAX_MACRO_STEPS * MACRO_STEP_SIZE + 1;
+    // Text commands starting with this character are preceded by a sequence number and acknowledged.
+    static const char SEQUENCE_PREFIX = '#';
 
     bool executeCommandFromBuffer(const char* buffer);
+    bool executeReport(const uint8_t* report);
+    // Executes a command of the form #<sequence><command> and acknowledges it. Returns false if it is malformed.
+    bool executeSequencedCommand(const char* buffer);
+    // Feeds the next byte of an uploaded macro, starting with the start byte.
+    // Returns true once the macro is complete, no matter whether it was valid.
+    bool receiveMacroByte(uint8_t value);
+    // Executes the steps of the playing macro that are due. Must be called on every iteration of the main loop.
+    void updateMacro();
 
 private:
     SwitchJoystick_& joystick;
     HardwareSerial& backend;
+    bool hasReceivedReport = false;
+    uint8_t lastReportSequence = 0;
+
+    // In ack mode, sequenced commands and reports are only executed in order and acknowledged.
+    bool isAckModeEnabled = false;
+    uint8_t expectedSequence = 0;
+
+    uint8_t macroData[MAX_MACRO_SIZE];
+    size_t macroUploadIndex = 0;
+    size_t macroStepCount = 0;
+    size_t nextMacroStep = 0;
+    bool isPlayingMacro = false;
+    // The time the last executed step was due, the delay of the next step is relative to it.
+    unsigned long lastMacroStepMillis = 0;
 
     bool doTapCommand(const char* command);
     bool doHoldCommand(const char* command);
     bool doStickCommand(const char* command);
     bool doReleaseCommand(const char* command);
+    bool doAckModeCommand(const char* command);
+    bool doPlayMacroCommand();
+    bool doStopMacroCommand();
     void printVersion() const;
+    void applyState(const uint8_t* state);
+    // Returns 0 if the sequence number is the expected one, a negative number for duplicates and a positive one
+    // if commands before it were lost.
+    int8_t compareToExpectedSequence(uint8_t sequence) const;
+    void acknowledge(uint8_t sequence, bool wasValid);
     void setLeftStick(byte, byte);
     void setRightStick(byte, byte);
 };
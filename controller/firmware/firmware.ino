@@ -15,6 +15,11 @@ const size_t MAX_COMMAND_LENGTH = 32;
 char commandBuffer[MAX_COMMAND_LENGTH];
 size_t currentIndex = 0;
 
+uint8_t reportBuffer[CommandExecutor::REPORT_SIZE];
+size_t reportIndex = 0;
+bool isReadingReport = false;
+bool isReadingMacro = false;
+
 // The "center" value for a joystick axis.
 const uint8_t AXIS_NEUTRAL = 128;
 
@@ -53,6 +58,9 @@ void resetCommandBuffer()
 
 void loop()
 {
+  // Macros are played without blocking so commands can still be received while one is playing.
+  executor->updateMacro();
+
   while (BackendSerial.available() > 0)
   {
     int receivedData = BackendSerial.read();
@@ -62,6 +70,41 @@ void loop()
       continue;
     }
 
+    // Binary reports start with a byte that can never start a text command, so both can be mixed freely.
+    if (isReadingReport)
+    {
+      reportBuffer[reportIndex++] = static_cast<uint8_t>(receivedData);
+      if (reportIndex == CommandExecutor::REPORT_SIZE)
+      {
+        // Don't print anything for valid reports, they are sent far more often than text commands.
+        if (!executor->executeReport(reportBuffer))
+        {
+          BackendSerial.println("CommandExecutor ignored invalid report.");
+        }
+        isReadingReport = false;
+        reportIndex = 0;
+      }
+      continue;
+    }
+    if (isReadingMacro)
+    {
+      isReadingMacro = !executor->receiveMacroByte(static_cast<uint8_t>(receivedData));
+      continue;
+    }
+    if (currentIndex == 0 && receivedData == CommandExecutor::MACRO_START_BYTE)
+    {
+      executor->receiveMacroByte(static_cast<uint8_t>(receivedData));
+      isReadingMacro = true;
+      continue;
+    }
+    if (currentIndex == 0 && receivedData == CommandExecutor::REPORT_START_BYTE)
+    {
+      reportBuffer[0] = static_cast<uint8_t>(receivedData);
+      reportIndex = 1;
+      isReadingReport = true;
+      continue;
+    }
+
     char receivedChar = static_cast<char>(receivedData);
     // If the command is invalid because it is too long, ignore it.
     if (currentIndex >= MAX_COMMAND_LENGTH - 1)
@@ -80,6 +123,16 @@ void loop()
       }
 
       commandBuffer[currentIndex] = '\0';
+      // Sequenced commands are acknowledged instead of printing diagnostics, which would only slow them down.
+      if (commandBuffer[0] == CommandExecutor::SEQUENCE_PREFIX)
+      {
+        if (!executor->executeSequencedCommand(commandBuffer))
+        {
+          BackendSerial.println("CommandExecutor ignored invalid command.");
+        }
+        resetCommandBuffer();
+        continue;
+      }
       BackendSerial.print("Executing command: ");
       BackendSerial.println(commandBuffer);
       bool wasValid = executor->executeCommandFromBuffer(commandBuffer);